@@ -1,66 +1,291 @@
-import requests
+import argparse
+import asyncio
+import json
+import random
 import time
+
+import httpx
 import numpy as np
-import argparse
-from tqdm import tqdm
+
+# The percentiles of the latencies to report
+PERCENTILES = [50, 95, 99, 99.9]
+
+
+def parse_mix(text):
+    """
+    Parse the weights of the scenarios in key=value format (e.g., "sensor_write=5,player_list=2,actuator_poll=3").
+
+    Parameters
+
+    - text (string): The weights (comma-separated key-value pairs).
+
+    Returns
+
+    - A dictionary of scenario names to weights.
+    """
+    return {name: float(weight) for name, weight in (pair.split("=") for pair in text.split(","))}
+
+
+def build_scenarios(args):
+    """
+    Build the scenarios. Each scenario is a function that returns the endpoint, the URL and the parameters of the next
+    request.
+
+    Parameters
+
+    - args (Namespace): The command line arguments.
+
+    Returns
+
+    - A dictionary of scenario names to functions.
+    """
+    base_url = args.base_url.rstrip("/")
+    return {
+        # A sensor writing a new value of an attribute
+        "sensor_write": lambda: (
+            "/update_attribute",
+            f"{base_url}/update_attribute",
+            {
+                "item_id": args.item_id,
+                "attribute": f"{args.attribute}={random.randint(0, 1000)}",
+                "api_key": args.sensor_key,
+            },
+        ),
+        # A player listing the items in a location
+        "player_list": lambda: (
+            "/list_items",
+            f"{base_url}/list_items",
+            {"location_id": args.location_id, "max_items": args.max_items, "api_key": args.player_key},
+        ),
+        # An actuator polling an attribute
+        "actuator_poll": lambda: (
+            "/get_attribute",
+            f"{base_url}/get_attribute",
+            {"item_id": args.item_id, "attribute": args.attribute, "api_key": args.actuator_key},
+        ),
+        # A full URL with parameters given on the command line
+        "url": lambda: (httpx.URL(args.api_url).path, args.api_url, None),
+    }
+
+
+async def send(client, scenario, next_request, intended_start, semaphore, samples):
+    # Send a request and record its latency from the time it was sent (service time) and from the time it should have
+    # been sent (corrected for coordinated omission, i.e., including the time spent waiting for a free connection)
+    endpoint, url, params = next_request()
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            response = await client.get(url, params=params)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        end = time.perf_counter()
+    samples.append(
+        {
+            "scenario": scenario,
+            "endpoint": endpoint,
+            "status": status,
+            "service_time": end - start,
+            "corrected_time": end - intended_start,
+        }
+    )
 
 
-def measure_api_performance(api_url, num_requests=100, interval=0.1):
-    # List to store response times
-    response_times = []
+async def run_load(args, scenarios, mix):
+    """
+    Send the requests and collect the samples.
 
-    # List to accumulate error messages
-    errors = []
+    With --rps (open loop), the requests are sent at a fixed rate regardless of the responses, and the corrected
+    latency is measured from the scheduled time of each request. Otherwise (closed loop), --concurrency clients send
+    requests back to back, and the corrected latency equals the service time.
 
-    # Using tqdm to display a progress bar
-    for _ in tqdm(range(num_requests), desc="Testing API", position=0, leave=True):
-        # Record start time
-        start_time = time.time()
+    Parameters
 
-        # Make the request
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            errors.append(f"Request #{_ + 1} failed with status code {response.status_code}")
+    - args (Namespace): The command line arguments.
+    - scenarios (dict): The scenarios (see build_scenarios).
+    - mix (dict): The weights of the scenarios.
+
+    Returns
+
+    - A tuple (samples, elapsed time in seconds).
+    """
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    def requests_left(sent):
+        return time.perf_counter() < deadline and (args.num_requests is None or sent < args.num_requests)
+
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        if args.rps:
+            # Schedule the requests at a fixed interval
+            tasks = []
+            while requests_left(len(tasks)):
+                intended_start = start + len(tasks) / args.rps
+                await asyncio.sleep(max(0, intended_start - time.perf_counter()))
+                scenario = random.choices(names, weights)[0]
+                tasks.append(
+                    asyncio.create_task(
+                        send(client, scenario, scenarios[scenario], intended_start, semaphore, samples)
+                    )
+                )
+            await asyncio.gather(*tasks)
+        else:
+            # Send the requests back to back from each client
+            sent = [0]
+
+            async def worker():
+                while requests_left(sent[0]):
+                    sent[0] += 1
+                    scenario = random.choices(names, weights)[0]
+                    await send(client, scenario, scenarios[scenario], time.perf_counter(), semaphore, samples)
+
+            await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+
+    return samples, time.perf_counter() - start
+
+
+def summarize(samples, elapsed):
+    """
+    Summarize the samples per scenario and in total. Failed requests are included in the latencies.
+
+    Parameters
+
+    - samples (list): The samples (see send).
+    - elapsed (float): The duration of the run in seconds.
+
+    Returns
+
+    - A dictionary of scenario names (and "total") to their statistics.
+    """
+    groups = {}
+    for sample in samples:
+        groups.setdefault(sample["scenario"], []).append(sample)
+    groups["total"] = samples
+
+    summary = {}
+    for name, group in groups.items():
+        if len(group) == 0:
             continue
+        statuses = {}
+        for sample in group:
+            statuses[sample["status"]] = statuses.get(sample["status"], 0) + 1
+        errors = sum(count for status, count in statuses.items() if not status.startswith("2"))
+        service_times = np.array([sample["service_time"] for sample in group]) * 1000
+        corrected_times = np.array([sample["corrected_time"] for sample in group]) * 1000
+        summary[name] = {
+            "endpoint": group[0]["endpoint"] if name != "total" else None,
+            "requests": len(group),
+            "errors": errors,
+            "error_rate": errors / len(group),
+            "throughput": len(group) / elapsed,
+            "statuses": statuses,
+            "latency_ms": {f"p{p:g}": float(np.percentile(service_times, p)) for p in PERCENTILES},
+            "corrected_latency_ms": {f"p{p:g}": float(np.percentile(corrected_times, p)) for p in PERCENTILES},
+        }
+        summary[name]["latency_ms"]["max"] = float(service_times.max())
+        summary[name]["corrected_latency_ms"]["max"] = float(corrected_times.max())
+    return summary
 
-        # Record end time
-        end_time = time.time()
 
-        # Calculate response time and add to list
-        response_times.append(end_time - start_time)
+def print_summary(summary, baseline=None):
+    """
+    Print the statistics as a table, with the changes from a baseline if given.
 
-        # Sleep for the interval (if set)
-        if interval:
-            time.sleep(interval)
+    Parameters
 
-    # Print accumulated error messages after progress bar is complete
-    for error in errors:
-        print(error)
+    - summary (dict): The statistics (see summarize).
+    - baseline (dict): The statistics of a previous run (optional).
+    """
+    print(
+        f"{'scenario':<16}{'requests':>9}{'errors':>8}{'req/s':>9}"
+        + "".join(f"{f'p{p:g}':>10}" for p in PERCENTILES)
+        + "".join(f"{f'p{p:g}*':>10}" for p in PERCENTILES)
+    )
+    for name, stats in summary.items():
+        print(
+            f"{name:<16}{stats['requests']:>9}{stats['error_rate']:>8.1%}{stats['throughput']:>9.1f}"
+            + "".join(f"{value:>10.1f}" for key, value in stats["latency_ms"].items() if key != "max")
+            + "".join(f"{value:>10.1f}" for key, value in stats["corrected_latency_ms"].items() if key != "max")
+        )
+        if stats["errors"] > 0:
+            statuses = stats["statuses"].items()
+            print(f"{'':<16}errors: " + ", ".join(f"{s} x {n}" for s, n in statuses if not s.startswith("2")))
+        if baseline is not None and name in baseline:
+            base = baseline[name]
+            changes = [f"req/s {change(base['throughput'], stats['throughput'])}"] + [
+                f"{key} {change(base['latency_ms'][key], stats['latency_ms'][key])}"
+                for key in stats["latency_ms"]
+                if key != "max" and key in base["latency_ms"]
+            ]
+            print(f"{'':<16}vs baseline: " + ", ".join(changes))
+    print("Latencies in milliseconds (* corrected for coordinated omission). Failed requests are included.")
 
-    # Calculate statistics
-    min_time = min(response_times)
-    max_time = max(response_times)
-    avg_time = np.mean(response_times)
-    std_dev = np.std(response_times)
 
-    return min_time, max_time, avg_time, std_dev
+def change(before, after):
+    # Format the relative change between two values (e.g., "+12.5%")
+    return f"{(after - before) / before:+.1%}" if before else "n/a"
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Measure API performance")
-    parser.add_argument("api_url", type=str, help="API URL to be tested")
-    parser.add_argument("--num_requests", type=int, default=100, help="Number of requests to make. Default is 100.")
+    parser = argparse.ArgumentParser(description="Measure API performance under concurrent load")
+    parser.add_argument("api_url", type=str, nargs="?", help="API URL to be tested (runs the url scenario)")
+    parser.add_argument("--base_url", type=str, default="http://127.0.0.1:5000", help="Base URL of the scenarios.")
     parser.add_argument(
-        "--interval", type=float, default=0.1, help="Interval between requests in seconds. Default is 0.1 seconds."
+        "--mix",
+        type=str,
+        default=None,
+        help="Weights of the scenarios (sensor_write, player_list, actuator_poll, url), e.g., "
+        "sensor_write=5,player_list=2,actuator_poll=3. Default is url=1 if api_url is given.",
     )
+    parser.add_argument("--concurrency", type=int, default=10, help="Maximum concurrent requests. Default is 10.")
+    parser.add_argument("--rps", type=float, default=None, help="Target requests per second (open loop, optional).")
+    parser.add_argument("--duration", type=float, default=30, help="Duration in seconds. Default is 30 seconds.")
+    parser.add_argument("--num_requests", type=int, default=None, help="Number of requests to make (optional).")
+    parser.add_argument("--timeout", type=float, default=10, help="Timeout of a request in seconds. Default is 10.")
+    parser.add_argument("--location_id", type=str, help="Location of the player_list scenario.")
+    parser.add_argument("--max_items", type=int, default=100, help="max_items of the player_list scenario.")
+    parser.add_argument("--item_id", type=str, help="Item of the sensor_write and actuator_poll scenarios.")
+    parser.add_argument("--attribute", type=str, default="state", help="Attribute of the item. Default is state.")
+    parser.add_argument("--sensor_key", type=str, help="API key of the sensor_write scenario (API_KEY_SENSOR).")
+    parser.add_argument("--player_key", type=str, help="API key of the player_list scenario (API_KEY_PLAYER).")
+    parser.add_argument("--actuator_key", type=str, help="API key of the actuator_poll scenario (API_KEY_ACTUATOR).")
+    parser.add_argument("--output", type=str, default=None, help="Save the results to a JSON file (optional).")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare with the results of a JSON file.")
 
     args = parser.parse_args()
 
-    min_time, max_time, avg_time, std_dev = measure_api_performance(args.api_url, args.num_requests, args.interval)
-    print(f"\nMinimum Time: {min_time}")
-    print(f"Maximum Time: {max_time}")
-    print(f"Average Time: {avg_time}")
-    print(f"Standard Deviation: {std_dev}")
+    # Check the scenarios
+    if args.mix is None and args.api_url is None:
+        parser.error("specify api_url or --mix")
+    mix = parse_mix(args.mix) if args.mix is not None else {"url": 1}
+    scenarios = build_scenarios(args)
+    for name in mix:
+        if name not in scenarios:
+            parser.error(f"unknown scenario: {name}")
+    if "url" in mix and args.api_url is None:
+        parser.error("the url scenario requires api_url")
+
+    samples, elapsed = asyncio.run(run_load(args, scenarios, mix))
+    if len(samples) == 0:
+        parser.error("no requests were sent")
+    summary = summarize(samples, elapsed)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["summary"]
+    print_summary(summary, baseline)
+
+    # Save the settings and the statistics so that runs can be compared
+    if args.output is not None:
+        settings = {key: value for key, value in vars(args).items() if not key.endswith("_key")}
+        with open(args.output, "w") as f:
+            json.dump({"settings": settings, "elapsed": elapsed, "summary": summary}, f, indent=2)
 
 
 if __name__ == "__main__":
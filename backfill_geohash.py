@@ -0,0 +1,75 @@
+import argparse
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from server import db, item_geohash
+
+# The maximum number of writes in a single batch
+BATCH_SIZE = 500
+
+
+def backfill_geohash(dry_run=False):
+    """
+    Store the geohash of every item in an OUTDOOR location that has no geohash (or an outdated one), so that
+    list_items can query OUTDOOR items by position (see GEOHASH_PREFILTER in server.py).
+
+    Parameters:
+    - dry_run: bool, Count the items to update without writing them
+
+    Returns:
+    - tuple, The number of items checked and the number of items updated
+    """
+    checked = 0
+    updated = 0
+
+    locations = db.collection("locations").where(filter=FieldFilter("type", "==", "OUTDOOR")).stream()
+    for location_doc in locations:
+        location = location_doc.to_dict()
+
+        # Read only the fields needed to calculate the geohash
+        items = (
+            db.collection("items")
+            .where(filter=FieldFilter("location_id", "==", location["location_id"]))
+            .select(["coordinates", "geohash"])
+            .stream()
+        )
+
+        # Update the items in batches
+        batch = db.batch()
+        batch_size = 0
+        for item in items:
+            checked += 1
+            item_data = item.to_dict()
+            geohash = item_geohash(location, item_data.get("coordinates"))
+            if geohash is None or item_data.get("geohash") == geohash:
+                continue
+
+            updated += 1
+            if dry_run:
+                continue
+            batch.update(item.reference, {"geohash": geohash})
+            batch_size += 1
+            if batch_size == BATCH_SIZE:
+                batch.commit()
+                batch = db.batch()
+                batch_size = 0
+
+        if batch_size > 0:
+            batch.commit()
+
+    return checked, updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store the geohash of existing OUTDOOR items")
+    parser.add_argument("--dry_run", action="store_true", help="Count the items to update without writing them.")
+
+    args = parser.parse_args()
+
+    checked, updated = backfill_geohash(args.dry_run)
+    print(f"Checked Items: {checked}")
+    print(f"{'Items To Update' if args.dry_run else 'Updated Items'}: {updated}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+# import necessary libraries
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+# This script measures the server-side cost of every endpoint without the network: the requests are sent through the
+# Flask test client to a server that uses the in-process storage engine (see storage.py). Each endpoint is measured
+# against locations seeded with 10, 1k and 100k items, and the latency and the memory allocated by each request are
+# compared with a baseline saved by a previous run. The datasets are seeded in ascending order of size in the same
+# process, so the larger datasets also include the items of the smaller ones.
+
+# Use the in-process storage engine and fixed API keys (set before importing the server)
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ["TRACING"] = "false"
+os.environ["API_KEY_DESIGNER"] = "benchmark_designer"
+os.environ["API_KEY_PLAYER"] = "benchmark_player"
+os.environ["API_KEY_SENSOR"] = "benchmark_sensor"
+os.environ["API_KEY_ACTUATOR"] = "benchmark_actuator"
+
+import server  # noqa: E402
+
+DESIGNER = server.API_KEY_DESIGNER
+PLAYER = server.API_KEY_PLAYER
+SENSOR = server.API_KEY_SENSOR
+ACTUATOR = server.API_KEY_ACTUATOR
+
+# The number of items in the location of each dataset
+DATASET_SIZES = [10, 1000, 100000]
+
+# The size of the square (in meters) over which the items of a dataset are spread
+DATASET_AREA = 100
+
+# The tags of the items
+TAGS = ["red", "blue"]
+
+# The collections that the benchmarks add documents to (the new documents are deleted after each benchmark)
+SCRATCH_COLLECTIONS = ["items", "locations", "tags"]
+
+# Changes smaller than these are not regressions, whatever the tolerance (timer and allocator noise)
+MIN_LATENCY_CHANGE_MS = 0.05
+MIN_ALLOCATION_CHANGE_KIB = 4
+
+
+def send(client, request_args):
+    # Send a request and read the whole body (including streamed responses)
+    path, params = request_args[0], request_args[1]
+    data = request_args[2] if len(request_args) > 2 else None
+    response = client.open(path, method="POST" if data is not None else "GET", query_string=params, data=data)
+    response.get_data()
+    response.close()
+    if response.status_code != 200:
+        raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def items_csv(rng, count):
+    """
+    Build items in the CSV format of create_items, spread at random over the dataset area.
+
+    Parameters
+
+    - rng (Random): The random number generator.
+    - count (int): The number of items.
+
+    Returns
+
+    - The items in CSV format (with a header).
+    """
+    rows = ["name,type,coordinates,tags,attributes"]
+    for i in range(count):
+        x, y = rng.uniform(0, DATASET_AREA), rng.uniform(0, DATASET_AREA)
+        tags = ",".join(rng.sample(TAGS, rng.randint(0, len(TAGS))))
+        rows.append(f'item{i},BENCHMARK,"{x:.2f},{y:.2f},0","{tags}","state={i % 2},temperature={rng.randint(0, 40)}"')
+    return "\n".join(rows)
+
+
+def document_ids():
+    # Get the ids of the documents in the collections that the benchmarks add documents to
+    return {
+        collection: {reference.id for reference in server.db.collection(collection).list_documents()}
+        for collection in SCRATCH_COLLECTIONS
+    }
+
+
+def delete_new_documents(previous_ids, location_id):
+    # Delete the documents added since document_ids was called, so that every benchmark (and every round of a
+    # benchmark) runs against the same number of documents
+    for collection, ids in previous_ids.items():
+        references = [ref for ref in server.db.collection(collection).list_documents() if ref.id not in ids]
+        for start in range(0, len(references), server.MAX_WRITES_PER_BATCH):
+            batch = server.db.batch()
+            for reference in references[start : start + server.MAX_WRITES_PER_BATCH]:
+                batch.delete(reference)
+            batch.commit()
+    server.spatial_indexes.invalidate(location_id)
+
+
+def seed_dataset(client, size):
+    """
+    Create a location with a number of items (reproducible for a given size).
+
+    Parameters
+
+    - client (FlaskClient): The test client.
+    - size (int): The number of items.
+
+    Returns
+
+    - A dictionary with the location_id, the item_ids, the id of a finished job, and a random number generator.
+    """
+    rng = random.Random(size)
+    response = send(client, ("/create_location", {"name": f"benchmark{size}", "type": "INDOOR", "api_key": DESIGNER}))
+    location_id = response.get_data(as_text=True).split(",")[1]
+
+    # Create the items in chunks of the maximum number of items per request
+    item_ids = []
+    for start in range(0, size, server.MAX_ITEMS_PER_REQUEST):
+        count = min(server.MAX_ITEMS_PER_REQUEST, size - start)
+        params = {"location_id": location_id, "api_key": DESIGNER}
+        response = send(client, ("/create_items", params, items_csv(rng, count)))
+        item_ids.extend(response.get_data(as_text=True).split(",")[1:])
+
+    # Start a job for get_job (deleting the items of an empty location)
+    location = send(client, ("/create_location", {"name": f"job{size}", "type": "INDOOR", "api_key": DESIGNER}))
+    params = {"location_id": location.get_data(as_text=True).split(",")[1], "api_key": DESIGNER}
+    job_id = send(client, ("/delete_items", params)).get_data(as_text=True).split(",")[1]
+
+    return {"location_id": location_id, "item_ids": item_ids, "job_id": job_id, "rng": rng}
+
+
+def build_benchmarks(client, dataset):
+    """
+    Build the benchmarks of a dataset. Each benchmark is a function that prepares a request (e.g., creates the item to
+    delete, which is not measured) and returns its path, its parameters and optionally the body of a POST request.
+    Benchmarks that would change the items of the dataset (e.g., acquire_item) work on new items instead.
+
+    Parameters
+
+    - client (FlaskClient): The test client.
+    - dataset (dict): The dataset (see seed_dataset).
+
+    Returns
+
+    - A dictionary of benchmark names to functions.
+    """
+    location_id, item_ids, rng = dataset["location_id"], dataset["item_ids"], dataset["rng"]
+    size = len(item_ids)
+    new_items = items_csv(rng, 100)
+
+    def random_item():
+        return rng.choice(item_ids)
+
+    def new_item():
+        params = {"location_id": location_id, "name": "new", "type": "BENCHMARK", "coordinates": "1,2,0"}
+        return send(client, ("/create_item", {**params, "api_key": DESIGNER})).get_data(as_text=True).split(",")[1]
+
+    def new_location():
+        params = {"name": f"scratch{uuid.uuid4().hex}", "type": "INDOOR", "api_key": DESIGNER}
+        return send(client, ("/create_location", params)).get_data(as_text=True).split(",")[1]
+
+    def new_tag():
+        name = f"scratch{uuid.uuid4().hex}"
+        send(client, ("/create_tag", {"name": name, "api_key": DESIGNER}))
+        return name
+
+    def position():
+        return f"{rng.uniform(0, DATASET_AREA):.2f},{rng.uniform(0, DATASET_AREA):.2f},0"
+
+    return {
+        "ping": lambda: ("/ping", {}),
+        "create_item": lambda: (
+            "/create_item",
+            {
+                "location_id": location_id,
+                "name": "new",
+                "type": "BENCHMARK",
+                "coordinates": position(),
+                "tags": ",".join(TAGS),
+                "attributes": "state=0",
+                "api_key": DESIGNER,
+            },
+        ),
+        "create_items": lambda: ("/create_items", {"location_id": location_id, "api_key": DESIGNER}, new_items),
+        "delete_item": lambda: ("/delete_item", {"item_id": new_item(), "api_key": DESIGNER}),
+        "update_item": lambda: (
+            "/update_item",
+            {"item_id": random_item(), "coordinates": position(), "attributes": "state=1", "api_key": DESIGNER},
+        ),
+        "get_item": lambda: ("/get_item", {"item_id": random_item(), "api_key": PLAYER}),
+        "get_item_binary": lambda: ("/get_item", {"item_id": random_item(), "format": "binary", "api_key": PLAYER}),
+        "list_items": lambda: ("/list_items", {"location_id": location_id, "api_key": PLAYER}),
+        "list_items_all": lambda: ("/list_items", {"location_id": location_id, "max_items": size, "api_key": PLAYER}),
+        "list_items_json": lambda: (
+            "/list_items",
+            {"location_id": location_id, "max_items": size, "format": "json", "api_key": PLAYER},
+        ),
+        "list_items_tags": lambda: ("/list_items", {"location_id": location_id, "tags": "red", "api_key": PLAYER}),
+        "list_items_radius": lambda: (
+            "/list_items",
+            {"location_id": location_id, "position": position(), "radius": 10, "api_key": PLAYER},
+        ),
+        "acquire_item": lambda: ("/acquire_item", {"item_id": new_item(), "api_key": PLAYER}),
+        "delete_items": lambda: ("/delete_items", {"location_id": new_location(), "api_key": DESIGNER}),
+        "create_location": lambda: (
+            "/create_location",
+            {"name": f"scratch{uuid.uuid4().hex}", "type": "INDOOR", "api_key": DESIGNER},
+        ),
+        "delete_location": lambda: ("/delete_location", {"location_id": new_location(), "api_key": DESIGNER}),
+        "get_job": lambda: ("/get_job", {"job_id": dataset["job_id"], "api_key": DESIGNER}),
+        "list_locations": lambda: ("/list_locations", {"api_key": DESIGNER}),
+        "create_tag": lambda: ("/create_tag", {"name": f"scratch{uuid.uuid4().hex}", "api_key": DESIGNER}),
+        "list_tags": lambda: ("/list_tags", {"api_key": DESIGNER}),
+        "delete_tag": lambda: ("/delete_tag", {"tag": new_tag(), "api_key": DESIGNER}),
+        "update_attribute": lambda: (
+            "/update_attribute",
+            {"item_id": random_item(), "attribute": f"temperature={rng.randint(0, 40)}", "api_key": SENSOR},
+        ),
+        "get_attribute": lambda: (
+            "/get_attribute",
+            {"item_id": random_item(), "attribute": "state", "api_key": ACTUATOR},
+        ),
+        "get_attributes": lambda: (
+            "/get_attributes",
+            {"item_ids": ",".join(item_ids[:100]), "attributes": "state,temperature", "api_key": ACTUATOR},
+        ),
+        "get_cache_stats": lambda: ("/get_cache_stats", {"api_key": DESIGNER}),
+        "metrics": lambda: ("/metrics", {"api_key": DESIGNER}),
+        "watch_attribute": lambda: (
+            "/watch_attribute",
+            {"item_id": random_item(), "attribute": "state", "api_key": ACTUATOR},
+        ),
+    }
+
+
+def run_benchmark(client, prepare, min_rounds, max_rounds, min_time, allocation_rounds):
+    """
+    Measure the latency of a benchmark, then the memory allocated by its requests (with tracemalloc, which slows them
+    down, so in separate rounds).
+
+    Parameters
+
+    - client (FlaskClient): The test client.
+    - prepare (function): The benchmark (see build_benchmarks).
+    - min_rounds (int): The minimum number of requests to time.
+    - max_rounds (int): The maximum number of requests to time.
+    - min_time (float): The minimum time to spend timing requests in seconds (until max_rounds).
+    - allocation_rounds (int): The number of requests to measure the allocations of.
+
+    Returns
+
+    - A dictionary with the endpoint, the number of rounds, the median, p95 and minimum latencies in milliseconds, and
+      the peak of the memory allocated by a request in KiB (the smallest of the rounds, since background threads such
+      as snapshot listeners can allocate memory at the same time).
+    """
+    # Send a request first so that lazy initialization (e.g., caches and listeners) is not measured
+    path = prepare()[0]
+    send(client, prepare())
+
+    # Disable the garbage collector while timing (like timeit), since its pauses depend on the previous benchmarks
+    durations = []
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(durations) < max_rounds and (len(durations) < min_rounds or time.perf_counter() - started < min_time):
+            request_args = prepare()
+            start = time.perf_counter()
+            send(client, request_args)
+            durations.append((time.perf_counter() - start) * 1000)
+    finally:
+        gc.enable()
+
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(allocation_rounds):
+            request_args = prepare()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            send(client, request_args)
+            peaks.append((tracemalloc.get_traced_memory()[1] - current) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    durations.sort()
+    return {
+        "endpoint": server.app.url_map.bind("").match(path)[0],
+        "rounds": len(durations),
+        "median_ms": statistics.median(durations),
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        "min_ms": durations[0],
+        "peak_kib": min(peaks) if len(peaks) > 0 else None,
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Compare the results with a baseline. The latencies are compared by their minimum, which is the least affected by
+    other processes (the median of the same benchmark can vary by a factor of two between runs on a busy machine).
+
+    Parameters
+
+    - results (dict): The results (dataset size to benchmark name to statistics).
+    - baseline (dict): The results of a previous run.
+    - tolerance (float): The relative increase of the minimum latency or the allocations that is a regression.
+
+    Returns
+
+    - A list of messages describing the regressions.
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, stats in benchmarks.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            latency, base_latency = stats["min_ms"], base["min_ms"]
+            if latency > base_latency * (1 + tolerance) and latency - base_latency > MIN_LATENCY_CHANGE_MS:
+                regressions.append(f"{name}[{size}]: latency {base_latency:.3f} ms -> {latency:.3f} ms")
+            peak, base_peak = stats["peak_kib"], base.get("peak_kib")
+            if peak is None or base_peak is None:
+                continue
+            if peak > base_peak * (1 + tolerance) and peak - base_peak > MIN_ALLOCATION_CHANGE_KIB:
+                regressions.append(f"{name}[{size}]: allocations {base_peak:.1f} KiB -> {peak:.1f} KiB")
+    return regressions
+
+
+def print_results(size, benchmarks, baseline):
+    # Print the results of a dataset as a table, with the changes from the baseline
+    print(f"\nDataset: {size} items")
+    print(
+        f"{'benchmark':<20}{'rounds':>8}{'median ms':>12}{'p95 ms':>10}{'min ms':>10}{'peak KiB':>10}"
+        f"{'min/peak vs baseline':>24}"
+    )
+    for name, stats in benchmarks.items():
+        base = baseline.get(size, {}).get(name) if baseline is not None else None
+        change = ""
+        if base is not None:
+            change = f"{(stats['min_ms'] - base['min_ms']) / base['min_ms']:+.1%}"
+            if stats["peak_kib"] is not None and base.get("peak_kib"):
+                change += f" / {(stats['peak_kib'] - base['peak_kib']) / base['peak_kib']:+.1%}"
+        peak = f"{stats['peak_kib']:.1f}" if stats["peak_kib"] is not None else "-"
+        print(
+            f"{name:<20}{stats['rounds']:>8}{stats['median_ms']:>12.3f}{stats['p95_ms']:>10.3f}"
+            f"{stats['min_ms']:>10.3f}{peak:>10}{change:>24}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the server-side latency and allocations of every endpoint")
+    parser.add_argument(
+        "--sizes",
+        type=str,
+        default=",".join(str(size) for size in DATASET_SIZES),
+        help="Numbers of items of the datasets (comma-separated). Default is 10,1000,100000.",
+    )
+    parser.add_argument("--benchmarks", type=str, default=None, help="Benchmarks to run (comma-separated, optional).")
+    parser.add_argument("--min_rounds", type=int, default=5, help="Minimum requests per benchmark. Default is 5.")
+    parser.add_argument("--max_rounds", type=int, default=1000, help="Maximum requests per benchmark. Default is 1000.")
+    parser.add_argument("--min_time", type=float, default=1.0, help="Minimum time per benchmark. Default is 1 second.")
+    parser.add_argument(
+        "--allocation_rounds", type=int, default=5, help="Requests to measure the allocations of. Default is 5."
+    )
+    parser.add_argument("--output", type=str, default=None, help="Save the results to a JSON file (optional).")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare with the results of a JSON file.")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Relative increase that fails the run. Default is 0.25."
+    )
+
+    args = parser.parse_args()
+
+    # Load the baseline (a missing baseline is an error, so that a comparison can't pass without comparing anything)
+    baseline = None
+    if args.baseline is not None:
+        if not os.path.exists(args.baseline):
+            parser.error(f"baseline {args.baseline} not found (save one with --output or make benchmark_baseline)")
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    # Requests are not rate limited in the benchmark
+    server.limiter.enabled = False
+    client = server.app.test_client()
+    for tag in TAGS:
+        send(client, ("/create_tag", {"name": tag, "api_key": DESIGNER}))
+
+    results = {}
+    for size in sorted(int(size) for size in args.sizes.split(",")):
+        started = time.perf_counter()
+        dataset = seed_dataset(client, size)
+        print(f"\nSeeded {size} items in {time.perf_counter() - started:.1f} seconds")
+
+        benchmarks = build_benchmarks(client, dataset)
+        names = args.benchmarks.split(",") if args.benchmarks is not None else list(benchmarks)
+        results[str(size)] = {}
+        previous_ids = document_ids()
+        for name in names:
+            results[str(size)][name] = run_benchmark(
+                client, benchmarks[name], args.min_rounds, args.max_rounds, args.min_time, args.allocation_rounds
+            )
+            delete_new_documents(previous_ids, dataset["location_id"])
+        print_results(str(size), results[str(size)], baseline)
+
+    # Report the routes that no benchmark covers
+    covered = {stats["endpoint"] for benchmarks in results.values() for stats in benchmarks.values()}
+    uncovered = sorted(rule.endpoint for rule in server.app.url_map.iter_rules() if rule.endpoint not in covered)
+    uncovered = [endpoint for endpoint in uncovered if endpoint != "static"]
+    if len(uncovered) > 0:
+        print(f"\nRoutes without a benchmark: {', '.join(uncovered)}")
+
+    # Save the settings and the results so that they can be used as a baseline
+    if args.output is not None:
+        settings = {key: value for key, value in vars(args).items() if key not in ["output", "baseline"]}
+        with open(args.output, "w") as f:
+            json.dump({"settings": settings, "python": sys.version, "results": results}, f, indent=2)
+
+    # Fail if a benchmark regressed past the baseline
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print(f"\n{len(regressions)} regressions (more than {args.tolerance:.0%} above the baseline):")
+            for regression in regressions:
+                print(f"- {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions (within {args.tolerance:.0%} of the baseline)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# import necessary libraries
+import struct
+
+# This module encodes items and attribute values in a compact binary format for microcontroller clients (e.g., M5Stack
+# controllers), which can decode it with struct.unpack() instead of splitting quoted CSV strings. All numbers are
+# big-endian.
+#
+# - A string is a uint32 length followed by the UTF-8 bytes.
+# - A value is a uint8 type tag followed by its payload: 0 (null, no payload), 1 (false), 2 (true), 3 (int8),
+#   4 (int32), 5 (int64), 6 (float32), 7 (float64), or 8 (string). Numbers use the smallest type that holds them
+#   exactly.
+# - An item is a uint32 length of the rest of the record, then the id, name, owner and type (strings), the x, y, z
+#   coordinates (float32, z is 0 for OUTDOOR locations), a uint16 number of attributes, and the attributes sorted by
+#   key (a string key followed by a value).
+#
+# The lengths and the number of attributes are wide enough for any document Firestore can store (at most 1 MiB).
+#
+# A list of items is the items one after another, so that it can be streamed and read record by record.
+
+# The MIME type of the binary format
+BINARY_MIMETYPE = "application/octet-stream"
+
+NULL, FALSE, TRUE, INT8, INT32, INT64, FLOAT32, FLOAT64, STRING = range(9)
+
+# Precompiled structs of the fixed-size fields
+UINT8 = struct.Struct(">B")
+UINT16 = struct.Struct(">H")
+UINT32 = struct.Struct(">I")
+COORDINATES = struct.Struct(">3f")
+TAGGED_INT8 = struct.Struct(">Bb")
+TAGGED_INT32 = struct.Struct(">Bi")
+TAGGED_INT64 = struct.Struct(">Bq")
+TAGGED_FLOAT32 = struct.Struct(">Bf")
+TAGGED_FLOAT64 = struct.Struct(">Bd")
+
+
+def pack_string(s):
+    """
+    Encode a string with its length.
+
+    Parameters
+
+    - s (string): The string.
+
+    Returns
+
+    - The encoded string (bytes).
+    """
+    data = s.encode("utf-8")
+    return UINT32.pack(len(data)) + data
+
+
+def pack_value(value):
+    """
+    Encode a value with its type tag. Values of other types (e.g., lists) are encoded as strings.
+
+    Parameters
+
+    - value (any): The value.
+
+    Returns
+
+    - The encoded value (bytes).
+    """
+    if value is None:
+        return UINT8.pack(NULL)
+    if isinstance(value, bool):
+        return UINT8.pack(TRUE if value else FALSE)
+    if isinstance(value, int):
+        if -128 <= value < 128:
+            return TAGGED_INT8.pack(INT8, value)
+        if -(2**31) <= value < 2**31:
+            return TAGGED_INT32.pack(INT32, value)
+        if -(2**63) <= value < 2**63:
+            return TAGGED_INT64.pack(INT64, value)
+    elif isinstance(value, float):
+        # Use float32 if it holds the value exactly (e.g., 21.5 but not 21.1)
+        try:
+            packed = TAGGED_FLOAT32.pack(FLOAT32, value)
+            if TAGGED_FLOAT32.unpack(packed)[1] == value:
+                return packed
+        except OverflowError:
+            pass
+        return TAGGED_FLOAT64.pack(FLOAT64, value)
+    return UINT8.pack(STRING) + pack_string(str(value))
+
+
+def pack_item(item_id, item_data):
+    """
+    Encode an item as a length-prefixed record.
+
+    Parameters
+
+    - item_id (string): The id of the item.
+    - item_data (dict): The item as a dictionary.
+
+    Returns
+
+    - The encoded item (bytes).
+    """
+    coordinates = item_data["coordinates"]
+    attributes = item_data["attributes"] or {}
+    parts = [
+        pack_string(item_id),
+        pack_string(item_data["name"]),
+        pack_string(item_data["owner"]),
+        pack_string(item_data["type"]),
+        COORDINATES.pack(coordinates[0], coordinates[1], coordinates[2] if len(coordinates) > 2 else 0),
+        UINT16.pack(len(attributes)),
+    ]
+    for key in sorted(attributes):
+        parts.append(pack_string(key))
+        parts.append(pack_value(attributes[key]))
+    record = b"".join(parts)
+    return UINT32.pack(len(record)) + record
@@ -0,0 +1,822 @@
+# import necessary libraries
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from spatial import GeohashIndex, GridIndex
+
+# This module provides process-local caches for documents that are read on almost every request but rarely change.
+# Each gunicorn worker has its own caches. Writes made through the same worker update the caches immediately, and
+# writes made through other workers are picked up by a Firestore snapshot listener (if available) or when the
+# cached entries expire.
+
+
+class TTLCache:
+    """
+    A thread-safe dictionary whose entries expire after a fixed time-to-live.
+    """
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        """
+        Get the value for a key.
+
+        Parameters
+
+        - key (any): The key.
+
+        Returns
+
+        - A tuple (found, value). found is False if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            return True, value
+
+    def put(self, key, value):
+        """
+        Set the value for a key and restart its time-to-live.
+
+        Parameters
+
+        - key (any): The key.
+        - value (any): The value.
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self._ttl)
+
+    def invalidate(self, key=None):
+        """
+        Remove a key (or all keys if key is None).
+
+        Parameters
+
+        - key (any): The key (optional).
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+
+class ItemCache:
+    """
+    A read-through cache of item snapshots with a bounded size (least recently used items are evicted first) and a
+    time-to-live. Writes made through the same worker invalidate the cached items immediately, and writes made through
+    other workers are picked up when the cached items expire.
+    """
+
+    def __init__(self, db, max_size=1000, ttl=2.0):
+        self._db = db
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, item_id, retry=None):
+        """
+        Get an item, reading it from the storage backend if it is not cached.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - retry (Retry): The retry policy for reading the item (optional).
+
+        Returns
+
+        - The snapshot of the item (check exists since missing items are not cached).
+        """
+        if self._max_size > 0:
+            with self._lock:
+                entry = self._entries.get(item_id)
+                if entry is not None and entry[1] >= time.monotonic():
+                    self._entries.move_to_end(item_id)
+                    self.hits += 1
+                    return entry[0]
+                self.misses += 1
+
+        item = self._db.collection("items").document(item_id).get(retry=retry)
+        if item.exists:
+            self.put(item)
+        return item
+
+    def get_all(self, item_ids, retry=None):
+        """
+        Get multiple items, reading the items that are not cached with a single batched read.
+
+        Parameters
+
+        - item_ids (list): The ids of the items.
+        - retry (Retry): The retry policy for reading the items (optional).
+
+        Returns
+
+        - A dictionary of item ids to snapshots (check exists since missing items are not cached).
+        """
+        return self.get_all_with(item_ids, [], retry)[0]
+
+    def get_all_with(self, item_ids, references, retry=None):
+        """
+        Get multiple items and other documents (which are not cached), reading the items that are not cached and the
+        other documents with a single batched read.
+
+        Parameters
+
+        - item_ids (list): The ids of the items.
+        - references (list): The references of the other documents (e.g., counter shards).
+        - retry (Retry): The retry policy for reading the documents (optional).
+
+        Returns
+
+        - A tuple (dictionary of item ids to snapshots, list of snapshots of the other documents).
+        """
+        items = {}
+        if self._max_size > 0:
+            with self._lock:
+                now = time.monotonic()
+                for item_id in item_ids:
+                    entry = self._entries.get(item_id)
+                    if entry is not None and entry[1] >= now:
+                        self._entries.move_to_end(item_id)
+                        self.hits += 1
+                        items[item_id] = entry[0]
+                    else:
+                        self.misses += 1
+
+        missing_refs = [self._db.collection("items").document(item_id) for item_id in item_ids if item_id not in items]
+        other_paths = {reference.path for reference in references}
+        others = []
+        if len(missing_refs) + len(references) > 0:
+            for doc in self._db.get_all(missing_refs + list(references), retry=retry):
+                if doc.reference.path in other_paths:
+                    others.append(doc)
+                    continue
+                items[doc.id] = doc
+                if doc.exists:
+                    self.put(doc)
+        return items, others
+
+    def put(self, item):
+        """
+        Store the snapshot of an item.
+
+        Parameters
+
+        - item (DocumentSnapshot): The snapshot of the item.
+        """
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            self._entries[item.id] = (item, time.monotonic() + self._ttl)
+            self._entries.move_to_end(item.id)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, item_id=None):
+        """
+        Remove an item (or all items if item_id is None).
+
+        Parameters
+
+        - item_id (string): The id of the item (optional).
+        """
+        with self._lock:
+            if item_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(item_id, None)
+
+    def invalidate_many(self, item_ids):
+        """
+        Remove multiple items.
+
+        Parameters
+
+        - item_ids (list): The ids of the items.
+        """
+        with self._lock:
+            for item_id in item_ids:
+                self._entries.pop(item_id, None)
+
+    def invalidate_location(self, location_id):
+        """
+        Remove all items in a location.
+
+        Parameters
+
+        - location_id (string): The location_id of the items.
+        """
+        with self._lock:
+            for item_id, (item, _) in list(self._entries.items()):
+                if item.get("location_id") == location_id:
+                    del self._entries[item_id]
+
+    def stats(self):
+        """
+        Get the statistics of the cache.
+
+        Returns
+
+        - A dictionary with the number of hits, misses, evictions and cached items (size).
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self._entries)}
+
+
+class CollectionListener:
+    """
+    A base class for caches that follow a whole collection with a snapshot listener.
+
+    The listener is started on first use so that each gunicorn worker subscribes after forking. Subclasses decide how
+    each document is keyed and stored in the snapshot by overriding snapshot_entry().
+    """
+
+    collection_id = None
+
+    def __init__(self, db, use_listener=True):
+        self._db = db
+        self._use_listener = use_listener
+        self._listener_lock = threading.Lock()
+        self._watch = None
+        self._snapshot = None
+
+    def snapshot_entry(self, doc):
+        """
+        Convert a document to a (key, value) pair of the snapshot.
+        """
+        return doc.id, doc.to_dict()
+
+    def _start_listener(self):
+        with self._listener_lock:
+            if self._watch is not None or not self._use_listener:
+                return
+            collection_ref = self._db.collection(self.collection_id)
+            if not hasattr(collection_ref, "on_snapshot"):
+                self._use_listener = False
+                return
+            self._watch = collection_ref.on_snapshot(self._on_snapshot)
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Replace the whole snapshot with the current set of documents
+        self._snapshot = dict(self.snapshot_entry(doc) for doc in docs)
+
+    def _listener_is_active(self):
+        self._start_listener()
+        return self._watch is not None and self._snapshot is not None and self._watch.is_active
+
+    def _snapshot_put(self, key, value):
+        if self._snapshot is not None:
+            self._snapshot = {**self._snapshot, key: value}
+
+    def _snapshot_remove(self, key):
+        if self._snapshot is not None:
+            self._snapshot = {k: v for k, v in self._snapshot.items() if k != key}
+
+    def close(self):
+        """
+        Stop the snapshot listener (if any).
+        """
+        with self._listener_lock:
+            if self._watch is not None:
+                self._watch.unsubscribe()
+                self._watch = None
+                self._snapshot = None
+
+
+class LocationCache(CollectionListener):
+    """
+    A cache of location documents keyed by location_id.
+
+    If the storage backend supports snapshot listeners, the cache subscribes to the locations collection and answers
+    every lookup (including lookups of missing locations) from memory while the listener is active. Otherwise, or
+    while the listener is not active, found locations are cached for ttl seconds and missing locations are read from
+    the storage backend every time.
+    """
+
+    collection_id = "locations"
+
+    def __init__(self, db, ttl=60.0, use_listener=True):
+        super().__init__(db, use_listener)
+        self._entries = TTLCache(ttl)
+
+    def get(self, location_id):
+        """
+        Get a location.
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+
+        Returns
+
+        - The location as a dictionary (location_id, name, type), or None if the location does not exist.
+        """
+        # A location_id that can't be a document id never exists
+        if not location_id or "/" in location_id:
+            return None
+
+        if self._listener_is_active():
+            return self._snapshot.get(location_id)
+
+        found, location = self._entries.get(location_id)
+        if found:
+            return location
+
+        location = self._db.collection("locations").document(location_id).get().to_dict()
+        if location is not None:
+            self._entries.put(location_id, location)
+        return location
+
+    def put(self, location_id, location):
+        """
+        Store a location that was just written.
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        - location (dict): The location data.
+        """
+        self._entries.put(location_id, location)
+        self._snapshot_put(location_id, location)
+
+    def invalidate(self, location_id):
+        """
+        Remove a location that was just deleted.
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        """
+        self._entries.invalidate(location_id)
+        self._snapshot_remove(location_id)
+
+
+class TagRegistry(CollectionListener):
+    """
+    A registry of tag names used to validate the tags of items.
+
+    If the storage backend supports snapshot listeners, the registry subscribes to the tags collection and validates
+    any number of tags from memory while the listener is active. Otherwise, or while the listener is not active,
+    found tag names are cached for ttl seconds and all unknown names are looked up with a single "in" query.
+    """
+
+    collection_id = "tags"
+
+    # The maximum number of values in a single "in" query
+    max_in_values = 30
+
+    def __init__(self, db, ttl=60.0, use_listener=True):
+        super().__init__(db, use_listener)
+        self._entries = TTLCache(ttl)
+
+    def snapshot_entry(self, doc):
+        return doc.to_dict()["name"], doc.id
+
+    def find_missing(self, names):
+        """
+        Find the tag names that do not exist.
+
+        Parameters
+
+        - names (list): The tag names to check.
+
+        Returns
+
+        - The list of names that do not exist, in the order given.
+        """
+        if self._listener_is_active():
+            snapshot = self._snapshot
+            return [name for name in names if name not in snapshot]
+
+        # Look up the names that are not cached yet in as few round-trips as possible
+        unknown = [name for name in dict.fromkeys(names) if not self._entries.get(name)[0]]
+        for start in range(0, len(unknown), self.max_in_values):
+            chunk = unknown[start : start + self.max_in_values]
+            for doc in self._db.collection("tags").where(filter=FieldFilter("name", "in", chunk)).get():
+                self._entries.put(doc.to_dict()["name"], doc.id)
+
+        return [name for name in names if not self._entries.get(name)[0]]
+
+    def put(self, name, tag_id):
+        """
+        Store a tag that was just created.
+
+        Parameters
+
+        - name (string): The name of the tag.
+        - tag_id (string): The id of the tag.
+        """
+        self._entries.put(name, tag_id)
+        self._snapshot_put(name, tag_id)
+
+    def invalidate(self, name):
+        """
+        Remove a tag that was just deleted.
+
+        Parameters
+
+        - name (string): The name of the tag.
+        """
+        self._entries.invalidate(name)
+        self._snapshot_remove(name)
+
+
+class SpatialIndexCache:
+    """
+    A cache of the spatial indexes of locations keyed by location_id, used to answer radius queries of list_items.
+
+    If the storage backend supports snapshot listeners, the index of a location is loaded from the first snapshot of a
+    listener on its items (started on first use), updated with each change, and kept until it is invalidated or has not
+    been used for idle_ttl seconds. Otherwise, or if the first snapshot doesn't arrive within load_timeout seconds, the
+    index is built from one query over the items (reading only the coordinates) and rebuilt after ttl seconds, and the
+    listener is not tried again for that location for retry_interval seconds. Items created, moved, or deleted through
+    the same worker update the index immediately. Since the index only selects candidates, callers should re-check the
+    fetched items.
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl=30.0,
+        idle_ttl=300.0,
+        load_timeout=10.0,
+        retry_interval=60.0,
+        grid_cell_size=2.0,
+        geohash_precision=9,
+        use_listener=True,
+    ):
+        self._db = db
+        self._indexes = TTLCache(ttl)
+        self._idle_ttl = idle_ttl
+        self._load_timeout = load_timeout
+        self._retry_interval = retry_interval
+        self._grid_cell_size = grid_cell_size
+        self._geohash_precision = geohash_precision
+        self._use_listener = use_listener
+        self._lock = threading.Lock()
+
+        # The indexes kept up to date by snapshot listeners (location_id -> FollowedIndex), and the times until which
+        # the listener of a location is not tried again after its first snapshot didn't arrive (location_id -> time)
+        self._follow_lock = threading.Lock()
+        self._followed = {}
+        self._retry_at = {}
+
+    def _new_index(self, location_type):
+        if location_type == "INDOOR":
+            return GridIndex(self._grid_cell_size)
+        return GeohashIndex(self._geohash_precision)
+
+    def _build(self, location_id, location_type):
+        index = self._new_index(location_type)
+        docs = (
+            self._db.collection("items")
+            .where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
+            .select(["coordinates"])
+            .stream()
+        )
+        index.load((doc.id, doc.to_dict().get("coordinates")) for doc in docs)
+        return index
+
+    def _apply(self, followed, docs, changes):
+        # Load the first snapshot of a listener, then apply the changes
+        with self._lock:
+            if not followed.loaded.is_set():
+                followed.index.load((doc.id, doc.to_dict().get("coordinates")) for doc in docs)
+                followed.loaded.set()
+                return
+
+            for change in changes:
+                followed.index.remove(change.document.id)
+                if change.type.name != "REMOVED":
+                    followed.index.load([(change.document.id, change.document.to_dict().get("coordinates"))])
+
+    def _unfollow(self, location_id):
+        followed = self._followed.pop(location_id)
+        followed.watch.unsubscribe()
+
+    def _follow(self, location_id, location_type):
+        # Get the index of a location kept up to date by a snapshot listener (None if it is not available)
+        with self._follow_lock:
+            # Stop the listeners that are idle or stopped
+            now = time.monotonic()
+            for followed_location_id, followed in list(self._followed.items()):
+                if now - followed.last_access > self._idle_ttl or not followed.watch.is_active:
+                    self._unfollow(followed_location_id)
+
+            followed = self._followed.get(location_id)
+            if followed is None:
+                if not self._use_listener or self._retry_at.get(location_id, 0) > now:
+                    return None
+                query_ref = self._db.collection("items").where(
+                    filter=FieldFilter(field_path="location_id", op_string="==", value=location_id)
+                )
+                if not hasattr(query_ref, "on_snapshot"):
+                    self._use_listener = False
+                    return None
+                followed = FollowedIndex(self._new_index(location_type))
+                followed.watch = query_ref.on_snapshot(
+                    lambda docs, changes, read_time: self._apply(followed, docs, changes)
+                )
+                self._followed[location_id] = followed
+            followed.last_access = now
+
+        # Wait for the first snapshot outside the lock so that other locations are not blocked
+        if not followed.loaded.wait(self._load_timeout):
+            with self._follow_lock:
+                if self._followed.get(location_id) is followed:
+                    self._unfollow(location_id)
+                self._retry_at[location_id] = time.monotonic() + self._retry_interval
+            return None
+        return followed.index
+
+    def query(self, location_id, location_type, position, radius):
+        """
+        Find the items within a radius of a position in a location.
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        - location_type (string): The type of the location (INDOOR or OUTDOOR).
+        - position (list): The center of the query (x, y, z for INDOOR or latitude, longitude for OUTDOOR).
+        - radius (float): The radius in meters.
+
+        Returns
+
+        - The list of ids of the items within the radius.
+        """
+        index = self._follow(location_id, location_type)
+        if index is None:
+            found, index = self._indexes.get(location_id)
+            if not found:
+                # Build the index outside the lock so that queries for other locations are not blocked
+                index = self._build(location_id, location_type)
+                self._indexes.put(location_id, index)
+        with self._lock:
+            return index.query(position, radius)
+
+    def _cached_indexes(self, location_id):
+        # Get the indexes of a location that are in use (followed by a listener or built by a query)
+        indexes = []
+        followed = self._followed.get(location_id)
+        if followed is not None and followed.loaded.is_set():
+            indexes.append(followed.index)
+        found, index = self._indexes.get(location_id)
+        if found:
+            indexes.append(index)
+        return indexes
+
+    def add(self, location_id, item_id, coordinates):
+        """
+        Add or move an item in the index of a location (if the index is cached).
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        - item_id (string): The id of the item.
+        - coordinates (list): The coordinates of the item.
+        """
+        for index in self._cached_indexes(location_id):
+            with self._lock:
+                index.remove(item_id)
+                index.load([(item_id, coordinates)])
+
+    def remove(self, location_id, item_id):
+        """
+        Remove an item from the index of a location (if the index is cached).
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        - item_id (string): The id of the item.
+        """
+        for index in self._cached_indexes(location_id):
+            with self._lock:
+                index.remove(item_id)
+
+    def invalidate(self, location_id=None):
+        """
+        Drop the index of a location (or of all locations if location_id is None), stopping its listener.
+
+        Parameters
+
+        - location_id (string): The location_id of the location (optional).
+        """
+        self._indexes.invalidate(location_id)
+        with self._follow_lock:
+            for followed_location_id in list(self._followed):
+                if location_id is None or followed_location_id == location_id:
+                    self._unfollow(followed_location_id)
+
+
+class FollowedIndex:
+    """
+    A spatial index of a location updated by a snapshot listener on the items of the location.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.loaded = threading.Event()
+        self.watch = None
+        self.last_access = time.monotonic()
+
+
+class LocationReplica:
+    """
+    An in-memory copy of the items in a location, kept up to date by a snapshot listener on the items of the location,
+    with a spatial index for radius queries.
+    """
+
+    def __init__(self, location_type, grid_cell_size=2.0, geohash_precision=9):
+        self._lock = threading.Lock()
+        self._items = {}
+        self._ids = []
+        if location_type == "INDOOR":
+            self._index = GridIndex(grid_cell_size)
+        else:
+            self._index = GeohashIndex(geohash_precision)
+        self.loaded = threading.Event()
+        self.watch = None
+        self.last_access = time.monotonic()
+
+    def apply(self, docs, changes):
+        """
+        Apply a snapshot of the listener (all documents the first time, then only the changes).
+
+        Parameters
+
+        - docs (list): The snapshots of all the items in the location.
+        - changes (list): The changes since the previous snapshot.
+        """
+        with self._lock:
+            if not self.loaded.is_set():
+                self._items = {doc.id: doc for doc in docs}
+                self._ids = sorted(self._items)
+                self._index.load((doc.id, doc.to_dict().get("coordinates")) for doc in docs)
+                self.loaded.set()
+                return
+
+            for change in changes:
+                item_id = change.document.id
+                self._index.remove(item_id)
+                if change.type.name == "REMOVED":
+                    if self._items.pop(item_id, None) is not None:
+                        del self._ids[bisect.bisect_left(self._ids, item_id)]
+                else:
+                    if item_id not in self._items:
+                        bisect.insort(self._ids, item_id)
+                    self._items[item_id] = change.document
+                    self._index.load([(item_id, change.document.to_dict().get("coordinates"))])
+
+    def items(self, position=None, radius=None, after_id=None):
+        """
+        Get the items in the location, or only the items within a radius of a position.
+
+        Parameters
+
+        - position (list): The center of the query (x, y, z for INDOOR or latitude, longitude for OUTDOOR, optional).
+        - radius (float): The radius in meters (optional).
+        - after_id (string): Only get the items whose ids are greater than this id (optional).
+
+        Returns
+
+        - An iterator over the snapshots of the items sorted by id (like the results of a query).
+        """
+        with self._lock:
+            self.last_access = time.monotonic()
+            if position is not None:
+                item_ids = [item_id for item_id in self._index.query(position, radius) if item_id > (after_id or "")]
+                return iter([self._items[item_id] for item_id in sorted(item_ids)])
+        return self._items_after(after_id)
+
+    def _items_after(self, after_id, chunk_size=256):
+        # Walk the sorted ids in chunks, so that only the items the caller reads are copied and the lock is not held
+        # while the caller filters them
+        while True:
+            with self._lock:
+                start = 0 if after_id is None else bisect.bisect_right(self._ids, after_id)
+                chunk = [self._items[item_id] for item_id in self._ids[start : start + chunk_size]]
+            if len(chunk) == 0:
+                return
+            yield from chunk
+            after_id = chunk[-1].id
+
+
+class LocationReplicaCache:
+    """
+    Keeps a LocationReplica for each location recently listed through this worker. A replica is created (and its
+    listener started) on first use, and dropped when it has not been used for idle_ttl seconds or when more than
+    max_locations locations are replicated (least recently used first). If the first snapshot of a replica doesn't
+    arrive within load_timeout seconds, the replica is dropped and the location is not replicated again for
+    retry_interval seconds.
+    """
+
+    def __init__(
+        self,
+        db,
+        idle_ttl=300.0,
+        max_locations=20,
+        load_timeout=10.0,
+        retry_interval=60.0,
+        grid_cell_size=2.0,
+        geohash_precision=9,
+    ):
+        self._db = db
+        self._idle_ttl = idle_ttl
+        self._max_locations = max_locations
+        self._load_timeout = load_timeout
+        self._retry_interval = retry_interval
+        self._grid_cell_size = grid_cell_size
+        self._geohash_precision = geohash_precision
+        self._lock = threading.Lock()
+        self._replicas = OrderedDict()
+
+        # The times until which locations whose first snapshot didn't arrive are not replicated (location_id -> time)
+        self._retry_at = {}
+
+    def _drop(self, location_id):
+        replica = self._replicas.pop(location_id)
+        if replica.watch is not None:
+            replica.watch.unsubscribe()
+
+    def get(self, location_id, location_type):
+        """
+        Get the replica of a location, starting it if needed.
+
+        Parameters
+
+        - location_id (string): The location_id of the location.
+        - location_type (string): The type of the location (INDOOR or OUTDOOR).
+
+        Returns
+
+        - The LocationReplica, or None if the replica is not available (e.g., the storage backend doesn't support
+          snapshot listeners or the first snapshot didn't arrive in time). Fall back to a query in that case.
+        """
+        with self._lock:
+            # Drop the replicas that are idle or whose listener stopped
+            now = time.monotonic()
+            for replica_location_id, replica in list(self._replicas.items()):
+                if now - replica.last_access > self._idle_ttl or not replica.watch.is_active:
+                    self._drop(replica_location_id)
+
+            replica = self._replicas.get(location_id)
+            if replica is None:
+                if self._retry_at.get(location_id, 0) > now:
+                    return None
+                self._retry_at.pop(location_id, None)
+                query_ref = self._db.collection("items").where(
+                    filter=FieldFilter(field_path="location_id", op_string="==", value=location_id)
+                )
+                if not hasattr(query_ref, "on_snapshot"):
+                    return None
+                replica = LocationReplica(location_type, self._grid_cell_size, self._geohash_precision)
+                replica.watch = query_ref.on_snapshot(
+                    lambda docs, changes, read_time: replica.apply(docs, changes)
+                )
+                self._replicas[location_id] = replica
+                while len(self._replicas) > self._max_locations:
+                    self._drop(next(iter(self._replicas)))
+            self._replicas.move_to_end(location_id)
+            replica.last_access = now
+
+        # Wait for the first snapshot outside the lock so that other locations are not blocked
+        if not replica.loaded.wait(self._load_timeout):
+            # Fall back to queries right away for a while instead of waiting again on every request
+            with self._lock:
+                if self._replicas.get(location_id) is replica:
+                    self._drop(location_id)
+                self._retry_at[location_id] = time.monotonic() + self._retry_interval
+            return None
+        return replica
+
+    def invalidate(self, location_id=None):
+        """
+        Drop the replica of a location (e.g., when the location is deleted), or of all locations if location_id is
+        None.
+
+        Parameters
+
+        - location_id (string): The location_id of the location (optional).
+        """
+        with self._lock:
+            for replica_location_id in list(self._replicas):
+                if location_id is None or replica_location_id == location_id:
+                    self._drop(replica_location_id)
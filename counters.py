@@ -0,0 +1,148 @@
+# import necessary libraries
+import random
+
+from firebase_admin import firestore
+
+# This module spreads the increments/decrements of very hot attributes (e.g., votes on an item in front of a crowd)
+# over several shard documents, since a single document can only sustain about one write per second. The value stored
+# in the item is the base value; the current value is the base value plus the sum of the shards. Setting an absolute
+# value resets the shards.
+
+
+class ShardedCounters:
+    """
+    Keeps the increments/decrements of the configured attributes in the counter_shards collection. Shard i of an item
+    is the document {item_id}-{i} with the fields item_id and attributes (a map of attribute names to sums).
+    """
+
+    def __init__(self, db, attributes, num_shards=10, max_writes_per_batch=500):
+        # Deleting or resetting an item writes the item and all of its shards in one batch
+        if num_shards < 1 or num_shards >= max_writes_per_batch:
+            raise ValueError(f"The number of counter shards should be between 1 and {max_writes_per_batch - 1}")
+        self._db = db
+        self._attributes = set(attributes)
+        self.num_shards = num_shards
+
+    @property
+    def enabled(self):
+        return len(self._attributes) > 0
+
+    def is_sharded(self, attribute):
+        return attribute in self._attributes
+
+    def _shard_refs(self, item_id):
+        return [self._db.collection("counter_shards").document(f"{item_id}-{i}") for i in range(self.num_shards)]
+
+    def increment(self, writer, item_id, attribute, delta):
+        """
+        Add a delta to a random shard of an attribute.
+
+        Parameters
+
+        - writer (Transaction or WriteBatch): The transaction or batch to write with.
+        - item_id (string): The id of the item.
+        - attribute (string): The name of the attribute.
+        - delta (int or float): The amount to add (negative to decrement).
+        """
+        shard_ref = self._db.collection("counter_shards").document(f"{item_id}-{random.randrange(self.num_shards)}")
+        writer.set(shard_ref, {"item_id": item_id, "attributes": {attribute: firestore.Increment(delta)}}, merge=True)
+
+    def reset(self, writer, item_id, attribute):
+        """
+        Clear the shards of an attribute (e.g., when an absolute value is set).
+
+        Parameters
+
+        - writer (Transaction or WriteBatch): The transaction or batch to write with.
+        - item_id (string): The id of the item.
+        - attribute (string): The name of the attribute.
+        """
+        for shard_ref in self._shard_refs(item_id):
+            writer.set(shard_ref, {"item_id": item_id, "attributes": {attribute: firestore.DELETE_FIELD}}, merge=True)
+
+    def delete(self, writer, item_id):
+        """
+        Delete all shards of an item.
+
+        Parameters
+
+        - writer (Transaction or WriteBatch): The transaction or batch to write with.
+        - item_id (string): The id of the item.
+        """
+        for shard_ref in self._shard_refs(item_id):
+            writer.delete(shard_ref)
+
+    def shard_refs(self, item_ids):
+        """
+        Get the references of the shards of several items (e.g., to read them with other documents at once).
+
+        Parameters
+
+        - item_ids (list): The ids of the items.
+
+        Returns
+
+        - The list of references.
+        """
+        return [shard_ref for item_id in item_ids for shard_ref in self._shard_refs(item_id)]
+
+    def sum_shards(self, shards):
+        """
+        Sum the shards of one or more items.
+
+        Parameters
+
+        - shards (list): The snapshots of the shards (missing shards are skipped).
+
+        Returns
+
+        - A dictionary of item ids to dictionaries of attribute names to the sums of their shards (only attributes with
+          shards).
+        """
+        totals = {}
+        for shard in shards:
+            if not shard.exists:
+                continue
+            shard_data = shard.to_dict()
+            item_totals = totals.setdefault(shard_data["item_id"], {})
+            for attribute, value in (shard_data.get("attributes") or {}).items():
+                item_totals[attribute] = item_totals.get(attribute, 0) + value
+        return totals
+
+    def totals(self, item_id):
+        """
+        Sum the shards of an item.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+
+        Returns
+
+        - A dictionary of attribute names to the sums of their shards (only attributes with shards).
+        """
+        return self.sum_shards(self._db.get_all(self._shard_refs(item_id))).get(item_id, {})
+
+    def apply(self, item_id, attributes, totals=None):
+        """
+        Add the sums of the shards of an item to its attributes.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - attributes (dict): The attributes stored in the item (base values, can be None).
+        - totals (dict): The sums of the shards of the item if already read (optional, see sum_shards).
+
+        Returns
+
+        - A new dictionary of the current values of the attributes.
+        """
+        attributes = dict(attributes or {})
+        if not self.enabled:
+            return attributes
+        if totals is None:
+            totals = self.totals(item_id)
+        for attribute, total in totals.items():
+            if attribute in attributes and isinstance(attributes[attribute], (int, float)):
+                attributes[attribute] = attributes[attribute] + total
+        return attributes
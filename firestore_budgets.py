@@ -0,0 +1,362 @@
+# import necessary libraries
+import argparse
+import os
+import sys
+import time
+
+# This script checks the number of Firestore documents read and written and the number of queries made by each
+# endpoint against a budget, so that a change that adds reads (e.g., a query per tag) fails the build instead of
+# showing up on the invoice. The requests are sent through the Flask test client to a server that uses the
+# in-process storage engine, and the operations are counted by the /metrics counters (see metrics.py).
+#
+# Each check sends a warm-up request first, so that the caches are filled as on a running server, then counts the
+# operations of a second request with new arguments (e.g., another item). Cold checks empty the caches of items,
+# spatial indexes and location replicas before the second request, so that the cost of filling them (e.g., loading
+# the spatial index of a whole location) is counted too. Operations made outside of the request are only counted for
+# the endpoints that start a job (the job is awaited) and for the cold checks, and then include the snapshot
+# listeners of the caches.
+
+# Count the operations with the metrics, in this process (set before importing the server)
+os.environ["METRICS"] = "true"
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+from prometheus_client import REGISTRY  # noqa: E402
+
+from instrumentation import unwrap  # noqa: E402
+from jobs import JobRunner  # noqa: E402
+
+from benchmark import (  # noqa: E402
+    ACTUATOR,
+    DESIGNER,
+    PLAYER,
+    SENSOR,
+    TAGS,
+    delete_new_documents,
+    document_ids,
+    seed_dataset,
+    send,
+    server,
+)
+
+# The counters of the operations (see metrics.py)
+COUNTERS = {
+    "reads": "firestore_document_reads_total",
+    "writes": "firestore_document_writes_total",
+    "queries": "firestore_queries_total",
+}
+
+# The time for the snapshot listeners of the caches to receive a change (they run in a thread of the storage engine)
+LISTENER_DELAY = 0.05
+
+# The tags used by the create_item checks
+BUDGET_TAGS = [f"budget{i}" for i in range(20)]
+
+
+def count_operations(endpoint):
+    # Get the number of operations counted so far for an endpoint
+    return {key: REGISTRY.get_sample_value(name, {"endpoint": endpoint}) or 0 for key, name in COUNTERS.items()}
+
+
+def wait_for_job(job_id, timeout=30):
+    # Wait until a job is no longer running (reading the job through the uninstrumented client so that the reads are
+    # not counted)
+    jobs = JobRunner(unwrap(server.db))
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(job_id)
+        if job is not None and job["status"] != "RUNNING":
+            return job
+        time.sleep(0.01)
+    raise RuntimeError(f"Job {job_id} did not finish in {timeout} seconds")
+
+
+def build_checks(client, dataset):
+    """
+    Build the checks of a dataset.
+
+    Parameters
+
+    - client (FlaskClient): The test client.
+    - dataset (dict): The dataset (see seed_dataset in benchmark.py).
+
+    Returns
+
+    - A list of tuples (name, function that prepares a request and returns its path, parameters and optionally body,
+      budget as a dictionary of reads, writes and queries, whether the request starts a job, whether the caches are
+      emptied before the request).
+    """
+    location_id, item_ids, rng = dataset["location_id"], dataset["item_ids"], dataset["rng"]
+    size = len(item_ids)
+
+    def random_item():
+        return rng.choice(item_ids)
+
+    def new_item():
+        params = {"location_id": location_id, "name": "new", "type": "BUDGET", "coordinates": "1,2,0"}
+        return send(client, ("/create_item", {**params, "api_key": DESIGNER})).get_data(as_text=True).split(",")[1]
+
+    def new_location(items=0):
+        params = {"name": f"budget{rng.getrandbits(64)}", "type": "INDOOR", "api_key": DESIGNER}
+        new_location_id = send(client, ("/create_location", params)).get_data(as_text=True).split(",")[1]
+        if items > 0:
+            body = "name,type,coordinates\n" + "\n".join(f'item{i},BUDGET,"1,2,0"' for i in range(items))
+            send(client, ("/create_items", {"location_id": new_location_id, "api_key": DESIGNER}, body))
+        return new_location_id
+
+    def new_tag():
+        name = f"budget{rng.getrandbits(64)}"
+        send(client, ("/create_tag", {"name": name, "api_key": DESIGNER}))
+        return name
+
+    def position():
+        return f"{rng.uniform(0, 100):.2f},{rng.uniform(0, 100):.2f},0"
+
+    def create_item(tags):
+        params = {"location_id": location_id, "name": "new", "type": "BUDGET", "coordinates": position()}
+        if len(tags) > 0:
+            params["tags"] = ",".join(tags)
+        return lambda: ("/create_item", {**params, "api_key": DESIGNER})
+
+    def create_items(count):
+        body = "name,type,coordinates,tags\n" + "\n".join(f'item{i},BUDGET,"1,2,0","{TAGS[0]}"' for i in range(count))
+        return lambda: ("/create_items", {"location_id": location_id, "api_key": DESIGNER}, body)
+
+    def get_attributes(count):
+        return lambda: (
+            "/get_attributes",
+            {"item_ids": ",".join(rng.sample(item_ids, count)), "attributes": "state", "api_key": ACTUATOR},
+        )
+
+    # delete_items reports its progress after each page of items (the query of the last page finds no items)
+    delete_count = 1200
+    delete_pages = -(-delete_count // server.DELETE_PAGE_SIZE)
+
+    def check(name, prepare, reads, writes, queries, starts_job=False, cold=False):
+        return (name, prepare, {"reads": reads, "writes": writes, "queries": queries}, starts_job, cold)
+
+    def get_item():
+        return ("/get_item", {"item_id": random_item(), "api_key": PLAYER})
+
+    def get_attribute():
+        return ("/get_attribute", {"item_id": random_item(), "attribute": "state", "api_key": ACTUATOR})
+
+    def list_items_with_radius():
+        return (
+            "/list_items",
+            {"location_id": location_id, "position": position(), "radius": 10, "api_key": PLAYER},
+        )
+
+    checks = [check("ping", lambda: ("/ping", {}), 0, 0, 0)]
+    for count in [0, 1, 5, 20]:
+        checks.append(check(f"create_item with {count} tags", create_item(BUDGET_TAGS[:count]), 3, 1, 1))
+    for count in [10, 100, 1000]:
+        checks.append(check(f"create_items with {count} items", create_items(count), 3, count, 1))
+    checks += [
+        check("delete_item", lambda: ("/delete_item", {"item_id": new_item(), "api_key": DESIGNER}), 1, 1, 1),
+        check(
+            "update_item",
+            lambda: ("/update_item", {"item_id": random_item(), "coordinates": position(), "api_key": DESIGNER}),
+            1,
+            1,
+            0,
+        ),
+        check("get_item", get_item, 1, 0, 0),
+        check("get_item (cold)", get_item, 1, 0, 0, cold=True),
+        check("list_items", lambda: ("/list_items", {"location_id": location_id, "api_key": PLAYER}), 100, 0, 1),
+        check(
+            f"list_items of all {size} items",
+            lambda: ("/list_items", {"location_id": location_id, "max_items": size, "api_key": PLAYER}),
+            size,
+            0,
+            1,
+        ),
+        check(
+            "list_items with tags",
+            lambda: ("/list_items", {"location_id": location_id, "tags": TAGS[0], "api_key": PLAYER}),
+            100,
+            0,
+            1,
+        ),
+        check("list_items with radius", list_items_with_radius, 100 + server.SPATIAL_FETCH_BATCH_SIZE, 0, 1),
+        # Loading the spatial index reads the coordinates of each item of the location once
+        check(
+            "list_items with radius (cold)",
+            list_items_with_radius,
+            size + 100 + server.SPATIAL_FETCH_BATCH_SIZE,
+            0,
+            1,
+            cold=True,
+        ),
+        check("acquire_item", lambda: ("/acquire_item", {"item_id": new_item(), "api_key": PLAYER}), 0, 1, 0),
+        check(
+            f"delete_items with {delete_count} items",
+            lambda: ("/delete_items", {"location_id": new_location(delete_count), "api_key": DESIGNER}),
+            delete_count,
+            delete_count + delete_pages + 2,
+            delete_pages + 1,
+            starts_job=True,
+        ),
+        check(
+            "create_location",
+            lambda: (
+                "/create_location",
+                {"name": f"budget{rng.getrandbits(64)}", "type": "INDOOR", "api_key": DESIGNER},
+            ),
+            0,
+            1,
+            1,
+        ),
+        check(
+            "delete_location",
+            lambda: ("/delete_location", {"location_id": new_location(), "api_key": DESIGNER}),
+            2,
+            3,
+            1,
+            starts_job=True,
+        ),
+        check("get_job", lambda: ("/get_job", {"job_id": dataset["job_id"], "api_key": DESIGNER}), 1, 0, 0),
+        check("list_locations", lambda: ("/list_locations", {"max_locations": 100, "api_key": DESIGNER}), 100, 0, 1),
+        check(
+            "create_tag",
+            lambda: ("/create_tag", {"name": f"budget{rng.getrandbits(64)}", "api_key": DESIGNER}),
+            0,
+            1,
+            1,
+        ),
+        check("list_tags", lambda: ("/list_tags", {"api_key": DESIGNER}), 100, 0, 1),
+        check("delete_tag", lambda: ("/delete_tag", {"tag": new_tag(), "api_key": DESIGNER}), 1, 1, 1),
+        check(
+            "update_attribute",
+            lambda: ("/update_attribute", {"item_id": random_item(), "attribute": "state=1", "api_key": SENSOR}),
+            1,
+            1,
+            0,
+        ),
+        check(
+            "update_attribute with an increment",
+            lambda: ("/update_attribute", {"item_id": random_item(), "attribute": "state+=1", "api_key": SENSOR}),
+            1,
+            1,
+            0,
+        ),
+        check("get_attribute", get_attribute, 1, 0, 0),
+        check("get_attribute (cold)", get_attribute, 1, 0, 0, cold=True),
+    ]
+    for count in sorted({1, 10, min(size, server.MAX_ITEMS_PER_BULK_READ)}):
+        checks.append(check(f"get_attributes of {count} items", get_attributes(count), count, 0, 0))
+        checks.append(check(f"get_attributes of {count} items (cold)", get_attributes(count), count, 0, 0, cold=True))
+    checks += [
+        check("get_cache_stats", lambda: ("/get_cache_stats", {"api_key": DESIGNER}), 0, 0, 0),
+        check("metrics", lambda: ("/metrics", {"api_key": DESIGNER}), 0, 0, 0),
+        check(
+            "watch_attribute",
+            lambda: ("/watch_attribute", {"item_id": random_item(), "attribute": "state", "api_key": ACTUATOR}),
+            1,
+            0,
+            0,
+        ),
+    ]
+    return checks
+
+
+def empty_caches():
+    # Empty the caches that are filled by the requests of players and actuators
+    server.item_cache.invalidate()
+    server.spatial_indexes.invalidate()
+    server.location_replicas.invalidate()
+
+
+def run_check(client, prepare, starts_job, cold=False):
+    """
+    Count the Firestore operations of a request (after a warm-up request).
+
+    Parameters
+
+    - client (FlaskClient): The test client.
+    - prepare (function): The function that prepares the request (see build_checks).
+    - starts_job (bool): Whether the request starts a job (whose operations are counted too).
+    - cold (bool): Whether to empty the caches before the request (the operations of their listeners are counted
+      too).
+
+    Returns
+
+    - A tuple (endpoint, dictionary of reads, writes and queries).
+    """
+    response = send(client, prepare())
+    if starts_job:
+        wait_for_job(response.get_data(as_text=True).split(",")[1])
+
+    # Let the snapshot listeners receive the changes made while preparing the request before counting
+    request_args = prepare()
+    time.sleep(LISTENER_DELAY)
+    if cold:
+        empty_caches()
+    endpoint = server.app.url_map.bind("").match(request_args[0])[0]
+    endpoints = [endpoint, "background"] if starts_job or cold else [endpoint]
+    before = [count_operations(name) for name in endpoints]
+    response = send(client, request_args)
+    if starts_job:
+        wait_for_job(response.get_data(as_text=True).split(",")[1])
+    if starts_job or cold:
+        time.sleep(LISTENER_DELAY)
+    after = [count_operations(name) for name in endpoints]
+
+    counts = {key: 0 for key in COUNTERS}
+    for previous, current in zip(before, after):
+        for key in COUNTERS:
+            counts[key] += int(current[key] - previous[key])
+    return endpoint, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the Firestore operations of each endpoint against a budget")
+    parser.add_argument(
+        "--sizes",
+        type=str,
+        default="10,1000",
+        help="Numbers of items of the datasets (comma-separated). Default is 10,1000.",
+    )
+
+    args = parser.parse_args()
+
+    server.limiter.enabled = False
+    client = server.app.test_client()
+    for tag in TAGS + BUDGET_TAGS:
+        send(client, ("/create_tag", {"name": tag, "api_key": DESIGNER}))
+
+    failures = []
+    covered = set()
+    for size in sorted(int(size) for size in args.sizes.split(",")):
+        dataset = seed_dataset(client, size)
+        print(f"\nDataset: {size} items")
+        print(f"{'check':<40}{'reads':>14}{'writes':>14}{'queries':>14}")
+        previous_ids = document_ids()
+        for name, prepare, budget, starts_job, cold in build_checks(client, dataset):
+            endpoint, counts = run_check(client, prepare, starts_job, cold)
+            delete_new_documents(previous_ids, dataset["location_id"])
+            covered.add(endpoint)
+            over = [key for key in COUNTERS if counts[key] > budget[key]]
+            print(
+                f"{name:<40}"
+                + "".join(f"{f'{counts[key]} / {budget[key]}':>14}" for key in COUNTERS)
+                + (f"  over budget ({', '.join(over)})" if len(over) > 0 else "")
+            )
+            if len(over) > 0:
+                failures.append(f"{name}[{size}]: " + ", ".join(f"{key} {counts[key]} > {budget[key]}" for key in over))
+
+    # Report the routes that no check covers
+    uncovered = sorted(rule.endpoint for rule in server.app.url_map.iter_rules() if rule.endpoint not in covered)
+    uncovered = [endpoint for endpoint in uncovered if endpoint != "static"]
+    if len(uncovered) > 0:
+        print(f"\nRoutes without a budget: {', '.join(uncovered)}")
+
+    if len(failures) > 0:
+        print(f"\n{len(failures)} checks over budget:")
+        for failure in failures:
+            print(f"- {failure}")
+        sys.exit(1)
+    print("\nAll checks within budget")
+
+
+if __name__ == "__main__":
+    main()
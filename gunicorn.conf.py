@@ -0,0 +1,30 @@
+# import necessary libraries
+import os
+import shutil
+import tempfile
+
+# gunicorn loads this file from the working directory (e.g., with the start command gunicorn server:app). The worker
+# processes write their metrics to files in PROMETHEUS_MULTIPROC_DIR so that /metrics reports the metrics of all the
+# workers (see metrics.py). The variable must be set before the workers import server.py.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "prometheus_multiproc"))
+
+# Serve the requests with threads, so that a long poll or an event stream of watch_attribute occupies one thread
+# instead of a whole worker process. With threaded workers, the timeout only restarts a worker that stops responding
+# (not a long request), and it is kept above the longest wait of watch_attribute (WATCH_MAX_TIMEOUT in server.py).
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+timeout = 120
+
+
+def on_starting(server):
+    # Remove the metrics of the previous run of the server
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    # Keep the counters of an exited worker but drop its live values
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
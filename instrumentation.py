@@ -0,0 +1,245 @@
+# import necessary libraries
+import time
+
+# This module wraps a Firestore client (or a MemoryClient) so that every operation made through it is reported to a
+# callback, e.g., to count the documents read and written by each endpoint. The wrappers forward everything else to
+# the wrapped objects, so the rest of the server uses them like the original client.
+#
+# The callback receives the operation (get, get_all, query, set, update, delete, create, commit, listen, or
+# transaction_retry), the collection (comma-separated if a batch writes to several collections), the number of
+# documents read or written, the duration in seconds, and the exception raised (None if the operation succeeded).
+
+# The operations that read documents and the operations that write documents
+READ_OPERATIONS = ["get", "get_all", "query", "listen"]
+WRITE_OPERATIONS = ["set", "update", "delete", "create", "commit"]
+
+
+def unwrap(value):
+    # Get the wrapped object of a wrapper (e.g., a reference passed to a batch), or the value itself
+    return value.wrapped if isinstance(value, Wrapper) else value
+
+
+def collection_of(reference):
+    # Get the name of the collection of a document reference
+    return unwrap(reference).parent.id
+
+
+class Wrapper:
+    """
+    The base class of the wrappers. Attributes that are not wrapped are read from the wrapped object.
+    """
+
+    def __init__(self, wrapped, on_operation):
+        self.wrapped = wrapped
+        self._on_operation = on_operation
+
+    def __getattr__(self, name):
+        # Avoid an infinite recursion if the wrapped object is not set yet (e.g., while copying a wrapper)
+        if name == "wrapped":
+            raise AttributeError(name)
+        return getattr(self.wrapped, name)
+
+    def __eq__(self, other):
+        return self.wrapped == unwrap(other)
+
+    def __hash__(self):
+        return hash(self.wrapped)
+
+    def _report(self, operation, collection, documents, start, error=None):
+        self._on_operation(operation, collection, documents, time.perf_counter() - start, error)
+
+    def _call(self, operation, collection, documents, function, *args, **kwargs):
+        # Call a function of the wrapped object and report it. documents is a number, or a function that counts the
+        # documents in the result
+        start = time.perf_counter()
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            self._report(operation, collection, 0, start, e)
+            raise
+        self._report(operation, collection, documents(result) if callable(documents) else documents, start)
+        return result
+
+    def _stream(self, operation, collection, function, *args, **kwargs):
+        # Call a function of the wrapped object that returns an iterator and report it when the iterator is exhausted
+        # or closed (e.g., when a streamed response ends)
+        start = time.perf_counter()
+        args = [unwrap(arg) for arg in args]
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+        documents, error = 0, None
+        try:
+            for document in function(*args, **kwargs):
+                documents += 1
+                yield document
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._report(operation, collection, documents, start, error)
+
+    def _wrap_callback(self, collection, callback):
+        # Report the documents received by a snapshot listener before calling the callback
+        def on_snapshot(docs, changes, read_time):
+            self._on_operation("listen", collection, len(changes), 0.0, None)
+            callback(docs, changes, read_time)
+
+        return on_snapshot
+
+
+class InstrumentedClient(Wrapper):
+    """
+    A wrapper of a Firestore client that reports its operations.
+
+    Parameters
+
+    - wrapped (Client or MemoryClient): The client.
+    - on_operation (function): The callback (operation, collection, documents, duration, error).
+    """
+
+    def collection(self, collection_id):
+        return InstrumentedQuery(self.wrapped.collection(collection_id), self._on_operation, collection_id)
+
+    def document(self, document_path):
+        return InstrumentedDocument(self.wrapped.document(document_path), self._on_operation)
+
+    def get_all(self, references, **kwargs):
+        references = list(references)
+        collection = ",".join(sorted({collection_of(reference) for reference in references}))
+        return self._stream("get_all", collection, self.wrapped.get_all, [unwrap(ref) for ref in references], **kwargs)
+
+    def batch(self):
+        return InstrumentedBatch(self.wrapped.batch(), self._on_operation)
+
+    def transaction(self, **kwargs):
+        return InstrumentedTransaction(self.wrapped.transaction(**kwargs), self._on_operation)
+
+
+class InstrumentedQuery(Wrapper):
+    """
+    A wrapper of a query or a collection reference that reports the queries and the snapshot listeners.
+    """
+
+    def __init__(self, wrapped, on_operation, collection):
+        super().__init__(wrapped, on_operation)
+        self._collection = collection
+
+    def _query(self, query):
+        return InstrumentedQuery(query, self._on_operation, self._collection)
+
+    def where(self, *args, **kwargs):
+        return self._query(self.wrapped.where(*args, **kwargs))
+
+    def order_by(self, *args, **kwargs):
+        return self._query(self.wrapped.order_by(*args, **kwargs))
+
+    def limit(self, count):
+        return self._query(self.wrapped.limit(count))
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._query(self.wrapped.start_after(document_fields_or_snapshot))
+
+    def select(self, field_paths):
+        return self._query(self.wrapped.select(field_paths))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self.wrapped.document(*args, **kwargs), self._on_operation)
+
+    def get(self, **kwargs):
+        return self._call("query", self._collection, len, self.wrapped.get, **kwargs)
+
+    def stream(self, **kwargs):
+        return self._stream("query", self._collection, self.wrapped.stream, **kwargs)
+
+    def on_snapshot(self, callback):
+        return self.wrapped.on_snapshot(self._wrap_callback(self._collection, callback))
+
+
+class InstrumentedDocument(Wrapper):
+    """
+    A wrapper of a document reference that reports the reads, the writes and the snapshot listeners.
+    """
+
+    def get(self, **kwargs):
+        return self._call("get", collection_of(self), 1, self.wrapped.get, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call("set", collection_of(self), 1, self.wrapped.set, *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._call("update", collection_of(self), 1, self.wrapped.update, *args, **kwargs)
+
+    def delete(self, **kwargs):
+        return self._call("delete", collection_of(self), 1, self.wrapped.delete, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._call("create", collection_of(self), 1, self.wrapped.create, *args, **kwargs)
+
+    def collection(self, collection_id):
+        return InstrumentedQuery(self.wrapped.collection(collection_id), self._on_operation, collection_id)
+
+    def on_snapshot(self, callback):
+        return self.wrapped.on_snapshot(self._wrap_callback(collection_of(self), callback))
+
+
+class InstrumentedBatch(Wrapper):
+    """
+    A wrapper of a write batch that reports the writes when they are committed.
+    """
+
+    def __init__(self, wrapped, on_operation):
+        super().__init__(wrapped, on_operation)
+        self._collections = set()
+        self._writes = 0
+
+    def _add(self, method, reference, *args, **kwargs):
+        self._collections.add(collection_of(reference))
+        self._writes += 1
+        return method(unwrap(reference), *args, **kwargs)
+
+    def set(self, reference, *args, **kwargs):
+        return self._add(self.wrapped.set, reference, *args, **kwargs)
+
+    def update(self, reference, *args, **kwargs):
+        return self._add(self.wrapped.update, reference, *args, **kwargs)
+
+    def delete(self, reference, *args, **kwargs):
+        return self._add(self.wrapped.delete, reference, *args, **kwargs)
+
+    def create(self, reference, *args, **kwargs):
+        return self._add(self.wrapped.create, reference, *args, **kwargs)
+
+    def commit(self, **kwargs):
+        collections, writes = ",".join(sorted(self._collections)), self._writes
+        self._collections, self._writes = set(), 0
+        return self._call("commit", collections, writes, self.wrapped.commit, **kwargs)
+
+
+class InstrumentedTransaction(InstrumentedBatch):
+    """
+    A wrapper of a transaction that reports the reads, the writes when they are committed, and the retries.
+    """
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, InstrumentedDocument):
+            return self._call("get", collection_of(ref_or_query), 1, self.wrapped.get, ref_or_query, **kwargs)
+        collection = getattr(ref_or_query, "_collection", None)
+        return self._stream("query", collection, self.wrapped.get, ref_or_query, **kwargs)
+
+    def get_all(self, references, **kwargs):
+        references = list(references)
+        collection = ",".join(sorted({collection_of(reference) for reference in references}))
+        return self._stream("get_all", collection, self.wrapped.get_all, [unwrap(ref) for ref in references], **kwargs)
+
+    def _begin(self, retry_id=None):
+        # Called by firestore.transactional before each attempt (retry_id is the id of the previous attempt)
+        if retry_id is not None:
+            self._on_operation("transaction_retry", None, 0, 0.0, None)
+        self._collections, self._writes = set(), 0
+        return self.wrapped._begin(retry_id=retry_id)
+
+    def _commit(self):
+        # Called by firestore.transactional to commit an attempt
+        collections, writes = ",".join(sorted(self._collections)), self._writes
+        return self._call("commit", collections, writes, self.wrapped._commit)
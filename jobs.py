@@ -0,0 +1,78 @@
+# import necessary libraries
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+# This module runs long operations (e.g., deleting all items in a location) in background threads so that the HTTP
+# request that starts them can return immediately. The state of each job is stored in the jobs collection, so any
+# worker process can report the progress of a job started by another one. A job that was running when its worker
+# process stopped stays RUNNING; start the operation again to finish it.
+
+
+class JobRunner:
+    """
+    Runs jobs in a pool of background threads and records their progress in the jobs collection.
+    """
+
+    def __init__(self, db, max_workers=2):
+        self._db = db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def start(self, job_type, target, function):
+        """
+        Start a job.
+
+        Parameters
+
+        - job_type (string): The type of the job (e.g., DELETE_ITEMS).
+        - target (string): The id of the document the job works on (e.g., a location_id).
+        - function (function): The function to run. It receives a callback to report the progress (an integer, e.g.,
+          the number of documents processed so far) and returns the final progress.
+
+        Returns
+
+        - job_id (string): The id of the job.
+        """
+        job_id = str(uuid.uuid4())
+        job_ref = self._db.collection("jobs").document(job_id)
+        now = datetime.now(timezone.utc)
+        job_ref.set(
+            {
+                "job_id": job_id,
+                "type": job_type,
+                "target": target,
+                "status": "RUNNING",
+                "progress": 0,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        self._executor.submit(self._run, job_ref, function)
+        return job_id
+
+    def _run(self, job_ref, function):
+        def report_progress(progress):
+            job_ref.update({"progress": progress, "updated_at": datetime.now(timezone.utc)})
+
+        try:
+            progress = function(report_progress)
+            job_ref.update({"status": "DONE", "progress": progress, "updated_at": datetime.now(timezone.utc)})
+        except Exception as e:
+            job_ref.update({"status": "FAILED", "error": str(e), "updated_at": datetime.now(timezone.utc)})
+
+    def get(self, job_id):
+        """
+        Get the state of a job.
+
+        Parameters
+
+        - job_id (string): The id of the job.
+
+        Returns
+
+        - The job as a dictionary (job_id, type, target, status, progress, error), or None if the job does not exist.
+        """
+        if not job_id or "/" in job_id:
+            return None
+        return self._db.collection("jobs").document(job_id).get().to_dict()
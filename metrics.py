@@ -0,0 +1,125 @@
+# import necessary libraries
+import os
+import time
+
+from flask import g, has_request_context, request
+from google.api_core.exceptions import DeadlineExceeded
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+from instrumentation import READ_OPERATIONS, WRITE_OPERATIONS
+
+# This module records the requests handled by the server and the Firestore operations they make, and renders them in
+# the Prometheus text format. Each gunicorn worker process has its own metrics; if the PROMETHEUS_MULTIPROC_DIR
+# environment variable is set (gunicorn.conf.py sets it), the workers write their metrics to files in that directory
+# and the worker that handles a scrape merges the files of all the workers.
+
+REQUESTS = Counter("http_requests_total", "The number of requests handled.", ["endpoint", "status"])
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "The time to handle a request (until the first byte for streamed responses).",
+    ["endpoint"],
+)
+FIRESTORE_READS = Counter("firestore_document_reads_total", "The number of Firestore documents read.", ["endpoint"])
+FIRESTORE_WRITES = Counter(
+    "firestore_document_writes_total", "The number of Firestore documents written.", ["endpoint"]
+)
+FIRESTORE_QUERIES = Counter("firestore_queries_total", "The number of Firestore queries run.", ["endpoint"])
+FIRESTORE_TRANSACTION_RETRIES = Counter(
+    "firestore_transaction_retries_total",
+    "The number of Firestore transactions retried after a conflict.",
+    ["endpoint"],
+)
+FIRESTORE_DEADLINE_EXCEEDED = Counter(
+    "firestore_deadline_exceeded_total", "The number of Firestore calls that hit DeadlineExceeded.", ["endpoint"]
+)
+
+
+def current_endpoint():
+    # Get the endpoint of the request being handled, or "background" outside of a request (e.g., jobs and listeners)
+    if has_request_context():
+        return request.endpoint or "unknown"
+    return "background"
+
+
+def record_firestore_operation(operation, collection, documents, duration, error):
+    """
+    Record a Firestore operation reported by an InstrumentedClient.
+
+    Parameters
+
+    - operation (string): The operation (see instrumentation.py).
+    - collection (string): The collection.
+    - documents (int): The number of documents read or written.
+    - duration (float): The duration of the operation in seconds.
+    - error (Exception): The exception raised by the operation (None if it succeeded).
+    """
+    endpoint = current_endpoint()
+    if operation == "query":
+        FIRESTORE_QUERIES.labels(endpoint).inc()
+    if operation in READ_OPERATIONS and documents > 0:
+        FIRESTORE_READS.labels(endpoint).inc(documents)
+    elif operation in WRITE_OPERATIONS and documents > 0 and error is None:
+        FIRESTORE_WRITES.labels(endpoint).inc(documents)
+    elif operation == "transaction_retry":
+        FIRESTORE_TRANSACTION_RETRIES.labels(endpoint).inc()
+    if isinstance(error, DeadlineExceeded):
+        FIRESTORE_DEADLINE_EXCEEDED.labels(endpoint).inc()
+
+
+def record_retried_error(error):
+    """
+    Record an error of a Firestore call that is about to be retried (the on_error callback of a Retry).
+
+    Parameters
+
+    - error (Exception): The error.
+    """
+    if isinstance(error, DeadlineExceeded):
+        FIRESTORE_DEADLINE_EXCEEDED.labels(current_endpoint()).inc()
+
+
+def init_metrics(app):
+    """
+    Record the count, the status code and the duration of every request handled by a Flask application.
+
+    Parameters
+
+    - app (Flask): The application.
+    """
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unknown"
+            REQUESTS.labels(endpoint, str(response.status_code)).inc()
+            REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - start)
+        return response
+
+
+def render_metrics():
+    """
+    Render the metrics in the Prometheus text format (merging all the worker processes in the multiprocess mode).
+
+    Returns
+
+    - A tuple (body, content_type).
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,21 +1,47 @@
 # import necessary libraries
+import base64
+import csv
+import hashlib
+import io
 import json
 import math
 import os
 import re
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 
+import orjson
 from firebase_admin import credentials, firestore
-from flask import Flask, request
+from flask import Flask, Response, request, stream_with_context
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from google.api_core.exceptions import Aborted, DeadlineExceeded
 from google.api_core.retry import Retry
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
 from google.cloud.firestore_v1.transaction import Transaction
 
+from binary_format import BINARY_MIMETYPE, pack_item, pack_value
+from cache import ItemCache, LocationCache, LocationReplicaCache, SpatialIndexCache, TagRegistry
+from counters import ShardedCounters
+from instrumentation import InstrumentedClient
+from jobs import JobRunner
+from metrics import init_metrics, record_firestore_operation, record_retried_error, render_metrics
+from spatial import (
+    GEOHASH_PRECISION,
+    calculate_distance_for_indoor,
+    calculate_distance_for_outdoor,
+    geohash_cover,
+    geohash_encode,
+    is_valid_coordinates,
+)
+from storage import MemoryClient, transactional
+from tracing import RequestTracer
+from watch import ItemWatchHub
+from write_buffer import AttributeWriteBuffer, parse_policies
+
 # Initialize the Flask application
 app = Flask(__name__)
 
@@ -28,7 +54,57 @@ limiter = Limiter(
 )
 
 # Enable CORS
-CORS(app)
+CORS(app, expose_headers=["ETag", "X-Next-Page-Token"])
+
+# Record the requests and the Firestore operations of each endpoint for the /metrics endpoint (enabled by default)
+METRICS = os.environ.get("METRICS", "true") == "true"
+if METRICS:
+    init_metrics(app)
+
+# Log the Firestore calls of each request in order, and the slow requests to the slow log (opt-in, see tracing.py)
+TRACING = os.environ.get("TRACING", "false") == "true"
+request_tracer = RequestTracer(
+    slow_threshold=float(os.environ.get("TRACE_SLOW_THRESHOLD", "1.0")),
+    slow_log_path=os.environ.get("TRACE_SLOW_LOG", "slow_requests.jsonl"),
+)
+if TRACING:
+    request_tracer.init_app(app)
+
+
+def record_firestore_call(operation, collection, documents, duration, error):
+    """
+    INTERNAL_FUNCTION
+
+    Reports a Firestore operation made through the instrumented client to the metrics and the tracer.
+
+    Parameters
+
+    - operation (string): The operation (see instrumentation.py).
+    - collection (string): The collection.
+    - documents (int): The number of documents read or written.
+    - duration (float): The duration of the operation in seconds.
+    - error (Exception): The exception raised by the operation (None if it succeeded).
+    """
+    if METRICS:
+        record_firestore_operation(operation, collection, documents, duration, error)
+    if TRACING:
+        request_tracer.record(operation, collection, documents, duration, error)
+
+
+def record_firestore_retry(error):
+    """
+    INTERNAL_FUNCTION
+
+    Reports an error of a Firestore call that is about to be retried to the metrics and the tracer.
+
+    Parameters
+
+    - error (Exception): The error.
+    """
+    if METRICS:
+        record_retried_error(error)
+    if TRACING:
+        request_tracer.record_retry(error)
 
 
 # Define the custom retry strategy to shorten the timeout period (default is 60 seconds)
@@ -38,6 +114,7 @@ custom_retry = Retry(
     maximum=2.0,  # Maximum delay between retries in seconds
     multiplier=1.5,  # Multiplier applied to delay for each retry
     deadline=5.0,  # Maximum total time for all retries (in seconds)
+    on_error=record_firestore_retry,  # Count the retries for the metrics and the tracer
 )
 
 
@@ -71,10 +148,135 @@ def handle_firestore_errors(func):
     return wrapper
 
 
-# Load the Firestore credentials from the environment variable
-config_json = os.environ.get("SERVICE_ACCOUNT_KEY_JSON")
-config = json.loads(config_json)
-db = firestore.Client.from_service_account_info(config)
+# Select the storage backend from the environment variable (firestore or memory, default is firestore)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore")
+if STORAGE_BACKEND == "memory":
+    # Use the in-process storage engine (no Google project required, data is lost when the process exits)
+    db = MemoryClient()
+elif STORAGE_BACKEND == "firestore":
+    # Load the Firestore credentials from the environment variable
+    config_json = os.environ.get("SERVICE_ACCOUNT_KEY_JSON")
+    config = json.loads(config_json)
+    db = firestore.Client.from_service_account_info(config)
+else:
+    raise ValueError(f"Invalid STORAGE_BACKEND (should be firestore or memory): {STORAGE_BACKEND}")
+
+# Report the operations made through the client (including the caches, the listeners and the jobs)
+if METRICS or TRACING:
+    db = InstrumentedClient(db, record_firestore_call)
+
+# Cache the locations since they are read by almost every item request but rarely change
+location_cache = LocationCache(
+    db,
+    ttl=float(os.environ.get("LOCATION_CACHE_TTL", "60")),
+    use_listener=os.environ.get("LOCATION_CACHE_LISTENER", "true") == "true",
+)
+
+# Keep a registry of the tag names so that the tags of items can be validated without a query per tag
+tag_registry = TagRegistry(
+    db,
+    ttl=float(os.environ.get("TAG_CACHE_TTL", "60")),
+    use_listener=os.environ.get("TAG_CACHE_LISTENER", "true") == "true",
+)
+
+# Keep a spatial index for each location so that radius queries only read the items near the position, updated by a
+# snapshot listener on the items of the location
+spatial_indexes = SpatialIndexCache(
+    db,
+    ttl=float(os.environ.get("SPATIAL_INDEX_TTL", "30")),
+    idle_ttl=float(os.environ.get("SPATIAL_INDEX_IDLE_TTL", "300")),
+    use_listener=os.environ.get("SPATIAL_INDEX_LISTENER", "true") == "true",
+    grid_cell_size=float(os.environ.get("SPATIAL_GRID_CELL_SIZE", "2.0")),
+)
+
+# Keep an in-memory replica of the items of each location recently listed, updated by a snapshot listener, and serve
+# list_items from it (opt-in since each replica holds all the items of the location in memory)
+LOCATION_REPLICA = os.environ.get("LOCATION_REPLICA", "false") == "true"
+location_replicas = LocationReplicaCache(
+    db,
+    idle_ttl=float(os.environ.get("LOCATION_REPLICA_IDLE_TTL", "300")),
+    max_locations=int(os.environ.get("LOCATION_REPLICA_MAX_LOCATIONS", "20")),
+    grid_cell_size=float(os.environ.get("SPATIAL_GRID_CELL_SIZE", "2.0")),
+)
+
+# The number of items fetched at once when reading the candidates found in a spatial index
+SPATIAL_FETCH_BATCH_SIZE = 300
+
+# The maximum number of items created by a single create_items request
+MAX_ITEMS_PER_REQUEST = 10000
+
+# The maximum number of items read by a single get_attributes request
+MAX_ITEMS_PER_BULK_READ = 500
+
+# The maximum number of writes in a single batch (limited by Firestore)
+MAX_WRITES_PER_BATCH = 500
+
+# The number of items read at once when deleting all items in a location, and the number of batches committed in
+# parallel
+DELETE_PAGE_SIZE = 2000
+DELETE_PARALLEL_COMMITS = 4
+
+# Run long operations (e.g., deleting all items in a location) in the background
+job_runner = JobRunner(db)
+
+# Query OUTDOOR items by their geohash field instead of the spatial index (run backfill_geohash.py before enabling)
+GEOHASH_PREFILTER = os.environ.get("GEOHASH_PREFILTER", "false") == "true"
+
+# The maximum number of geohash range queries issued for a radius query
+GEOHASH_MAX_RANGES = 8
+
+# Cache the items read by get_item and get_attribute, since players in the same room read the same items
+item_cache = ItemCache(
+    db,
+    max_size=int(os.environ.get("ITEM_CACHE_SIZE", "1000")),
+    ttl=float(os.environ.get("ITEM_CACHE_TTL", "2")),
+)
+
+# Buffer the attribute updates from sensors and write them at a fixed interval instead of one transaction per update
+SENSOR_WRITE_BEHIND = os.environ.get("SENSOR_WRITE_BEHIND", "false") == "true"
+sensor_write_buffer = AttributeWriteBuffer(
+    db,
+    flush_interval=float(os.environ.get("SENSOR_FLUSH_INTERVAL", "1.0")),
+    deadbands=parse_policies(os.environ.get("SENSOR_DEADBANDS")),
+    min_intervals=parse_policies(os.environ.get("SENSOR_MIN_INTERVALS")),
+    on_flush=item_cache.invalidate_many,
+)
+
+# Spread the increments/decrements of very hot attributes (comma-separated names, e.g., "votes") over shard documents
+sharded_counters = ShardedCounters(
+    db,
+    attributes=[attribute for attribute in os.environ.get("SHARDED_COUNTERS", "").split(",") if attribute != ""],
+    num_shards=int(os.environ.get("COUNTER_SHARDS", "10")),
+    max_writes_per_batch=MAX_WRITES_PER_BATCH,
+)
+
+# Share one snapshot listener per watched item among the watch_attribute requests of this worker process
+item_watch_hub = ItemWatchHub(db)
+
+# The default and maximum time (in seconds) a watch_attribute request waits for a change, and the interval of the
+# keep-alive comments sent to an event stream (keep the maximum below the worker timeout in gunicorn.conf.py)
+WATCH_DEFAULT_TIMEOUT = 25
+WATCH_MAX_TIMEOUT = 60
+WATCH_KEEP_ALIVE_INTERVAL = 15
+
+# The response header that carries the token of the next page of list_items, list_tags and list_locations
+NEXT_PAGE_TOKEN_HEADER = "X-Next-Page-Token"
+
+# Lists with a larger limit than this are streamed while the documents are read, without the ETag and
+# X-Next-Page-Token headers (since they depend on all the documents)
+LIST_STREAM_THRESHOLD = 1000
+
+# The formatters of a line of the CSV responses of items and locations
+ITEM_CSV_ROW = '{},"{}",{},{},{},{}\n'.format
+LOCATION_CSV_ROW = '{},"{}",{}\n'.format
+
+# The formats of the responses of get_item, list_items and get_attribute (see binary_format.py for the binary format),
+# and of the other read endpoints
+RESPONSE_FORMATS = ["csv", "binary", "ndjson", "json"]
+TEXT_FORMATS = ["csv", "ndjson", "json"]
+
+# The MIME types of the formats (CSV responses keep the default MIME type of Flask, text/html)
+FORMAT_MIMETYPES = {"binary": BINARY_MIMETYPE, "ndjson": "application/x-ndjson", "json": "application/json"}
 
 # Set the API keys from the environment variables
 API_KEY_DESIGNER = os.environ.get("API_KEY_DESIGNER")
@@ -136,70 +338,51 @@ def is_numeric_string(s):
     return bool(re.match(pattern, s))
 
 
-@app.route("/create_item", methods=["GET"])
-@handle_firestore_errors
-def create_item():
+def build_item(location_id, location, owner, name, type, coordinates, tags, attributes):
     """
-    Allows a designer to create a new item with specific attributes, including a timer and visibility.
+    INTERNAL_FUNCTION
+
+    Validates the parameters of a new item and converts them to an item document. The existence of the tags is not
+    checked, so that the tags of many items can be checked at once.
 
     Parameters
 
     - location_id (string): The location_id of the item.
-    - owner (string): The name of the owner of the item, should be either PUBLIC_DOMAIN or A_PLAYER (optional, default is PUBLIC_DOMAIN).
-    - name (string): The name of the item (e.g., "flyer", don't have to be unique, can't contain commas).
-    - type (string): The type of the item (e.g., FLYER).
-    - coordinates (string): The coordinates of the item (x, y, z for an INDOOR location or latitude, longitude for an OUTDOOR location, comma-separated).
-    - tags (string): The tags of the item (comma-separated, e.g., "tag1,tag2", optional).
-    - attributes (string): The attributes of the item (comma-separated, e.g., "color=blue,shape=circle", optional).
-    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+    - location (dict): The location of the item (None if the location does not exist).
+    - owner (string): The name of the owner of the item (optional).
+    - name (string): The name of the item.
+    - type (string): The type of the item.
+    - coordinates (string): The coordinates of the item (comma-separated).
+    - tags (string): The tags of the item (comma-separated, optional).
+    - attributes (string): The attributes of the item (comma-separated key-value pairs, optional).
 
-    Response
+    Returns
 
-    - message (string): A message indicating that the item was created successfully.
-    - status code (integer): HTTP status code.
-    """
-    # Extract parameters from the request
-    location_id = request.args.get("location_id")
-    owner = request.args.get("owner")
-    name = request.args.get("name")
-    type = request.args.get("type")
-    coordinates = request.args.get("coordinates")
-    tags = request.args.get("tags")
-    attributes = request.args.get("attributes")
-    api_key = request.args.get("api_key")
+    - item (dict): The item document (without the item_id).
 
-    # Check if the API key is valid
-    if api_key != API_KEY_DESIGNER:
-        return "Invalid API key", 400
+    Raises
 
+    - ValueError: If a parameter is invalid.
+    """
     # Default to PUBLIC_DOMAIN if owner is not specified
     if owner is None:
         owner = "PUBLIC_DOMAIN"
     else:
         # If specified, check if the owner is valid
         if owner not in ["PUBLIC_DOMAIN", "A_PLAYER"]:
-            return "Invalid owner", 400
+            raise ValueError("Invalid owner")
 
     # Check if the name is valid (at least one character, can't contain commas)
     if name is None or len(name) == 0 or "," in name:
-        return "Invalid name (at least one character, can't contain commas)", 400
+        raise ValueError("Invalid name (at least one character, can't contain commas)")
 
     # Check if the type is not empty
     if type is None:
-        return "Invalid type", 400
+        raise ValueError("Invalid type")
 
-    # Check if the location_id is valid
-    if location_id is None:
-        return "Invalid location_id", 400
-    else:
-        # Check if the location_id exists
-        locations_ref = db.collection("locations")
-        query_ref = locations_ref.where(
-            filter=FieldFilter(field_path="location_id", op_string="==", value=location_id)
-        )
-        locations = query_ref.get(retry=custom_retry)
-        if len(locations) == 0:
-            return "Invalid location_id", 400
+    # Check if the location_id is valid (the location must exist)
+    if location_id is None or location is None:
+        raise ValueError("Invalid location_id")
 
     # Check if the attributes are valid
     if attributes is not None:
@@ -207,14 +390,14 @@ def create_item():
         try:
             attributes = dict(map(lambda x: x.split("="), attributes.split(",")))
         except Exception as e:
-            return "Invalid attributes (must be comma-separated key-value pairs)", 400
+            raise ValueError("Invalid attributes (must be comma-separated key-value pairs)")
 
         # Check if keys and values are valid (can't contain commas, spaces, or equal signs)
         for key, value in attributes.items():
             if "," in key or " " in key or "=" in key:
-                return f"Invalid attribute key (can't contain commas, spaces, or equal signs): {key}", 400
+                raise ValueError(f"Invalid attribute key (can't contain commas, spaces, or equal signs): {key}")
             if "," in value or " " in value or "=" in value:
-                return f"Invalid attribute value (can't contain commas, spaces, or equal signs): {value}", 400
+                raise ValueError(f"Invalid attribute value (can't contain commas, spaces, or equal signs): {value}")
 
             # Convert the value to an integer or a float if the value is a number
             if is_numeric_string(value):
@@ -225,25 +408,21 @@ def create_item():
 
     # Check if the coordinates are valid
     if coordinates is None:
-        return "Invalid coordinates (you must specify coordinates)", 400
+        raise ValueError("Invalid coordinates (you must specify coordinates)")
     else:
         # Check if the coordinates are in the correct format
         try:
             coordinates = list(map(float, coordinates.split(",")))
         except Exception as e:
-            return "Invalid coordinates (must be comma-separated numbers)", 400
+            raise ValueError("Invalid coordinates (must be comma-separated numbers)")
+        if not all(math.isfinite(c) for c in coordinates):
+            raise ValueError("Invalid coordinates (must be finite numbers)")
 
         # Check if the coordinates are in the correct format for the location type
-        locations_ref = db.collection("locations")
-        query_ref = locations_ref.where(
-            filter=FieldFilter(field_path="location_id", op_string="==", value=location_id)
-        )
-        locations = query_ref.get(retry=custom_retry)
-        location = locations[0].to_dict()
         if location["type"] == "INDOOR" and len(coordinates) != 3:
-            return "Invalid coordinates (must be x, y, z)", 400
+            raise ValueError("Invalid coordinates (must be x, y, z)")
         elif location["type"] == "OUTDOOR" and len(coordinates) != 2:
-            return "Invalid coordinates (must be latitude, longitude)", 400
+            raise ValueError("Invalid coordinates (must be latitude, longitude)")
 
     # Check if the tags are valid
     if tags is not None:
@@ -251,43 +430,238 @@ def create_item():
         try:
             tags = tags.split(",")
         except Exception as e:
-            return "Invalid tags (must be comma-separated)", 400
+            raise ValueError("Invalid tags (must be comma-separated)")
 
         # Check if all the tags are valid
         for tag in tags:
             if len(tag) == 0:
-                return "Invalid tags (at least one character)", 400
+                raise ValueError("Invalid tags (at least one character)")
+
+    # Create the item document (with a geohash if the location is OUTDOOR)
+    item = {
+        "owner": owner,
+        "name": name,
+        "type": type,
+        "location_id": location_id,
+        "coordinates": coordinates,
+        "tags": tags,
+        "attributes": attributes,
+    }
+    geohash = item_geohash(location, coordinates)
+    if geohash is not None:
+        item["geohash"] = geohash
+    return item
+
 
-            # Check if the tag exists
-            tags_ref = db.collection("tags")
-            query_ref = tags_ref.where(filter=FieldFilter(field_path="name", op_string="==", value=tag))
-            found_tags = query_ref.get(retry=custom_retry)
-            if len(found_tags) == 0:
-                return "Invalid tags (tag does not exist)", 400
+@app.route("/create_item", methods=["GET"])
+@handle_firestore_errors
+def create_item():
+    """
+    Allows a designer to create a new item with specific attributes, including a timer and visibility.
+
+    Parameters
+
+    - location_id (string): The location_id of the item.
+    - owner (string): The name of the owner of the item, should be either PUBLIC_DOMAIN or A_PLAYER (optional, default is PUBLIC_DOMAIN).
+    - name (string): The name of the item (e.g., "flyer", don't have to be unique, can't contain commas).
+    - type (string): The type of the item (e.g., FLYER).
+    - coordinates (string): The coordinates of the item (x, y, z for an INDOOR location or latitude, longitude for an OUTDOOR location, comma-separated).
+    - tags (string): The tags of the item (comma-separated, e.g., "tag1,tag2", optional).
+    - attributes (string): The attributes of the item (comma-separated, e.g., "color=blue,shape=circle", optional).
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+
+    Response
+
+    - message (string): A message indicating that the item was created successfully.
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    location_id = request.args.get("location_id")
+    owner = request.args.get("owner")
+    name = request.args.get("name")
+    type = request.args.get("type")
+    coordinates = request.args.get("coordinates")
+    tags = request.args.get("tags")
+    attributes = request.args.get("attributes")
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key != API_KEY_DESIGNER:
+        return "Invalid API key", 400
+
+    # Check if the parameters are valid
+    location = location_cache.get(location_id) if location_id is not None else None
+    try:
+        item = build_item(location_id, location, owner, name, type, coordinates, tags, attributes)
+    except ValueError as e:
+        return str(e), 400
+
+    # Check if the tags exist
+    if item["tags"] is not None and len(tag_registry.find_missing(item["tags"])) > 0:
+        return "Invalid tags (tag does not exist)", 400
 
     # Generate a unique id for the item
     item_id = str(uuid.uuid4())
 
     # Create a new item document in Firestore
     doc_ref = db.collection("items").document(item_id)
-    doc_ref.set(
-        {
-            "item_id": item_id,
-            "owner": owner,
-            "name": name,
-            "type": type,
-            "location_id": location_id,
-            "coordinates": coordinates,
-            "tags": tags,
-            "attributes": attributes,
-        },
-        retry=custom_retry,
-    )
+    doc_ref.set({"item_id": item_id, **item}, retry=custom_retry)
+
+    # Add the new item to the spatial index of the location
+    spatial_indexes.add(location_id, item_id, item["coordinates"])
 
     # Return a message telling that the item was created successfully
     return f"Item created successfully,{item_id}", 200
 
 
+def parse_items(text, format):
+    """
+    INTERNAL_FUNCTION
+
+    Parses the items of a create_items request into dictionaries of string parameters (the same format as the
+    parameters of create_item).
+
+    Parameters
+
+    - text (string): The items in CSV (with a header row) or NDJSON format.
+    - format (string): The format of the items (csv or ndjson).
+
+    Returns
+
+    - The list of dictionaries (owner, name, type, coordinates, tags, attributes).
+
+    Raises
+
+    - ValueError: If the items can't be parsed or a value has an invalid type.
+    """
+    if format == "csv":
+        return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+    rows = []
+    for line in text.splitlines():
+        if len(line.strip()) == 0:
+            continue
+        row = json.loads(line)
+        if not isinstance(row, dict):
+            raise ValueError("each line must be a JSON object")
+
+        # Accept lists for the coordinates and the tags, and an object for the attributes
+        if isinstance(row.get("coordinates"), list):
+            row["coordinates"] = ",".join(str(c) for c in row["coordinates"])
+        if isinstance(row.get("tags"), list):
+            row["tags"] = ",".join(row["tags"])
+        if isinstance(row.get("attributes"), dict):
+            row["attributes"] = ",".join(f"{key}={value}" for key, value in row["attributes"].items())
+
+        # Check that the values are strings after the conversions, like the values of the CSV format
+        expected_types = {
+            "coordinates": "a string or a list",
+            "tags": "a string or a list",
+            "attributes": "a string or an object",
+        }
+        for key in ["owner", "name", "type", "coordinates", "tags", "attributes"]:
+            if row.get(key) is not None and not isinstance(row[key], str):
+                raise ValueError(f"{key} must be {expected_types.get(key, 'a string')} (line {len(rows) + 1})")
+        rows.append(row)
+    return rows
+
+
+@app.route("/create_items", methods=["GET", "POST"])
+@handle_firestore_errors
+def create_items():
+    """
+    Allows a designer to create many items in a location at once.
+
+    Parameters
+
+    - location_id (string): The location_id of the items.
+    - format (string): The format of the items, should be either csv or ndjson (optional, default is csv).
+    - items (string): The items (optional, the body of a POST request is used if not specified). In csv format, the first row is a header with the names of the columns (name, type, coordinates, and optionally owner, tags, attributes), and values that contain commas are quoted with double quotations (e.g., "1,2,3"). In ndjson format, each line is a JSON object with the same keys.
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+
+    Response
+
+    - message (string): A message indicating that the items were created successfully, followed by a comma and the comma-separated ids of the new items in the order of the input.
+    - status code (integer): HTTP status code.
+
+    Notes
+
+    - Each item is validated in the same way as create_item. If any item is invalid, no items are created.
+    - Up to 10000 items can be created by a single request. The items are written in batches of 500.
+    """
+    # Extract parameters from the request
+    location_id = request.args.get("location_id")
+    format = request.args.get("format", "csv")
+    items = request.args.get("items")
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key != API_KEY_DESIGNER:
+        return "Invalid API key", 400
+
+    # Check if the format is valid
+    if format not in ["csv", "ndjson"]:
+        return "Invalid format (should be either csv or ndjson)", 400
+
+    # Check if the location_id is valid
+    location = location_cache.get(location_id) if location_id is not None else None
+    if location is None:
+        return "Invalid location_id", 400
+
+    # Parse the items (from the body of the request if not specified as a parameter)
+    if items is None:
+        items = request.get_data(as_text=True)
+    try:
+        rows = parse_items(items, format)
+    except Exception as e:
+        return f"Invalid items (must be in {format} format): {e}", 400
+
+    # Check if the number of items is valid
+    if len(rows) == 0:
+        return "Invalid items (at least one item)", 400
+    if len(rows) > MAX_ITEMS_PER_REQUEST:
+        return f"Invalid items (at most {MAX_ITEMS_PER_REQUEST} items)", 400
+
+    # Check if all the items are valid
+    new_items = []
+    for i, row in enumerate(rows):
+        try:
+            new_items.append(
+                build_item(
+                    location_id,
+                    location,
+                    row.get("owner") or None,
+                    row.get("name"),
+                    row.get("type"),
+                    row.get("coordinates"),
+                    row.get("tags") or None,
+                    row.get("attributes") or None,
+                )
+            )
+        except ValueError as e:
+            return f"Invalid item #{i + 1}: {e}", 400
+
+    # Check if the tags of all the items exist at once
+    missing_tags = tag_registry.find_missing(sorted({tag for item in new_items for tag in item["tags"] or []}))
+    if len(missing_tags) > 0:
+        return f"Invalid tags (tag does not exist): {missing_tags[0]}", 400
+
+    # Create the item documents in Firestore in batches
+    item_ids = [str(uuid.uuid4()) for _ in new_items]
+    for start in range(0, len(new_items), MAX_WRITES_PER_BATCH):
+        batch = db.batch()
+        for i in range(start, min(start + MAX_WRITES_PER_BATCH, len(new_items))):
+            batch.set(db.collection("items").document(item_ids[i]), {"item_id": item_ids[i], **new_items[i]})
+        batch.commit(retry=custom_retry)
+
+    # Add the new items to the spatial index of the location
+    for item_id, item in zip(item_ids, new_items):
+        spatial_indexes.add(location_id, item_id, item["coordinates"])
+
+    # Return a message telling that the items were created successfully
+    return "Items created successfully," + ",".join(item_ids), 200
+
+
 @app.route("/delete_item", methods=["GET"])
 @handle_firestore_errors
 def delete_item():
@@ -323,15 +697,44 @@ def delete_item():
         if len(items) == 0:
             return "Invalid item_id", 400
 
-    # Delete the item document from Firestore
+    # Delete the item document (and its counter shards) from Firestore and remove it from the spatial index of the
+    # location
     doc_ref = db.collection("items").document(item_id)
-    doc_ref.delete(retry=custom_retry)
+    if sharded_counters.enabled:
+        batch = db.batch()
+        batch.delete(doc_ref)
+        sharded_counters.delete(batch, item_id)
+        batch.commit(retry=custom_retry)
+    else:
+        doc_ref.delete(retry=custom_retry)
+    spatial_indexes.remove(items[0].to_dict()["location_id"], item_id)
+    item_cache.invalidate(item_id)
 
     # Return a message telling that the item was deleted successfully
     return "Item deleted successfully", 200
 
 
-def item_to_csv(item):
+def item_geohash(location, coordinates):
+    """
+    INTERNAL_FUNCTION
+
+    Calculates the geohash stored in an item so that OUTDOOR items can be queried by position.
+
+    Parameters
+
+    - location (dict): The location of the item.
+    - coordinates (list): The coordinates of the item.
+
+    Returns
+
+    - The geohash (string), or None if the item is not in an OUTDOOR location.
+    """
+    if location is None or location["type"] != "OUTDOOR" or not is_valid_coordinates(coordinates, 2):
+        return None
+    return geohash_encode(coordinates[0], coordinates[1], GEOHASH_PRECISION)
+
+
+def item_to_csv(item_id, item_data):
     """
     INTERNAL_FUNCTION
 
@@ -339,35 +742,341 @@ def item_to_csv(item):
 
     Parameters
 
-    - item (Item): The item to convert.
+    - item_id (string): The id of the item.
+    - item_data (dict): The item as a dictionary.
 
     Returns
 
     - item_in_csv (string): The item in CSV format.
     """
-    # Convert the item to CSV format. Regarding the coordinates, add trailing 0 if the length is 2 (i.e., OUTDOOR location)
-    name_str = f'"{item.to_dict()["name"]}"'
-    coordinates_csv = ",".join(
-        str(item.to_dict()["coordinates"][i]) for i in range(len(item.to_dict()["coordinates"]))
-    )
-    if len(coordinates_csv.split(",")) == 2:
+    # Convert the coordinates to CSV format. Add trailing 0 if the length is 2 (i.e., OUTDOOR location)
+    coordinates = item_data["coordinates"]
+    coordinates_csv = ",".join(map(str, coordinates))
+    if len(coordinates) == 2:
         coordinates_csv += ",0"
 
-    # If the item has no attributes (i.e., item.to_dict()["attributes"] is None), set the attributes_csv to "null"
+    # If the item has no attributes (i.e., item_data["attributes"] is None), set the attributes_csv to "null"
     # Otherwise, convert the attributes dictionary to key-value pairs in key=value format and separate them with semicolons
-    if item.to_dict()["attributes"] is None or item.to_dict()["attributes"] == {}:
+    attributes = item_data["attributes"]
+    if not attributes:
         attributes_str = "null"
     else:
         # Sort the attributes by key and convert the attributes dictionary to key-value pairs in key=value format
-        attributes_str = ";".join(
-            f"{key}={value}"
-            for key, value in sorted(item.to_dict()["attributes"].items(), key=lambda item: item[0])
-        )
+        attributes_str = ";".join(f"{key}={attributes[key]}" for key in sorted(attributes))
 
-    item_in_csv = (
-        f"{item.id},{name_str},{item.to_dict()['owner']},{item.to_dict()['type']},{coordinates_csv},{attributes_str}\n"
+    return ITEM_CSV_ROW(
+        item_id, item_data["name"], item_data["owner"], item_data["type"], coordinates_csv, attributes_str
     )
-    return item_in_csv
+
+
+def generate_rows(docs, to_row, empty_message=""):
+    """
+    INTERNAL_FUNCTION
+
+    Generates the rows of a list response one document at a time, so that a response can be streamed while the
+    documents are still being read.
+
+    Parameters
+
+    - docs (iterable): The document snapshots (e.g., the stream() of a query).
+    - to_row (function): A function that converts the id and the data of a document to a row (e.g., a line in CSV).
+    - empty_message (string): The response if there are no documents (optional).
+
+    Returns
+
+    - A generator of rows.
+    """
+    empty = True
+    for doc in docs:
+        empty = False
+        yield to_row(doc.id, doc.to_dict())
+    if empty and empty_message != "":
+        yield empty_message
+
+
+def response_format(formats=RESPONSE_FORMATS):
+    """
+    INTERNAL_FUNCTION
+
+    Returns the format of the response requested with the format parameter, or with the Accept header if the
+    parameter is omitted (e.g., "Accept: application/octet-stream" for the binary format). The Accept header selects a
+    format only if it does not also accept text (*/* or text/*), so clients that accept anything keep getting CSV.
+
+    Parameters
+
+    - formats (list): The formats the endpoint supports (default is RESPONSE_FORMATS).
+
+    Returns
+
+    - The format (one of formats), or None if the format parameter is invalid.
+    """
+    format = request.args.get("format")
+    if format is None:
+        # Keep CSV for clients that accept it (e.g., "Accept: application/json, text/plain, */*" from axios)
+        if any(mimetype == "*/*" or mimetype.startswith("text/") for mimetype, _ in request.accept_mimetypes):
+            return "csv"
+        best = request.accept_mimetypes.best
+        for format, mimetype in FORMAT_MIMETYPES.items():
+            if format in formats and best == mimetype:
+                return format
+        return "csv"
+    return format if format in formats else None
+
+
+def invalid_format_message(formats=RESPONSE_FORMATS):
+    """
+    INTERNAL_FUNCTION
+
+    Returns the error message for an invalid format parameter.
+
+    Parameters
+
+    - formats (list): The formats the endpoint supports (default is RESPONSE_FORMATS).
+
+    Returns
+
+    - The error message.
+    """
+    return f"Invalid format (should be {', '.join(formats[:-1])} or {formats[-1]})"
+
+
+def to_json(value, format):
+    """
+    INTERNAL_FUNCTION
+
+    Serializes a value in JSON (with a trailing newline if the format is ndjson).
+
+    Parameters
+
+    - value (any): The value (e.g., a dictionary).
+    - format (string): The format of the response (json or ndjson).
+
+    Returns
+
+    - The value in JSON (bytes).
+    """
+    return orjson.dumps(value, default=str, option=orjson.OPT_APPEND_NEWLINE if format == "ndjson" else None)
+
+
+def item_to_dict(item_id, item_data):
+    """
+    INTERNAL_FUNCTION
+
+    Converts an item to a dictionary with the fields of the CSV format, keeping the types of the coordinates (2 for
+    OUTDOOR locations and 3 for INDOOR locations) and the attributes (an empty dictionary if the item has none).
+
+    Parameters
+
+    - item_id (string): The id of the item.
+    - item_data (dict): The item as a dictionary.
+
+    Returns
+
+    - The item as a dictionary (id, name, owner, type, coordinates, attributes).
+    """
+    return {
+        "id": item_id,
+        "name": item_data["name"],
+        "owner": item_data["owner"],
+        "type": item_data["type"],
+        "coordinates": item_data["coordinates"],
+        "attributes": item_data["attributes"] or {},
+    }
+
+
+def item_formatter(format):
+    """
+    INTERNAL_FUNCTION
+
+    Returns the function that converts an item to a row of a response in a format.
+
+    Parameters
+
+    - format (string): The format of the response (one of RESPONSE_FORMATS).
+
+    Returns
+
+    - A function that takes the id and the data of an item.
+    """
+    if format == "binary":
+        return pack_item
+    if format in ["ndjson", "json"]:
+        return lambda item_id, item_data: to_json(item_to_dict(item_id, item_data), format)
+    return item_to_csv
+
+
+def value_formatter(format):
+    """
+    INTERNAL_FUNCTION
+
+    Returns the function that converts an attribute value to a response in a format.
+
+    Parameters
+
+    - format (string): The format of the response (one of RESPONSE_FORMATS).
+
+    Returns
+
+    - A function that takes the value.
+    """
+    if format == "binary":
+        return pack_value
+    if format in ["ndjson", "json"]:
+        return lambda value: to_json(value, format)
+    return str
+
+
+def response_mimetype(format):
+    """
+    INTERNAL_FUNCTION
+
+    Returns the MIME type of a response in a format.
+
+    Parameters
+
+    - format (string): The format of the response (one of RESPONSE_FORMATS).
+
+    Returns
+
+    - The MIME type, or None for the default (text/html, as with the other endpoints).
+    """
+    return FORMAT_MIMETYPES.get(format)
+
+
+def generate_list(docs, to_row, format, empty_message=""):
+    """
+    INTERNAL_FUNCTION
+
+    Generates the chunks of a list response in a format one document at a time: the rows one after another, or a
+    JSON array of the rows if the format is json.
+
+    Parameters
+
+    - docs (iterable): The document snapshots (e.g., the stream() of a query).
+    - to_row (function): A function that converts the id and the data of a document to a row in the format.
+    - format (string): The format of the response (one of RESPONSE_FORMATS).
+    - empty_message (string): The response in CSV format if there are no documents (optional).
+
+    Returns
+
+    - A generator of chunks (strings in CSV format, bytes in the other formats).
+    """
+    if format == "csv":
+        yield from generate_rows(docs, to_row, empty_message)
+        return
+    if format != "json":
+        yield from generate_rows(docs, to_row)
+        return
+    yield b"["
+    separator = b""
+    for row in generate_rows(docs, to_row):
+        yield separator + row
+        separator = b","
+    yield b"]"
+
+
+def join_chunks(chunks, format):
+    """
+    INTERNAL_FUNCTION
+
+    Joins the chunks of a response in a format.
+
+    Parameters
+
+    - chunks (iterable): The chunks (e.g., from generate_list).
+    - format (string): The format of the response (one of RESPONSE_FORMATS).
+
+    Returns
+
+    - The body of the response (a string in CSV format, bytes in the other formats).
+    """
+    return "".join(chunks) if format == "csv" else b"".join(chunks)
+
+
+def conditional_response(build_body, etag_parts=None, mimetype=None):
+    """
+    INTERNAL_FUNCTION
+
+    Returns a response with an ETag, or 304 Not Modified without a body if the ETag matches the If-None-Match header
+    of the request.
+
+    Parameters
+
+    - build_body (function): A function that returns the body of the response (called only if needed).
+    - etag_parts (list): The values the ETag is derived from (e.g., the ids and update times of the documents). If
+      omitted, the ETag is derived from the body.
+    - mimetype (string): The MIME type of the body (optional, default is text/html).
+
+    Returns
+
+    - The response.
+    """
+    body = None
+    if etag_parts is None:
+        body = build_body()
+        etag_parts = [body]
+
+    # Derive different ETags for different representations of the same data
+    if mimetype is not None:
+        etag_parts = [mimetype] + list(etag_parts)
+    etag = hashlib.sha1("\n".join(str(part) for part in etag_parts).encode()).hexdigest()
+
+    # Skip building the body if the client already has it
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, mimetype=mimetype)
+    else:
+        response = Response(body if body is not None else build_body(), status=200, mimetype=mimetype)
+    response.vary.add("Accept")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def encode_page_token(cursor):
+    """
+    INTERNAL_FUNCTION
+
+    Encodes the position of the last document of a page as an opaque token for the next page.
+
+    Parameters
+
+    - cursor (dict): The values of the ordered fields of the last document (e.g., {"__name__": item_id}).
+
+    Returns
+
+    - page_token (string): The token (URL-safe).
+    """
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_page_token(page_token, fields):
+    """
+    INTERNAL_FUNCTION
+
+    Decodes a token made by encode_page_token.
+
+    Parameters
+
+    - page_token (string): The token.
+    - fields (list): The ordered fields the token must have (e.g., ["__name__"]).
+
+    Returns
+
+    - cursor (dict): The values of the ordered fields of the last document of the previous page (for start_after).
+
+    Raises
+
+    - ValueError: If the token is invalid.
+    """
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(page_token + "=" * (-len(page_token) % 4)))
+    except Exception:
+        raise ValueError("Invalid page_token")
+    if not isinstance(cursor, dict) or sorted(cursor) != sorted(fields):
+        raise ValueError("Invalid page_token")
+    if not all(isinstance(value, str) and value != "" for value in cursor.values()) or "/" in cursor["__name__"]:
+        raise ValueError("Invalid page_token")
+    return cursor
 
 
 @app.route("/update_item", methods=["GET"])
@@ -432,25 +1141,25 @@ def update_item():
     transaction = db.transaction()
 
     # Use a transaction to update the attribute of the item document in Firestore
-    @firestore.transactional
+    @transactional
     def update_transaction(transaction):
         # Get the item document from Firestore
         item_ref = db.collection("items").document(item_id)
-        item = item_ref.get()
+        item = item_ref.get(transaction=transaction)
         if not item.exists:
             raise ValueError("Invalid item_id")
 
         item_data = item.to_dict()
 
+        # The fields to update with a single write and the item after the update (to build the response without
+        # reading the item again)
+        fields = {}
+        updated_item_data = item.to_dict()
+
         # Check if the location_id is valid
         if location_id is not None:
             # Check if the location_id exists
-            locations_ref = db.collection("locations")
-            query_ref = locations_ref.where(
-                filter=FieldFilter(field_path="location_id", op_string="==", value=location_id)
-            )
-            locations = query_ref.get()
-            if len(locations) == 0:
+            if location_cache.get(location_id) is None:
                 raise ValueError("Invalid location_id")
 
         # Check if the coordinates is valid
@@ -460,17 +1169,14 @@ def update_item():
                 coordinates_list = list(map(float, coordinates.split(",")))
             except Exception as e:
                 raise ValueError("Invalid coordinates (must be comma-separated numbers)")
+            if not all(math.isfinite(c) for c in coordinates_list):
+                raise ValueError("Invalid coordinates (must be finite numbers)")
 
             # Check if the coordinates is valid (should be 2 for OUTDOOR location , 3 for INDOOR location)
-            locations_ref = db.collection("locations")
-
             # Get the location for the item
-            location_id_for_item = item_data["location_id"]
-            query_ref = locations_ref.where(
-                filter=FieldFilter(field_path="location_id", op_string="==", value=location_id_for_item)
-            )
-            locations = query_ref.get()
-            location = locations[0].to_dict()
+            location = location_cache.get(item_data["location_id"])
+            if location is None:
+                raise ValueError("Invalid location_id")
 
             # Check if the location is INDOOR or OUTDOOR
             if location["type"] == "INDOOR":
@@ -490,12 +1196,9 @@ def update_item():
                 raise ValueError("Invalid tags")
 
             # Check if the tags exist
-            tags_ref = db.collection("tags")
-            for tag in tags_list:
-                query_ref = tags_ref.where(filter=FieldFilter(field_path="name", op_string="==", value=tag))
-                found_tags = query_ref.get()
-                if len(found_tags) == 0:
-                    raise ValueError(f"Invalid tag: {tag}")
+            missing_tags = tag_registry.find_missing(tags_list)
+            if len(missing_tags) > 0:
+                raise ValueError(f"Invalid tag: {missing_tags[0]}")
 
         # Check if the attributes is valid
         if attributes is not None:
@@ -544,54 +1247,73 @@ def update_item():
                             f"Invalid attribute value (must be a number to increment/decrement): {current_value}"
                         )
 
-                    # Increment/decrement the attribute
+                    # Increment/decrement the attribute atomically so that concurrent increments don't conflict
                     # Note: The type of the current value (int or float) preserved
-                    if key[-1] == "+":
-                        if isinstance(current_value, int):
-                            updated_attributes[key[:-1]] = current_value + int(value)
-                        else:
-                            updated_attributes[key[:-1]] = current_value + float(value)
+                    delta = int(value) if isinstance(current_value, int) else float(value)
+                    if key[-1] == "-":
+                        delta = -delta
+                    if sharded_counters.is_sharded(key[:-1]):
+                        sharded_counters.increment(transaction, item_id, key[:-1], delta)
                     else:
-                        if isinstance(current_value, int):
-                            updated_attributes[key[:-1]] = current_value - int(value)
-                        else:
-                            updated_attributes[key[:-1]] = current_value - float(value)
+                        fields[f"attributes.{key[:-1]}"] = firestore.Increment(delta)
+                        updated_attributes[key[:-1]] = current_value + delta
 
                 else:
-                    # Add the attribute to the updated_attributes dictionary
+                    # Add the attribute to the updated_attributes dictionary (and clear its counter shards)
+                    fields[f"attributes.{key}"] = value
                     updated_attributes[key] = value
+                    if sharded_counters.is_sharded(key):
+                        sharded_counters.reset(transaction, item_id, key)
 
-            # Update a sub-item of the attributes parameter of the item document in Firestore
-            for key, value in updated_attributes.items():
-                item_ref.update({f"attributes.{key}": value})
+            updated_item_data["attributes"] = {**(item_data["attributes"] or {}), **updated_attributes}
 
-        # Update a parameter or parameters of the item document in Firestore
+        # Collect a parameter or parameters to update
         if owner is not None:
-            item_ref.update({"owner": owner})
+            fields["owner"] = owner
         if name is not None:
-            item_ref.update({"name": name})
+            fields["name"] = name
         if type is not None:
-            item_ref.update({"type": type})
+            fields["type"] = type
         if location_id is not None:
-            item_ref.update({"location_id": location_id})
+            fields["location_id"] = location_id
         if coordinates is not None:
-            item_ref.update({"coordinates": coordinates_list})
+            fields["coordinates"] = coordinates_list
         if tags is not None:
-            item_ref.update({"tags": tags_list})
+            fields["tags"] = tags_list
+        updated_item_data.update(
+            {field: value for field, value in fields.items() if not field.startswith("attributes.")}
+        )
 
-        # Get the updated item
-        updated_item = item_ref.get()
+        # Update the geohash if the position of the item changed
+        if location_id is not None or coordinates is not None:
+            geohash = item_geohash(
+                location_cache.get(updated_item_data["location_id"]), updated_item_data["coordinates"]
+            )
+            fields["geohash"] = geohash if geohash is not None else firestore.DELETE_FIELD
+
+        # Update the item document in Firestore with a single write
+        if len(fields) > 0:
+            transaction.update(item_ref, fields)
 
-        return updated_item
+        return item_data["location_id"], updated_item_data
 
     # Update the item document in Firestore
     try:
-        updated_item = update_transaction(transaction)
+        previous_location_id, updated_item_data = update_transaction(transaction)
     except ValueError as e:
         return str(e), 400
 
+    item_cache.invalidate(item_id)
+
+    # Move the item in the spatial indexes if its position changed
+    if location_id is not None or coordinates is not None:
+        spatial_indexes.remove(previous_location_id, item_id)
+        spatial_indexes.add(updated_item_data["location_id"], item_id, updated_item_data["coordinates"])
+
     # Return the item details in CSV format
-    return item_to_csv(updated_item), 200
+    if sharded_counters.enabled:
+        updated_item_data["attributes"] = sharded_counters.apply(item_id, updated_item_data["attributes"])
+    return item_to_csv(item_id, updated_item_data), 200
 
 
 @app.route("/get_item", methods=["GET"])
@@ -603,59 +1325,118 @@ def get_item():
     Parameters
 
     - item_id (string): The id of the item.
+    - format (string): The format of the response, csv, binary, ndjson or json (optional, default is csv, or the format of the Accept header: application/octet-stream, application/x-ndjson or application/json if it does not include */* or text/*).
     - api_key (string): The API key for the user (should be API_KEY_DESIGNER or API_KEY_PLAYER).
 
     Response
 
-    - item_details (string): The details of the item in CSV format (item_id, name quoted with double quotations, owner, type, coordinates, attributes). If the item has no attributes, the attributes field will be "null".
-    - status code (integer): HTTP status code.
+    - item_details (string): The details of the item in CSV format (item_id, name quoted with double quotations, owner, type, coordinates, attributes). If the item has no attributes, the attributes field will be "null". In the binary format, the item is a length-prefixed record (see binary_format.py). In the JSON formats, the item is an object (id, name, owner, type, coordinates, attributes) with typed values and without the trailing 0 of OUTDOOR coordinates.
+    - status code (integer): HTTP status code (304 Not Modified without a body if the If-None-Match header matches the ETag of the response).
     """
     # Extract parameters from the request
     item_id = request.args.get("item_id")
+    format = response_format()
     api_key = request.args.get("api_key")
 
     # Check if the API key is valid
     if api_key not in [API_KEY_DESIGNER, API_KEY_PLAYER]:
         return "Invalid API key", 400
 
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(), 400
+
     # Check if the item_id is valid
     if item_id is None:
         return "Invalid item_id (must be specified)", 400
     else:
-        item_ref = db.collection("items").document(item_id)
-        item = item_ref.get(retry=custom_retry)
+        item = item_cache.get(item_id, retry=custom_retry)
         if item.exists is False:
             return "Invalid item_id (item does not exist)", 400
 
-    # Return the item details in CSV format
-    return item_to_csv(item), 200
+    # Return the item details in the requested format (with the current values of the sharded counters) with an ETag
+    # derived from the update time of the item (or from the details if the sharded counters may have changed)
+    item_data = item.to_dict()
+    to_row = item_formatter(format)
+    mimetype = response_mimetype(format)
+    if sharded_counters.enabled:
+        item_data["attributes"] = sharded_counters.apply(item_id, item_data["attributes"])
+        return conditional_response(lambda: to_row(item_id, item_data), mimetype=mimetype)
+    return conditional_response(lambda: to_row(item_id, item_data), [item_id, item.update_time], mimetype)
 
 
-def calculate_distance_for_outdoor(lat1, lon1, lat2, lon2):
+def is_item_in_radius(item_data, location, tags, position, radius):
     """
     INTERNAL_FUNCTION
 
-    Calculates the distance in meters between two sets of (lat, lon) coordinates.
+    Check if an item is in a location, has all the tags, and is within a radius of a position.
+
+    Parameters
+
+    - item_data (dict): The item.
+    - location (dict): The location.
+    - tags (list): The tags the item must have.
+    - position (list): The center (x, y, z for an INDOOR location or latitude, longitude for an OUTDOOR location).
+    - radius (float): The radius in meters.
+
+    Returns
+
+    - True if the item matches, False otherwise.
     """
-    radius = 6371000  # Earth's radius in meters
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat / 2) * math.sin(dlat / 2) + math.cos(math.radians(lat1)) * math.cos(
-        math.radians(lat2)
-    ) * math.sin(dlon / 2) * math.sin(dlon / 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    distance = radius * c
-    return distance
+    if item_data.get("location_id") != location["location_id"]:
+        return False
+    if any(tag not in (item_data.get("tags") or []) for tag in tags):
+        return False
+
+    coordinates = item_data.get("coordinates")
+    if location["type"] == "INDOOR":
+        if not is_valid_coordinates(coordinates, 3):
+            return False
+        distance = calculate_distance_for_indoor(
+            position[0], position[1], position[2], coordinates[0], coordinates[1], coordinates[2]
+        )
+    else:
+        if not is_valid_coordinates(coordinates, 2):
+            return False
+        distance = calculate_distance_for_outdoor(position[0], position[1], coordinates[0], coordinates[1])
+    return distance <= radius
 
 
-def calculate_distance_for_indoor(x1, y1, z1, x2, y2, z2):
+def query_items_by_geohash(location_id, position, radius):
     """
     INTERNAL_FUNCTION
 
-    Calculates the distance in meters between two sets of (x, y, z) coordinates.
+    Queries the OUTDOOR items whose geohash is in one of the geohash cells that cover a radius around a position.
+    Each cell is read with a range query on the geohash field, so items far from the position are not read. If the
+    radius needs more than GEOHASH_MAX_RANGES cells, all the items in the location are queried instead.
+
+    Parameters
+
+    - location_id (string): The location_id of the items.
+    - position (list): The center (latitude, longitude).
+    - radius (float): The radius in meters.
+
+    Returns
+
+    - The list of items in the covering cells (some of them may be outside the radius).
     """
-    distance = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2)
-    return distance
+    items_ref = db.collection("items")
+    prefixes = geohash_cover(position[0], position[1], radius, max_cells=GEOHASH_MAX_RANGES)
+    if prefixes is None:
+        # Read the whole location rather than exceed the number of range queries
+        query_ref = items_ref.where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
+        return list(query_ref.get(retry=custom_retry))
+
+    items = []
+    for prefix in prefixes:
+        # Every geohash that starts with the prefix sorts between the prefix and the prefix followed by "~"
+        query_ref = (
+            items_ref.where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
+            .where(filter=FieldFilter(field_path="geohash", op_string=">=", value=prefix))
+            .where(filter=FieldFilter(field_path="geohash", op_string="<", value=prefix + "~"))
+        )
+        items.extend(query_ref.get(retry=custom_retry))
+    return items
 
 
 @app.route("/list_items", methods=["GET"])
@@ -671,17 +1452,22 @@ def list_items():
     - max_items (integer): The maximum number of items to return (default is 100).
     - position (float): The position within the location to filter items by. For INDOOR locations, x,y,z coordinates are required. For OUTDOOR locations, latitude and longitude are required.
     - radius (float): The radius from the point within which to filter the items (optional).
+    - page_token (string): The token of the page to return, taken from the X-Next-Page-Token header of the previous response (optional, default is the first page).
+    - format (string): The format of the response, csv, binary, ndjson or json (optional, default is csv, or the format of the Accept header: application/octet-stream, application/x-ndjson or application/json if it does not include */* or text/*).
     - api_key (string): The API key for the user (should be either API_KEY_DESIGNER or API_KEY_PLAYER).
 
     Response
 
-    - items (string): A list of items in the specified location in CSV format (item_id, name quoted with double quotations, owner, type, coordinates, attributes). If an item has no attributes, the attributes field will be "null".
-    - status code (integer): HTTP status code.
+    - items (string): A list of items in the specified location in CSV format (item_id, name quoted with double quotations, owner, type, coordinates, attributes). If an item has no attributes, the attributes field will be "null". In the binary format, the items are length-prefixed records one after another (see binary_format.py). In the JSON formats, each item is an object (id, name, owner, type, coordinates, attributes) with typed values and without the trailing 0 of OUTDOOR coordinates, one per line (ndjson) or in an array (json).
+    - status code (integer): HTTP status code (304 Not Modified without a body if the If-None-Match header matches the ETag of the response).
 
     Notes
 
     - Since the length of the coordinates is variable (i.e., 3 for INDOOR locations and 2 for OUTDOOR locations), add 0 for OUTDOOR locations' third coordinate.
     - Clients should treat the attributes as a variable-length list.
+    - If the position and radius are specified, the max_items limit applies to the items within the radius.
+    - The items are sorted by item_id. If the page is full (i.e., there may be more items), the response has an X-Next-Page-Token header. Send the same parameters with the token as page_token to get the next page.
+    - If max_items is greater than 1000, no position is specified and the location is not served from a replica, the response is streamed without the ETag and X-Next-Page-Token headers.
     """
     # Extract parameters from the request
     location_id = request.args.get("location_id")
@@ -689,21 +1475,35 @@ def list_items():
     max_items = request.args.get("max_items")
     position = request.args.get("position")
     radius = request.args.get("radius")
+    page_token = request.args.get("page_token")
+    format = response_format()
     api_key = request.args.get("api_key")
 
     # Check if the API key is valid
     if api_key not in [API_KEY_DESIGNER, API_KEY_PLAYER]:
         return "Invalid API key", 400
 
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(), 400
+    to_row = item_formatter(format)
+    mimetype = response_mimetype(format)
+
+    # Check if the page_token is valid and get the item_id the page starts after
+    after_id = None
+    if page_token is not None:
+        try:
+            after_id = decode_page_token(page_token, ["__name__"])["__name__"]
+        except ValueError as e:
+            return str(e), 400
+
     # Check the location_id
     if location_id is None:
         return "location_id is required", 400
 
     # Check if the location_id is valid
-    locations_ref = db.collection("locations")
-    query_ref = locations_ref.where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
-    locations = query_ref.get(retry=custom_retry)
-    if len(locations) == 0:
+    location = location_cache.get(location_id)
+    if location is None:
         return "Invalid location_id", 400
 
     # Check if the max_items is valid
@@ -718,27 +1518,11 @@ def list_items():
     else:
         tags = tags.split(",")
         # Check all tags are valid
-        for tag in tags:
-            tags_ref = db.collection("tags")
-            query_ref = tags_ref.where(filter=FieldFilter(field_path="name", op_string="==", value=tag))
-            found_tags = query_ref.get()
-            if len(found_tags) == 0:
-                return f"Invalid tag: {tag}", 400
+        missing_tags = tag_registry.find_missing(tags)
+        if len(missing_tags) > 0:
+            return f"Invalid tag: {missing_tags[0]}", 400
 
-    # Retrieve items for the location_id filtered by tags
-    items_ref = db.collection("items")
-    query_ref = items_ref.where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
-
-    # If a tag or tags are specified, filter the items by tags
-    if len(tags) > 0:
-        # Adds a where filter for each tag, resulting in a logical AND across all the tags
-        for tag in tags:
-            query_ref = query_ref.where(filter=FieldFilter(field_path="tags", op_string="array_contains", value=tag))
-
-    query_ref = query_ref.limit(max_items)
-    items = query_ref.get(retry=custom_retry)
-
-    # If the point is specified, filter the items by distance
+    # If the position is specified, check the radius and the position
     if position is not None:
         # Check if the radius is valid (should be a number and greater than 0)
         if radius is None:
@@ -749,6 +1533,9 @@ def list_items():
             except ValueError:
                 return "radius should be a number", 400
 
+            if not math.isfinite(radius):
+                return "radius should be a finite number", 400
+
             if radius <= 0:
                 return "radius should be greater than 0", 400
 
@@ -756,54 +1543,100 @@ def list_items():
         position = position.split(",")
         position = [float(p) for p in position]
 
-        # If the location is INDOOR, filter the items by distance
-        if locations[0].to_dict()["type"] == "INDOOR":
-            # Check if the length of the position is valid
-            if len(position) != 3:
-                return "Invalid position (should be x,y,z)", 400
-
-            # Check if the radius is valid
-            if radius is None:
-                return "radius is required", 400
-
-            # Filter the items by distance
+        # Check if the length of the position is valid
+        if location["type"] == "INDOOR" and len(position) != 3:
+            return "Invalid position (should be x,y,z)", 400
+        elif location["type"] == "OUTDOOR" and len(position) != 2:
+            return "Invalid position (should be latitude,longitude)", 400
+        elif not all(math.isfinite(p) for p in position):
+            return "Invalid position (should be finite numbers)", 400
+
+    # Get the replica of the location if the replica mode is enabled (None if it is not available)
+    replica = None
+    if LOCATION_REPLICA:
+        replica = location_replicas.get(location_id, location["type"])
+
+    if replica is not None:
+        # Filter the items in the replica without reading them from Firestore
+        items = []
+        for item in replica.items(position, radius, after_id):
+            item_data = item.to_dict()
+            if position is not None:
+                matches = is_item_in_radius(item_data, location, tags, position, radius)
+            else:
+                matches = all(tag in (item_data.get("tags") or []) for tag in tags)
+            if matches:
+                items.append(item)
+                if len(items) >= max_items:
+                    break
+    elif position is not None:
+        # Query the OUTDOOR items in the geohash cells around the position if the geohash prefilter is enabled
+        if location["type"] == "OUTDOOR" and GEOHASH_PREFILTER:
             items = [
                 item
-                for item in items
-                if calculate_distance_for_indoor(
-                    position[0],
-                    position[1],
-                    position[2],
-                    item.to_dict()["coordinates"][0],
-                    item.to_dict()["coordinates"][1],
-                    item.to_dict()["coordinates"][2],
-                )
-                <= radius
+                for item in query_items_by_geohash(location_id, position, radius)
+                if (after_id is None or item.id > after_id)
+                and is_item_in_radius(item.to_dict(), location, tags, position, radius)
             ]
+            items = sorted(items, key=lambda item: item.id)[:max_items]
+        else:
+            # Find the candidates in the spatial index (sorted by id, like the results of a query)
+            item_ids = sorted(spatial_indexes.query(location_id, location["type"], position, radius))
+            if after_id is not None:
+                item_ids = [item_id for item_id in item_ids if item_id > after_id]
+
+            # Fetch the candidates in batches until max_items items are found, and check them again since the index
+            # may be slightly out of date (e.g., items updated through other workers)
+            items = []
+            for start in range(0, len(item_ids), SPATIAL_FETCH_BATCH_SIZE):
+                if len(items) >= max_items:
+                    break
+                item_refs = [
+                    db.collection("items").document(item_id)
+                    for item_id in item_ids[start : start + SPATIAL_FETCH_BATCH_SIZE]
+                ]
+                for item in sorted(db.get_all(item_refs, retry=custom_retry), key=lambda item: item.id):
+                    if item.exists and is_item_in_radius(item.to_dict(), location, tags, position, radius):
+                        items.append(item)
+            items = items[:max_items]
+    else:
+        # Retrieve items for the location_id filtered by tags
+        items_ref = db.collection("items")
+        query_ref = items_ref.where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
+
+        # If a tag or tags are specified, filter the items by tags
+        if len(tags) > 0:
+            # Adds a where filter for each tag, resulting in a logical AND across all the tags
+            for tag in tags:
+                query_ref = query_ref.where(
+                    filter=FieldFilter(field_path="tags", op_string="array_contains", value=tag)
+                )
 
-        # If the location is OUTDOOR, filter the items by distance
-        elif locations[0].to_dict()["type"] == "OUTDOOR":
-            # Check if the length of the position is valid
-            if len(position) != 2:
-                return "Invalid position (should be latitude,longitude)", 400
+        # Continue after the last item of the previous page
+        if after_id is not None:
+            query_ref = query_ref.order_by(FieldPath.document_id()).start_after({"__name__": after_id})
 
-            # Filter the items by distance
-            items = [
-                item
-                for item in items
-                if calculate_distance_for_outdoor(
-                    position[0], position[1], item.to_dict()["coordinates"][0], item.to_dict()["coordinates"][1]
-                )
-                <= radius
-            ]
+        query_ref = query_ref.limit(max_items)
+
+        # Stream a large list while the items are read
+        if max_items > LIST_STREAM_THRESHOLD:
+            chunks = generate_list(query_ref.stream(retry=custom_retry), to_row, format)
+            return Response(stream_with_context(chunks), mimetype=mimetype)
 
-    # Convert the items to CSV format. Regarding the coordinates, add trailing 0 if the length is 2 (i.e., OUTDOOR location)
-    items_in_csv = ""
-    for item in items:
-        items_in_csv += item_to_csv(item)
+        items = query_ref.get(retry=custom_retry)
+
+    def build_items():
+        # Convert the items to the requested format
+        return join_chunks(generate_list(items, to_row, format), format)
 
-    # Return the items in CSV format
-    return items_in_csv, 200
+    # Return the items in the requested format with an ETag derived from the ids and update times of the items (the
+    # revision of the list), so that an unchanged list is not converted or sent again
+    response = conditional_response(build_items, [(item.id, item.update_time) for item in items], mimetype)
+
+    # Add the token of the next page if the page is full
+    if len(items) > 0 and len(items) >= max_items:
+        response.headers[NEXT_PAGE_TOKEN_HEADER] = encode_page_token({"__name__": items[-1].id})
+    return response
 
 
 @app.route("/acquire_item", methods=["GET"])
@@ -838,10 +1671,66 @@ def acquire_item():
         },
         retry=custom_retry,
     )
+    item_cache.invalidate(item_id)
 
     return "Item acquired successfully", 200
 
 
+def delete_items_in_location(location_id, report_progress):
+    """
+    INTERNAL_FUNCTION
+
+    Deletes all items in a location. The items are read in pages (only their ids) and deleted in batches that are
+    committed in parallel.
+
+    Parameters
+
+    - location_id (string): The location_id of the items.
+    - report_progress (function): A callback that receives the number of items deleted so far.
+
+    Returns
+
+    - The number of items deleted.
+    """
+    query_ref = (
+        db.collection("items")
+        .where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
+        .select([FieldPath.document_id()])
+        .limit(DELETE_PAGE_SIZE)
+    )
+
+    # Each item takes one write, plus one for each counter shard
+    items_per_batch = MAX_WRITES_PER_BATCH
+    if sharded_counters.enabled:
+        items_per_batch = max(1, MAX_WRITES_PER_BATCH // (1 + sharded_counters.num_shards))
+
+    deleted = 0
+    with ThreadPoolExecutor(max_workers=DELETE_PARALLEL_COMMITS) as executor:
+        page = query_ref.get(retry=custom_retry)
+        while len(page) > 0:
+            # Delete the items in the page (and their counter shards) in batches committed in parallel
+            batches = []
+            for start in range(0, len(page), items_per_batch):
+                batch = db.batch()
+                for doc in page[start : start + items_per_batch]:
+                    batch.delete(doc.reference)
+                    if sharded_counters.enabled:
+                        sharded_counters.delete(batch, doc.id)
+                batches.append(batch)
+            for future in [executor.submit(batch.commit, retry=custom_retry) for batch in batches]:
+                future.result()
+
+            deleted += len(page)
+            report_progress(deleted)
+
+            # Continue after the last item of the page so that the deleted items are not scanned again
+            page = query_ref.start_after(page[-1]).get(retry=custom_retry)
+
+    spatial_indexes.invalidate(location_id)
+    item_cache.invalidate_location(location_id)
+    return deleted
+
+
 @app.route("/delete_items", methods=["GET"])
 @handle_firestore_errors
 def delete_items():
@@ -855,7 +1744,7 @@ def delete_items():
 
     Response
 
-    - message (string): A message indicating that the items was deleted successfully.
+    - message (string): A message indicating that the deletion of the items was started, followed by a comma and the id of the job (use get_job to check the progress).
     - status code (integer): HTTP status code.
     """
     # Extract parameters from the request
@@ -867,21 +1756,15 @@ def delete_items():
         return "Invalid API key", 401
 
     # Check if the location exists
-    doc_ref = db.collection("locations").document(location_id)
-    location = doc_ref.get(retry=custom_retry)
-    if not location.exists:
+    if location_cache.get(location_id) is None:
         return "Location does not exist", 400
 
-    # Delete the items in the location from Firestore
-    docs = (
-        db.collection("items")
-        .where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
-        .get(retry=custom_retry)
+    # Delete the items in the location from Firestore in the background
+    job_id = job_runner.start(
+        "DELETE_ITEMS", location_id, lambda report_progress: delete_items_in_location(location_id, report_progress)
     )
-    for doc in docs:
-        doc.reference.delete(retry=custom_retry)
 
-    return "Items deleted successfully", 200
+    return f"Items deletion started,{job_id}", 200
 
 
 @app.route("/create_location", methods=["GET"])
@@ -933,15 +1816,16 @@ def create_location():
     location_id = str(uuid.uuid4())
 
     # Create a new location document in Firestore
+    location = {
+        "location_id": location_id,
+        "name": name,
+        "type": type,
+    }
     doc_ref = db.collection("locations").document(location_id)
-    doc_ref.set(
-        {
-            "location_id": location_id,
-            "name": name,
-            "type": type,
-        },
-        retry=custom_retry,
-    )
+    doc_ref.set(location, retry=custom_retry)
+
+    # Add the new location to the location cache
+    location_cache.put(location_id, location)
 
     return f"Location created successfully,{location_id}", 200
 
@@ -959,7 +1843,7 @@ def delete_location():
 
     Response
 
-    - message (string): A message indicating that the location was deleted successfully.
+    - message (string): A message indicating that the location was deleted successfully, followed by a comma and the id of the job that deletes the items in the location (use get_job to check the progress).
     - status code (integer): HTTP status code.
     """
     # Extract parameters from the request
@@ -976,19 +1860,64 @@ def delete_location():
     if not location.exists:
         return "Location does not exist", 400
 
-    # Delete the location document from Firestore
+    # Delete the location document from Firestore and remove it from the location cache and the replicas
     doc_ref.delete(retry=custom_retry)
+    location_cache.invalidate(location_id)
+    location_replicas.invalidate(location_id)
 
-    # Delete the items in the location from Firestore
-    docs = (
-        db.collection("items")
-        .where(filter=FieldFilter(field_path="location_id", op_string="==", value=location_id))
-        .get(retry=custom_retry)
+    # Delete the items in the location from Firestore in the background
+    job_id = job_runner.start(
+        "DELETE_ITEMS", location_id, lambda report_progress: delete_items_in_location(location_id, report_progress)
     )
-    for doc in docs:
-        doc.reference.delete(retry=custom_retry)
 
-    return "Location deleted successfully", 200
+    return f"Location deleted successfully,{job_id}", 200
+
+
+@app.route("/get_job", methods=["GET"])
+@handle_firestore_errors
+def get_job():
+    """
+    Allows a designer to check the progress of a background job (e.g., deleting the items in a location).
+
+    Parameters
+
+    - job_id (string): The id of the job.
+    - format (string): The format of the response, csv, ndjson or json (optional, default is csv, or the format of the Accept header: application/x-ndjson or application/json if it does not include */* or text/*).
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+
+    Response
+
+    - job (string): The job in CSV format (job_id, status, progress). The status is RUNNING, DONE, or FAILED, and the progress is the number of items processed so far. If the job failed, the error message quoted with double quotations follows. In the JSON formats, the job is an object (job_id, status, progress, error).
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    job_id = request.args.get("job_id")
+    format = response_format(TEXT_FORMATS)
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key != API_KEY_DESIGNER:
+        return "Invalid API key", 401
+
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(TEXT_FORMATS), 400
+
+    # Check if the job exists
+    job = job_runner.get(job_id)
+    if job is None:
+        return "Job does not exist", 400
+
+    # Return the job in JSON if requested
+    if format != "csv":
+        fields = {key: job[key] for key in ["job_id", "status", "progress", "error"]}
+        return Response(to_json(fields, format), mimetype=response_mimetype(format))
+
+    # Return the job in CSV format
+    job_csv = f"{job['job_id']},{job['status']},{job['progress']}"
+    if job["status"] == "FAILED":
+        job_csv += f',"{job["error"]}"'
+    return job_csv, 200
 
 
 @app.route("/list_locations", methods=["GET"])
@@ -999,37 +1928,65 @@ def list_locations():
 
     Parameters
 
+    - max_locations (integer): The maximum number of locations to return (default is 1000). If it is greater than 1000, the response is streamed without the X-Next-Page-Token header.
+    - page_token (string): The token of the page to return, taken from the X-Next-Page-Token header of the previous response (optional, default is the first page).
+    - format (string): The format of the response, csv, ndjson or json (optional, default is csv, or the format of the Accept header: application/x-ndjson or application/json if it does not include */* or text/*).
     - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
 
     Response
 
-    - locations (string): A list of locations in CSV format (id, name quoted with double quotations, type).
+    - locations (string): A list of locations in CSV format (id, name quoted with double quotations, type), sorted by id. In the JSON formats, each location is an object (id, name, type), one per line (ndjson) or in an array (json). If the page is full (i.e., there may be more locations), the response has an X-Next-Page-Token header.
     - status code (integer): HTTP status code.
     """
     # Extract parameters from the request
+    max_locations = request.args.get("max_locations")
+    page_token = request.args.get("page_token")
+    format = response_format(TEXT_FORMATS)
     api_key = request.args.get("api_key")
 
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(TEXT_FORMATS), 400
+    mimetype = response_mimetype(format)
+
+    # Check if the max_locations is valid
+    if max_locations is None:
+        max_locations = 1000
+    else:
+        max_locations = int(max_locations)
+
     # Get the location documents from Firestore
-    docs = db.collection("locations").get(retry=custom_retry)
+    query_ref = db.collection("locations").order_by(FieldPath.document_id())
 
-    # Create a list of locations
-    locations = []
-    for doc in docs:
-        location = doc.to_dict()
-        location["id"] = doc.id
-        locations.append(location)
+    # Continue after the last location of the previous page
+    if page_token is not None:
+        try:
+            query_ref = query_ref.start_after(decode_page_token(page_token, ["__name__"]))
+        except ValueError as e:
+            return str(e), 400
+
+    query_ref = query_ref.limit(max_locations)
 
-    # If there are no locations, return "NO_LOCATIONS"
-    if len(locations) == 0:
-        return "NO_LOCATIONS", 200
+    def location_to_row(location_id, location):
+        if format == "csv":
+            return LOCATION_CSV_ROW(location_id, location["name"], location["type"])
+        return to_json({"id": location_id, "name": location["name"], "type": location["type"]}, format)
 
-    # Convert the locations to CSV format
-    locations_csv = ""
-    for location in locations:
-        name_str = f'"{location["name"]}"'
-        locations_csv += f"{location['id']},{name_str},{location['type']}\n"
+    # Stream a large list while the locations are read (if there are no locations, return "NO_LOCATIONS" in CSV)
+    if max_locations > LIST_STREAM_THRESHOLD:
+        docs = query_ref.stream(retry=custom_retry)
+        chunks = generate_list(docs, location_to_row, format, empty_message="NO_LOCATIONS")
+        return Response(stream_with_context(chunks), mimetype=mimetype)
 
-    return locations_csv, 200
+    # Convert the locations to the requested format (if there are no locations, return "NO_LOCATIONS" in CSV)
+    docs = query_ref.get(retry=custom_retry)
+    locations = join_chunks(generate_list(docs, location_to_row, format, empty_message="NO_LOCATIONS"), format)
+    response = Response(locations, status=200, mimetype=mimetype)
+
+    # Add the token of the next page if the page is full
+    if len(docs) > 0 and len(docs) >= max_locations:
+        response.headers[NEXT_PAGE_TOKEN_HEADER] = encode_page_token({"__name__": docs[-1].id})
+    return response
 
 
 @app.route("/create_tag", methods=["GET"])
@@ -1078,6 +2035,9 @@ def create_tag():
     doc_ref = db.collection("tags").document(tag_id)
     doc_ref.set({"tag_id": tag_id, "name": name}, retry=custom_retry)
 
+    # Add the new tag to the tag registry
+    tag_registry.put(name, tag_id)
+
     # Return a message telling that the tag was created successfully
     return f"Tag created successfully,{tag_id}", 200
 
@@ -1091,47 +2051,68 @@ def list_tags():
     Parameters
 
     - max_tags (integer): The maximum number of tags to return (default is 100).
+    - page_token (string): The token of the page to return, taken from the X-Next-Page-Token header of the previous response (optional, default is the first page).
+    - format (string): The format of the response, csv, ndjson or json (optional, default is csv, or the format of the Accept header: application/x-ndjson or application/json if it does not include */* or text/*).
     - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
 
     Response
 
-    - tags (string): A list of tags in CSV format (name).
+    - tags (string): A list of tags in CSV format (name), sorted by name. If the page is full (i.e., there may be more tags), the response has an X-Next-Page-Token header. In the JSON formats, each tag is an object (name), one per line (ndjson) or in an array (json).
     - status code (integer): HTTP status code.
     """
     # Extract parameters from the request
     max_tags = request.args.get("max_tags")
+    page_token = request.args.get("page_token")
+    format = response_format(TEXT_FORMATS)
     api_key = request.args.get("api_key")
 
     # Check if the API key is valid
     if api_key != API_KEY_DESIGNER:
         return "invalid API key", 400
 
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(TEXT_FORMATS), 400
+
     # Check if the max_tags is valid
     if max_tags is None:
         max_tags = 100
     else:
         max_tags = int(max_tags)
 
-    # Get the tags from Firestore
+    # Get the tags from Firestore (ties are broken by the document id so that the pages are stable)
     tags_ref = db.collection("tags")
-    query_ref = tags_ref.order_by("name").limit(max_tags)
+    query_ref = tags_ref.order_by("name").order_by(FieldPath.document_id())
+
+    # Continue after the last tag of the previous page
+    if page_token is not None:
+        try:
+            query_ref = query_ref.start_after(decode_page_token(page_token, ["name", "__name__"]))
+        except ValueError as e:
+            return str(e), 400
+
+    query_ref = query_ref.limit(max_tags)
     tags = query_ref.get(retry=custom_retry)
 
+    # The token of the next page if the page is full
+    headers = {}
+    if len(tags) > 0 and len(tags) >= max_tags:
+        next_page_token = encode_page_token({"name": tags[-1].to_dict()["name"], "__name__": tags[-1].id})
+        headers[NEXT_PAGE_TOKEN_HEADER] = next_page_token
+
+    # Return the tags in JSON if requested
+    if format != "csv":
+        chunks = generate_list(tags, lambda _, tag: to_json({"name": tag["name"]}, format), format)
+        tags_json = join_chunks(chunks, format)
+        return Response(tags_json, mimetype=response_mimetype(format), headers=headers)
+
     # If there are no tags, return "NO_TAGS"
     if len(tags) == 0:
         return "NO_TAGS", 200
 
-    # Return the tags in CSV format
-    tags_csv = ""
-
-    # Convert the tags to CSV format
-    for tag in tags:
-        tags_csv += f"{tag.to_dict()['name']},"
-
-    # Remove the last comma
-    tags_csv = tags_csv[:-1]
-
-    return tags_csv, 200
+    # Return the tags in CSV format (separated by commas)
+    tags_csv = ",".join(tag.to_dict()["name"] for tag in tags)
+    return tags_csv, 200, headers
 
 
 @app.route("/delete_tag", methods=["GET"])
@@ -1173,6 +2154,9 @@ def delete_tag():
     doc_ref = db.collection("tags").document(tags[0].id)
     doc_ref.delete(retry=custom_retry)
 
+    # Remove the tag from the tag registry
+    tag_registry.invalidate(tag)
+
     # Return a message telling that the tag was deleted successfully
     return "The tag was deleted successfully", 200
 
@@ -1191,7 +2175,7 @@ def update_attribute():
 
     Response
 
-    - message (string): The updated attribute value.
+    - message (string): The updated attribute value. For increments/decrements of attributes in SHARDED_COUNTERS, the value is computed from the shards read before the increment and can miss concurrent increments.
     - status code (integer): HTTP status code.
     """
     # Extract parameters from the request
@@ -1216,55 +2200,84 @@ def update_attribute():
     if len(key_value) != 2:
         return "Invalid attribute (should be in key-value format, e.g., 'temperature=20')", 400
 
-    # Create a transaction
-    transaction = db.transaction()
+    key = key_value[0]
+    value = key_value[1]
 
-    # Use a transaction to update the attribute of the item document in Firestore
-    @firestore.transactional
-    def update_transaction(transaction):
-        key = key_value[0]
-        value = key_value[1]
+    # Convert the value to an integer or a float if the value is a number
+    if is_numeric_string(value):
+        value = convert_to_number(value)
+
+    # Check if increment/decrement postfix is used in the key and remove it from the key
+    increment = None
+    if key[-1] == "+" or key[-1] == "-":
+        increment = key[-1]
+        key = key[:-1]
+
+    # Buffer the update if it comes from a sensor and the write-behind mode is enabled
+    if SENSOR_WRITE_BEHIND and api_key == API_KEY_SENSOR and not sharded_counters.is_sharded(key):
+        try:
+            updated_value = sensor_write_buffer.update(item_id, key, value, increment)
+        except ValueError as e:
+            return str(e), 400
+
+        # Return the updated attribute value
+        return str(updated_value), 200
+
+    doc_ref = db.collection("items").document(item_id)
+
+    if increment is not None:
+        # Check if the value is int or float
+        if not isinstance(value, (int, float)):
+            return "Invalid attribute (value should be a number to increment/decrement)", 400
 
-        doc_ref = db.collection("items").document(item_id)
         item = doc_ref.get(retry=custom_retry)
         if item.exists == False:
-            raise ValueError("Invalid item_id")
+            return "Invalid item_id", 400
 
-        # Convert the value to an integer or a float if the value is a number
-        if is_numeric_string(value):
-            value = convert_to_number(value)
+        # Get the current value of the attribute
+        current_value = item.to_dict()["attributes"].get(key)
 
-        # Check if increment/decrement postfix is used in the key
-        if key[-1] == "+" or key[-1] == "-":
-            # Check if the value is int or float
-            if not isinstance(value, (int, float)):
-                raise ValueError("Invalid attribute (value should be a number to increment/decrement)")
+        # Check if the current value is a number
+        if current_value is None or not isinstance(current_value, (int, float)):
+            return "Invalid attribute (current value should be a number to increment/decrement)", 400
 
-            # Get the current value of the attribute
-            current_value = item.to_dict()["attributes"][key[:-1]]
+        # Increment/decrement the value with an atomic transform instead of a transaction so that concurrent
+        # increments of the same item don't abort each other
+        # Note: The type of the value preserved (int or float)
+        delta = int(value) if isinstance(current_value, int) else float(value)
+        if increment == "-":
+            delta = -delta
+        if sharded_counters.is_sharded(key):
+            current_value = sharded_counters.apply(item_id, {key: current_value})[key]
+            batch = db.batch()
+            sharded_counters.increment(batch, item_id, key, delta)
+            batch.commit(retry=custom_retry)
 
-            # Check if the current value is a number
-            if current_value is None or not isinstance(current_value, (int, float)):
-                raise ValueError("Invalid attribute (current value should be a number to increment/decrement)")
+            # Return the updated attribute value as seen by this request (approximate, since the other shards may
+            # have changed since they were read)
+            return str(current_value + delta), 200
 
-            # Increment/decrement the value
-            # Note: The type of the value preserved (int or float)
-            if key[-1] == "+":
-                if isinstance(current_value, int):
-                    value = current_value + int(value)
-                else:
-                    value = current_value + float(value)
-            else:
-                if isinstance(current_value, int):
-                    value = current_value - int(value)
-                else:
-                    value = current_value - float(value)
+        write_result = doc_ref.update({f"attributes.{key}": firestore.Increment(delta)}, retry=custom_retry)
+        item_cache.invalidate(item_id)
+
+        # Return the value after the increment, as returned by Firestore (including concurrent increments)
+        result = write_result.transform_results[0]
+        return str(result.integer_value if "integer_value" in result else result.double_value), 200
 
-            # Remove the postfix from the key
-            key = key[:-1]
+    # Create a transaction
+    transaction = db.transaction()
+
+    # Use a transaction to update the attribute of the item document in Firestore
+    @transactional
+    def update_transaction(transaction):
+        item = doc_ref.get(retry=custom_retry)
+        if item.exists == False:
+            raise ValueError("Invalid item_id")
 
-        # Update the attribute of the item document in Firestore
+        # Update the attribute of the item document in Firestore (and clear its counter shards)
         transaction.update(doc_ref, {f"attributes.{key}": value})
+        if sharded_counters.is_sharded(key):
+            sharded_counters.reset(transaction, item_id, key)
 
         # Return the updated attribute value
         return str(value)
@@ -1274,6 +2287,7 @@ def update_attribute():
         updated_value = update_transaction(transaction)
     except ValueError as e:
         return str(e), 400
+    item_cache.invalidate(item_id)
 
     # Return the updated attribute value
     return updated_value, 200
@@ -1289,29 +2303,42 @@ def get_attribute():
 
     - item_id (string): The id of the item.
     - attribute (string): The attribute of the item.
+    - format (string): The format of the response, csv, binary, ndjson or json (optional, default is csv, or the format of the Accept header: application/octet-stream, application/x-ndjson or application/json if it does not include */* or text/*).
     - api_key (string): The API key for the user (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR).
 
     Response
 
-    - item_status (string): The value of the attribute.
-    - status code (integer): HTTP status code.
+    - item_status (string): The value of the attribute. In the binary format, the value is a type tag followed by the typed value (see binary_format.py). In the JSON formats, the value is a JSON value (e.g., 21.5 or "on").
+    - status code (integer): HTTP status code (304 Not Modified without a body if the If-None-Match header matches the ETag of the response).
     """
     # Extract parameters from the request
     item_id = request.args.get("item_id")
     attribute = request.args.get("attribute")
+    format = response_format()
     api_key = request.args.get("api_key")
 
     # Check if the API key is valid
     if api_key not in [API_KEY_DESIGNER, API_KEY_PLAYER, API_KEY_ACTUATOR]:
         return "Invalid API key (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR)", 400
 
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(), 400
+    to_value = value_formatter(format)
+    mimetype = response_mimetype(format)
+
     # Check if the item_id is valid
     if item_id == None or item_id == "":
         return "Invalid item_id", 400
 
-    # Get the item document from Firestore
-    doc_ref = db.collection("items").document(item_id)
-    item = doc_ref.get(retry=custom_retry)
+    # Return the buffered value if a sensor update has not been written yet
+    if SENSOR_WRITE_BEHIND:
+        found, value = sensor_write_buffer.get(item_id, attribute)
+        if found:
+            return conditional_response(lambda: to_value(value), mimetype=mimetype)
+
+    # Get the item document from the cache or Firestore
+    item = item_cache.get(item_id, retry=custom_retry)
 
     # Check if the item exists
     if not item.exists:
@@ -1321,8 +2348,279 @@ def get_attribute():
     if attribute not in item.to_dict()["attributes"]:
         return "Invalid attribute (attribute does not exist)", 400
 
+    # Return the value of the attribute (including the counter shards if the attribute is sharded) with an ETag derived
+    # from the update time of the item
+    if sharded_counters.is_sharded(attribute):
+        value = sharded_counters.apply(item_id, item.to_dict()["attributes"])[attribute]
+        return conditional_response(lambda: to_value(value), mimetype=mimetype)
+    value = item.to_dict()["attributes"][attribute]
+    return conditional_response(lambda: to_value(value), [item_id, attribute, item.update_time], mimetype)
+
+
+@app.route("/get_attributes", methods=["GET"])
+@handle_firestore_errors
+def get_attributes():
+    """
+    Allows a player or an actuator to read attributes of multiple items at once.
+
+    Parameters
+
+    - item_ids (string): The ids of the items (comma-separated).
+    - attributes (string): The attributes to read (comma-separated, e.g., "temperature,votes").
+    - format (string): The format of the response, csv, ndjson or json (optional, default is csv, or the format of the Accept header: application/x-ndjson or application/json if it does not include */* or text/*).
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR).
+
+    Response
+
+    - attributes (string): A table in CSV format. The first line is the header (item_id followed by the attributes), and each following line has the values of an item in the order of item_ids. If an item doesn't have an attribute, the value will be "null". In the JSON formats, each item is an object (id, attributes) with typed values, one per line (ndjson) or in an array (json).
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    item_ids = request.args.get("item_ids")
+    attributes = request.args.get("attributes")
+    format = response_format(TEXT_FORMATS)
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key not in [API_KEY_DESIGNER, API_KEY_PLAYER, API_KEY_ACTUATOR]:
+        return "Invalid API key (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR)", 400
+
+    # Check if the format is valid
+    if format is None:
+        return invalid_format_message(TEXT_FORMATS), 400
+
+    # Check if the item_ids are valid (duplicates are removed, keeping the order)
+    if item_ids is None or item_ids == "":
+        return "Invalid item_ids", 400
+    item_ids = list(dict.fromkeys(item_ids.split(",")))
+    if len(item_ids) > MAX_ITEMS_PER_BULK_READ:
+        return f"Invalid item_ids (up to {MAX_ITEMS_PER_BULK_READ} items)", 400
+    for item_id in item_ids:
+        if item_id == "" or "/" in item_id:
+            return f"Invalid item_id: {item_id}", 400
+
+    # Check if the attributes are valid
+    if attributes is None or attributes == "":
+        return "Invalid attributes", 400
+    attributes = list(dict.fromkeys(attributes.split(",")))
+
+    # Get all the item documents from the cache, reading the others and the shards of the requested sharded counters
+    # (if any) from Firestore with a single batched read. The items are read in full rather than projected to the
+    # attributes field, since Firestore bills a read per document either way and full documents can fill the item
+    # cache for the next get_item, get_attribute, and get_attributes requests.
+    shard_refs = []
+    if any(sharded_counters.is_sharded(attribute) for attribute in attributes):
+        shard_refs = sharded_counters.shard_refs(item_ids)
+    items, shards = item_cache.get_all_with(item_ids, shard_refs, retry=custom_retry)
+    shard_totals = sharded_counters.sum_shards(shards)
+
+    # Create a table of the attributes (one row per item)
+    rows = []
+    for item_id in item_ids:
+        item = items.get(item_id)
+        if item is None or not item.exists:
+            return f"Invalid item_id (item does not exist): {item_id}", 400
+
+        item_attributes = item.to_dict().get("attributes") or {}
+        if len(shard_refs) > 0:
+            item_attributes = sharded_counters.apply(item_id, item_attributes, shard_totals.get(item_id, {}))
+
+        values, csv_values = {}, []
+        for attribute in attributes:
+            # Use the buffered value if a sensor update has not been written yet
+            found, value = False, None
+            if SENSOR_WRITE_BEHIND:
+                found, value = sensor_write_buffer.get(item_id, attribute)
+            if not found:
+                found, value = attribute in item_attributes, item_attributes.get(attribute)
+            values[attribute] = value if found else None
+            csv_values.append(str(value) if found else "null")
+        rows.append((item_id, values, csv_values))
+
+    # Return the table in JSON if requested
+    if format != "csv":
+        chunks = [to_json({"id": item_id, "attributes": values}, format) for item_id, values, _ in rows]
+        body = b"[" + b",".join(chunks) + b"]" if format == "json" else b"".join(chunks)
+        return Response(body, mimetype=response_mimetype(format))
+
+    # Return the table in CSV format
+    csv_lines = [",".join(["item_id"] + attributes)]
+    for item_id, _, csv_values in rows:
+        csv_lines.append(",".join([item_id] + csv_values))
+    return "\n".join(csv_lines) + "\n", 200
+
+
+@app.route("/get_cache_stats", methods=["GET"])
+def get_cache_stats():
+    """
+    Allows a designer to check the statistics of the item cache of the worker process that handles the request.
+
+    Parameters
+
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+
+    Response
+
+    - stats (string): The statistics in CSV format (hits, misses, evictions, size). size is the number of cached items.
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key != API_KEY_DESIGNER:
+        return "Invalid API key", 400
+
+    # Return the statistics in CSV format
+    stats = item_cache.stats()
+    return f"{stats['hits']},{stats['misses']},{stats['evictions']},{stats['size']}", 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Allows a monitoring system (e.g., Prometheus) to collect the metrics of the server: the number of requests per endpoint and status code, the latency histogram of each endpoint, and the number of Firestore documents read and written, queries, transaction retries and DeadlineExceeded errors per endpoint.
+
+    Parameters
+
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER).
+
+    Response
+
+    - metrics (string): The metrics in the Prometheus text format, merged across the worker processes if PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it). Firestore operations made outside of a request (e.g., by jobs and listeners) are counted under the endpoint "background".
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key != API_KEY_DESIGNER:
+        return "Invalid API key", 400
+
+    # Check if the metrics are enabled
+    if not METRICS:
+        return "Metrics are disabled (set METRICS to true)", 400
+
+    # Return the metrics in the Prometheus text format
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+@app.route("/watch_attribute", methods=["GET"])
+@handle_firestore_errors
+def watch_attribute():
+    """
+    Allows a player or an actuator to wait for a change of an attribute of an item instead of polling get_attribute.
+
+    Parameters
+
+    - item_id (string): The id of the item.
+    - attribute (string): The attribute of the item.
+    - value (string): The last value known to the client (optional). If specified, the response is sent when the value of the attribute differs from it, or when the timeout expires. Otherwise, the current value is returned immediately.
+    - timeout (float): The maximum time to wait for a change in seconds (optional, default is 25, up to 60).
+    - stream (string): Set to "true" to receive every change as Server-Sent Events (text/event-stream) instead of a single response (optional).
+    - api_key (string): The API key for the user (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR).
+
+    Response
+
+    - item_status (string): The value of the attribute (the current value if it didn't change before the timeout). In the stream mode, each event has the value of the attribute in the data field.
+    - status code (integer): HTTP status code.
+    """
+    # Extract parameters from the request
+    item_id = request.args.get("item_id")
+    attribute = request.args.get("attribute")
+    value = request.args.get("value")
+    timeout = request.args.get("timeout")
+    stream = request.args.get("stream", "false")
+    api_key = request.args.get("api_key")
+
+    # Check if the API key is valid
+    if api_key not in [API_KEY_DESIGNER, API_KEY_PLAYER, API_KEY_ACTUATOR]:
+        return "Invalid API key (should be API_KEY_DESIGNER or API_KEY_PLAYER or API_KEY_ACTUATOR)", 400
+
+    # Check if the item_id is valid
+    if item_id == None or item_id == "" or "/" in item_id:
+        return "Invalid item_id", 400
+
+    # Check if the attribute is valid
+    if attribute == None or attribute == "":
+        return "Invalid attribute", 400
+
+    # Check if the timeout is valid
+    if timeout is None:
+        timeout = WATCH_DEFAULT_TIMEOUT
+    else:
+        try:
+            timeout = float(timeout)
+        except ValueError:
+            return "Invalid timeout (must be a number)", 400
+        if timeout < 0 or timeout > WATCH_MAX_TIMEOUT:
+            return f"Invalid timeout (must be between 0 and {WATCH_MAX_TIMEOUT})", 400
+
+    def attribute_of(item_data):
+        # Get the value of the attribute as a string (None if the item or the attribute does not exist)
+        if item_data is None or attribute not in (item_data.get("attributes") or {}):
+            return None
+        return str(item_data["attributes"][attribute])
+
+    def generate_events(last_value):
+        # Send the current value, then every change until the item or the attribute is deleted or the client leaves
+        yield f"data: {last_value}\n\n"
+        while True:
+            _, item_data = item_watch_hub.wait(
+                item_id, lambda item_data: attribute_of(item_data) != last_value, timeout=WATCH_KEEP_ALIVE_INTERVAL
+            )
+            current_value = attribute_of(item_data)
+            if current_value == last_value:
+                # Send a comment to keep the connection open (and to notice that the client left)
+                yield ": keep-alive\n\n"
+            elif current_value is None:
+                yield "event: error\ndata: Invalid item_id or attribute\n\n"
+                return
+            else:
+                last_value = current_value
+                yield f"data: {last_value}\n\n"
+
+    # Subscribe to the item (the event stream unsubscribes when the response is closed)
+    item_watch_hub.subscribe(item_id)
+    streaming = False
+    try:
+        # Wait for the first snapshot to check if the item and the attribute exist
+        loaded, item_data = item_watch_hub.wait(item_id, lambda item_data: True, timeout=WATCH_MAX_TIMEOUT)
+        if not loaded:
+            return "Timeout error occurred while watching the item", 500
+        if item_data is None:
+            return "Invalid item_id", 400
+        if attribute_of(item_data) is None:
+            return "Invalid attribute (attribute does not exist)", 400
+
+        if stream == "true":
+            response = Response(
+                stream_with_context(generate_events(attribute_of(item_data))),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+            response.call_on_close(lambda: item_watch_hub.unsubscribe(item_id))
+            streaming = True
+            return response
+
+        # Wait until the value differs from the value known to the client
+        if value is not None:
+            _, item_data = item_watch_hub.wait(
+                item_id, lambda item_data: attribute_of(item_data) != value, timeout=timeout
+            )
+    finally:
+        if not streaming:
+            item_watch_hub.unsubscribe(item_id)
+
+    # Check if the item or the attribute was deleted while waiting
+    if item_data is None:
+        return "Invalid item_id", 400
+    if attribute_of(item_data) is None:
+        return "Invalid attribute (attribute does not exist)", 400
+
     # Return the value of the attribute
-    return str(item.to_dict()["attributes"][attribute]), 200
+    return attribute_of(item_data), 200
 
 
 if __name__ == "__main__":
@@ -0,0 +1,508 @@
+# import necessary libraries
+import bisect
+import math
+
+import numpy as np
+
+# This module provides the spatial indexes used to answer radius queries of list_items without scanning every item
+# in a location: a uniform grid for INDOOR locations (x, y, z in meters) and a geohash index for OUTDOOR locations
+# (latitude and longitude in degrees).
+
+# Earth's radius in meters
+EARTH_RADIUS = 6371000
+
+# The length of one degree of latitude in meters
+METERS_PER_DEGREE = 2 * math.pi * EARTH_RADIUS / 360
+
+# The alphabet used by geohashes
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# The number of characters of the geohashes stored in OUTDOOR items (a cell is about 4.8 m x 4.8 m)
+GEOHASH_PRECISION = 9
+
+# The largest radius in meters for which a bounding box is used to skip items before calculating distances
+BOUNDING_BOX_MAX_RADIUS = 1000000
+
+
+def calculate_distance_for_outdoor(lat1, lon1, lat2, lon2):
+    """
+    Calculates the distance in meters between two sets of (lat, lon) coordinates.
+    """
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) * math.sin(dlat / 2) + math.cos(math.radians(lat1)) * math.cos(
+        math.radians(lat2)
+    ) * math.sin(dlon / 2) * math.sin(dlon / 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    distance = EARTH_RADIUS * c
+    return distance
+
+
+def calculate_distance_for_indoor(x1, y1, z1, x2, y2, z2):
+    """
+    Calculates the distance in meters between two sets of (x, y, z) coordinates.
+    """
+    distance = math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2 + (z2 - z1) ** 2)
+    return distance
+
+
+def calculate_distances_for_outdoor(coordinates, lat, lon):
+    """
+    Calculates the distances in meters between many (lat, lon) coordinates and a single point in one pass.
+
+    Parameters
+
+    - coordinates (ndarray): An array of shape (n, 2) of latitudes and longitudes in degrees.
+    - lat (float): The latitude of the point in degrees.
+    - lon (float): The longitude of the point in degrees.
+
+    Returns
+
+    - An array of n distances in meters.
+    """
+    lat1 = math.radians(lat)
+    lat2 = np.radians(coordinates[:, 0])
+    dlat = lat2 - lat1
+    dlon = np.radians(coordinates[:, 1] - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def calculate_distances_for_indoor(coordinates, x, y, z):
+    """
+    Calculates the distances in meters between many (x, y, z) coordinates and a single point in one pass.
+
+    Parameters
+
+    - coordinates (ndarray): An array of shape (n, 3) of x, y, z coordinates.
+    - x, y, z (float): The coordinates of the point.
+
+    Returns
+
+    - An array of n distances in meters.
+    """
+    return np.sqrt(
+        (coordinates[:, 0] - x) ** 2 + (coordinates[:, 1] - y) ** 2 + (coordinates[:, 2] - z) ** 2
+    )
+
+
+def find_within_radius_for_outdoor(coordinates, lat, lon, radius):
+    """
+    Find the (lat, lon) coordinates within a radius of a point. For small radii, the coordinates outside a bounding
+    box are skipped before calculating distances.
+
+    Parameters
+
+    - coordinates (ndarray): An array of shape (n, 2) of latitudes and longitudes in degrees.
+    - lat (float): The latitude of the point in degrees.
+    - lon (float): The longitude of the point in degrees.
+    - radius (float): The radius in meters.
+
+    Returns
+
+    - An array of the row numbers of the coordinates within the radius.
+    """
+    rows = np.arange(len(coordinates))
+    if radius <= BOUNDING_BOX_MAX_RADIUS:
+        min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+        inside = (coordinates[:, 0] >= min_lat) & (coordinates[:, 0] <= max_lat)
+        if max_lon - min_lon < 360.0:
+            # Measure the longitudes from the west edge of the box so that boxes across the antimeridian also work
+            inside &= (coordinates[:, 1] - min_lon) % 360.0 <= max_lon - min_lon
+        rows = rows[inside]
+    distances = calculate_distances_for_outdoor(coordinates[rows], lat, lon)
+    return rows[distances <= radius]
+
+
+def find_within_radius_for_indoor(coordinates, x, y, z, radius):
+    """
+    Find the (x, y, z) coordinates within a radius of a point.
+
+    Parameters
+
+    - coordinates (ndarray): An array of shape (n, 3) of x, y, z coordinates.
+    - x, y, z (float): The coordinates of the point.
+    - radius (float): The radius in meters.
+
+    Returns
+
+    - An array of the row numbers of the coordinates within the radius.
+    """
+    distances = calculate_distances_for_indoor(coordinates, x, y, z)
+    return np.nonzero(distances <= radius)[0]
+
+
+def is_valid_coordinates(coordinates, length):
+    """
+    Check if the coordinates of an item are a list of finite numbers of the given length.
+
+    Parameters
+
+    - coordinates (any): The coordinates to check.
+    - length (integer): The expected length (3 for INDOOR locations, 2 for OUTDOOR locations).
+
+    Returns
+
+    - True if the coordinates are valid, False otherwise.
+    """
+    return (
+        isinstance(coordinates, list)
+        and len(coordinates) == length
+        and all(isinstance(c, (int, float)) and not isinstance(c, bool) and math.isfinite(c) for c in coordinates)
+    )
+
+
+def geohash_encode(lat, lon, precision):
+    """
+    Encode a latitude and longitude as a geohash.
+
+    Parameters
+
+    - lat (float): The latitude in degrees.
+    - lon (float): The longitude in degrees.
+    - precision (integer): The number of characters of the geohash.
+
+    Returns
+
+    - The geohash (string).
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        # Even bits refine the longitude and odd bits refine the latitude
+        value, value_range = (lon, lon_range) if even else (lat, lat_range)
+        middle = (value_range[0] + value_range[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            value_range[0] = middle
+        else:
+            bits = bits << 1
+            value_range[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+
+def geohash_cell_size(precision):
+    """
+    Get the size of a geohash cell in degrees.
+
+    Parameters
+
+    - precision (integer): The number of characters of the geohash.
+
+    Returns
+
+    - A tuple (height, width) in degrees of latitude and longitude.
+    """
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2**lat_bits, 360.0 / 2**lon_bits
+
+
+def bounding_box(lat, lon, radius):
+    """
+    Get a latitude/longitude box that contains every point within a radius of a center point.
+
+    Parameters
+
+    - lat (float): The latitude of the center in degrees.
+    - lon (float): The longitude of the center in degrees.
+    - radius (float): The radius in meters.
+
+    Returns
+
+    - A tuple (min_lat, max_lat, min_lon, max_lon) in degrees. The longitudes are not wrapped, so min_lon may be
+      less than -180 and max_lon may be greater than 180 near the antimeridian.
+    """
+    dlat = radius / METERS_PER_DEGREE
+    min_lat = max(lat - dlat, -90.0)
+    max_lat = min(lat + dlat, 90.0)
+
+    # The box covers all longitudes if it reaches a pole
+    cos_lat = min(math.cos(math.radians(min_lat)), math.cos(math.radians(max_lat)))
+    if min_lat <= -90.0 or max_lat >= 90.0 or cos_lat <= 0:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = radius / (METERS_PER_DEGREE * cos_lat)
+    if dlon >= 180.0:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+def geohash_cover(lat, lon, radius, max_precision=GEOHASH_PRECISION, max_cells=16):
+    """
+    Get a set of geohash prefixes whose cells cover every point within a radius of a center point. The longest
+    prefixes that need at most max_cells cells are used.
+
+    Parameters
+
+    - lat (float): The latitude of the center in degrees.
+    - lon (float): The longitude of the center in degrees.
+    - radius (float): The radius in meters.
+    - max_precision (integer): The maximum length of the prefixes.
+    - max_cells (integer): The maximum number of prefixes.
+
+    Returns
+
+    - A sorted list of geohash prefixes, or None if even single-character prefixes need more than max_cells cells.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius)
+
+    for precision in range(max_precision, 0, -1):
+        height, width = geohash_cell_size(precision)
+        first_row = math.floor((min_lat + 90.0) / height)
+        last_row = min(math.floor((max_lat + 90.0) / height), round(180.0 / height) - 1)
+        first_column = math.floor((min_lon + 180.0) / width)
+        last_column = math.floor((max_lon + 180.0) / width)
+        if (last_row - first_row + 1) * (last_column - first_column + 1) <= max_cells:
+            break
+    else:
+        return None
+
+    # Encode the center of every cell in the box (wrapping the longitude around the antimeridian)
+    prefixes = set()
+    for row in range(first_row, last_row + 1):
+        cell_lat = (row + 0.5) * height - 90.0
+        for column in range(first_column, last_column + 1):
+            cell_lon = ((column + 0.5) * width) % 360.0 - 180.0
+            prefixes.add(geohash_encode(cell_lat, cell_lon, precision))
+    return sorted(prefixes)
+
+
+class PointStore:
+    """
+    A base class for spatial indexes that keeps the coordinates of the items in one contiguous array, so that the
+    distances to many candidates can be calculated in a single vectorized pass. Removed items are replaced by the
+    last item, so the first len(self) rows are always in use.
+    """
+
+    def __init__(self, dimensions):
+        self._ids = []
+        self._rows = {}
+        self._coordinates = np.empty((64, dimensions))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _store(self, item_id, coordinates):
+        row = len(self._ids)
+        if row == len(self._coordinates):
+            self._coordinates = np.concatenate([self._coordinates, np.empty_like(self._coordinates)])
+        self._coordinates[row] = coordinates
+        self._ids.append(item_id)
+        self._rows[item_id] = row
+
+    def _discard(self, item_id):
+        row = self._rows.pop(item_id)
+        last_id = self._ids.pop()
+        if last_id != item_id:
+            self._coordinates[row] = self._coordinates[len(self._ids)]
+            self._ids[row] = last_id
+            self._rows[last_id] = row
+
+    def _coordinates_of(self, item_id):
+        return self._coordinates[self._rows[item_id]]
+
+    def _candidate_rows(self, item_ids):
+        return np.fromiter((self._rows[item_id] for item_id in item_ids), dtype=np.intp, count=len(item_ids))
+
+
+class GridIndex(PointStore):
+    """
+    A uniform grid index of (x, y, z) positions in meters for INDOOR locations.
+    """
+
+    def __init__(self, cell_size=2.0):
+        super().__init__(3)
+        self._cell_size = cell_size
+        self._cells = {}
+
+    def _cell(self, x, y, z):
+        return (
+            math.floor(x / self._cell_size),
+            math.floor(y / self._cell_size),
+            math.floor(z / self._cell_size),
+        )
+
+    def add(self, item_id, coordinates):
+        """
+        Add or move an item.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - coordinates (list): The coordinates of the item (x, y, z).
+        """
+        self.remove(item_id)
+        x, y, z = coordinates[0], coordinates[1], coordinates[2]
+        self._store(item_id, (x, y, z))
+        self._cells.setdefault(self._cell(x, y, z), set()).add(item_id)
+
+    def load(self, items):
+        """
+        Add many items, skipping items whose coordinates are not finite x, y, z.
+
+        Parameters
+
+        - items (iterable): Pairs of (item_id, coordinates).
+        """
+        for item_id, coordinates in items:
+            if is_valid_coordinates(coordinates, 3):
+                self.add(item_id, coordinates)
+
+    def remove(self, item_id):
+        """
+        Remove an item if it is in the index.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        """
+        if item_id not in self._rows:
+            return
+        cell = self._cell(*self._coordinates_of(item_id))
+        self._discard(item_id)
+        self._cells[cell].discard(item_id)
+        if len(self._cells[cell]) == 0:
+            del self._cells[cell]
+
+    def query(self, position, radius):
+        """
+        Find the items within a radius of a position.
+
+        Parameters
+
+        - position (list): The center of the query (x, y, z).
+        - radius (float): The radius in meters.
+
+        Returns
+
+        - The list of ids of the items within the radius.
+        """
+        x, y, z = position[0], position[1], position[2]
+        low = self._cell(x - radius, y - radius, z - radius)
+        high = self._cell(x + radius, y + radius, z + radius)
+
+        # Check every item at once if the radius spans more cells than are occupied
+        cell_count = (high[0] - low[0] + 1) * (high[1] - low[1] + 1) * (high[2] - low[2] + 1)
+        if cell_count > len(self._cells):
+            rows = find_within_radius_for_indoor(self._coordinates[: len(self)], x, y, z, radius)
+            return [self._ids[row] for row in rows]
+
+        # Otherwise, only check the items in the candidate cells
+        candidates = []
+        for i in range(low[0], high[0] + 1):
+            for j in range(low[1], high[1] + 1):
+                for k in range(low[2], high[2] + 1):
+                    candidates.extend(self._cells.get((i, j, k), ()))
+        rows = self._candidate_rows(candidates)
+        found = find_within_radius_for_indoor(self._coordinates[rows], x, y, z, radius)
+        return [candidates[i] for i in found]
+
+
+class GeohashIndex(PointStore):
+    """
+    A geohash index of (latitude, longitude) positions in degrees for OUTDOOR locations. The geohashes are kept in a
+    sorted list so that the items in any geohash cell can be found with a binary search for its prefix.
+    """
+
+    def __init__(self, precision=GEOHASH_PRECISION):
+        super().__init__(2)
+        self._precision = precision
+        self._entries = []
+        self._geohashes = {}
+
+    def add(self, item_id, coordinates):
+        """
+        Add or move an item.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - coordinates (list): The coordinates of the item (latitude, longitude).
+        """
+        self.remove(item_id)
+        geohash = self._store_with_geohash(item_id, coordinates)
+        bisect.insort(self._entries, (geohash, item_id))
+
+    def _store_with_geohash(self, item_id, coordinates):
+        lat, lon = coordinates[0], coordinates[1]
+        geohash = geohash_encode(lat, lon, self._precision)
+        self._store(item_id, (lat, lon))
+        self._geohashes[item_id] = geohash
+        return geohash
+
+    def load(self, items):
+        """
+        Add many items, skipping items whose coordinates are not finite latitude, longitude. The entries are sorted once
+        at the end, which is much faster than adding the items one by one.
+
+        Parameters
+
+        - items (iterable): Pairs of (item_id, coordinates).
+        """
+        for item_id, coordinates in items:
+            if is_valid_coordinates(coordinates, 2):
+                self.remove(item_id)
+                geohash = self._store_with_geohash(item_id, coordinates)
+                self._entries.append((geohash, item_id))
+        self._entries.sort()
+
+    def remove(self, item_id):
+        """
+        Remove an item if it is in the index.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        """
+        geohash = self._geohashes.pop(item_id, None)
+        if geohash is None:
+            return
+        self._discard(item_id)
+        entry = (geohash, item_id)
+        index = bisect.bisect_left(self._entries, entry)
+        if index < len(self._entries) and self._entries[index] == entry:
+            del self._entries[index]
+
+    def query(self, position, radius):
+        """
+        Find the items within a radius of a position.
+
+        Parameters
+
+        - position (list): The center of the query (latitude, longitude).
+        - radius (float): The radius in meters.
+
+        Returns
+
+        - The list of ids of the items within the radius.
+        """
+        lat, lon = position[0], position[1]
+
+        # Every geohash that starts with a prefix sorts between the prefix and the prefix followed by "~"
+        ranges = []
+        prefixes = geohash_cover(lat, lon, radius, max_precision=self._precision)
+        for prefix in prefixes or []:
+            start = bisect.bisect_left(self._entries, (prefix,))
+            end = bisect.bisect_left(self._entries, (prefix + "~",))
+            ranges.append((start, end))
+
+        # Check every item at once if the radius needs too many cells or the cells contain most of the items
+        if prefixes is None or sum(end - start for start, end in ranges) * 2 > len(self):
+            rows = find_within_radius_for_outdoor(self._coordinates[: len(self)], lat, lon, radius)
+            return [self._ids[row] for row in rows]
+
+        # Otherwise, only check the items in the covering cells
+        candidates = [item_id for start, end in ranges for _, item_id in self._entries[start:end]]
+        rows = self._candidate_rows(candidates)
+        found = find_within_radius_for_outdoor(self._coordinates[rows], lat, lon, radius)
+        return [candidates[i] for i in found]
@@ -0,0 +1,722 @@
+# import necessary libraries
+import copy
+import queue
+import threading
+import uuid
+from datetime import datetime, timezone
+from functools import wraps
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.types import Value, WriteResult
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+# This module provides an in-process storage engine that mimics the subset of the Cloud Firestore client API used by
+# server.py (collections, documents, where-queries, transactions, batched writes and document snapshot listeners).
+# Select it by setting the STORAGE_BACKEND environment variable to "memory". Data lives in the memory of each worker
+# process and is lost when the process exits, so use it for local development, load tests and edge deployments with a
+# single worker.
+
+
+def get_field(data, field_path):
+    """
+    Get the value of a (possibly dotted) field path from a document dictionary.
+
+    Parameters
+
+    - data (dict): The document data.
+    - field_path (string): The field path (e.g., "attributes.color").
+
+    Returns
+
+    - A tuple (found, value). found is False if any part of the path is missing.
+    """
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return False, None
+        value = value[part]
+    return True, value
+
+
+def set_field(data, field_path, value):
+    """
+    Set the value of a (possibly dotted) field path in a document dictionary, creating intermediate maps as needed.
+
+    Parameters
+
+    - data (dict): The document data (modified in place).
+    - field_path (string): The field path (e.g., "attributes.color").
+    - value (any): The new value.
+    """
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    data[parts[-1]] = value
+
+
+def delete_field(data, field_path):
+    """
+    Delete a (possibly dotted) field path from a document dictionary if it exists.
+
+    Parameters
+
+    - data (dict): The document data (modified in place).
+    - field_path (string): The field path (e.g., "attributes.color").
+    """
+    parts = field_path.split(".")
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            return
+        data = data[part]
+    data.pop(parts[-1], None)
+
+
+def merge_fields(target, source):
+    """
+    Recursively merge the source dictionary into the target dictionary (same semantics as set(..., merge=True)).
+
+    Parameters
+
+    - target (dict): The dictionary to merge into (modified in place).
+    - source (dict): The dictionary to merge from.
+    """
+    for key, value in source.items():
+        if isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            merge_fields(target[key], value)
+        elif value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, firestore.Increment):
+            current = target.get(key)
+            if isinstance(current, (int, float)) and not isinstance(current, bool):
+                target[key] = current + value.value
+            else:
+                target[key] = value.value
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+def project_fields(data, field_paths):
+    """
+    Return a new dictionary that only contains the given field paths (same semantics as select()).
+
+    Parameters
+
+    - data (dict): The document data.
+    - field_paths (list): The field paths to keep.
+
+    Returns
+
+    - The projected document data.
+    """
+    projected = {}
+    for field_path in field_paths:
+        found, value = get_field(data, field_path)
+        if found:
+            set_field(projected, field_path, value)
+    return projected
+
+
+def apply_value(data, field_path, value):
+    """
+    Apply a value that may be a Firestore sentinel (DELETE_FIELD) or transform (Increment) to a field path.
+
+    Parameters
+
+    - data (dict): The document data (modified in place).
+    - field_path (string): The field path.
+    - value (any): The new value, a sentinel, or a transform.
+    """
+    if value is firestore.DELETE_FIELD:
+        delete_field(data, field_path)
+    elif isinstance(value, firestore.Increment):
+        # Like Firestore, a missing or non-numeric field is replaced by the increment
+        found, current = get_field(data, field_path)
+        if found and isinstance(current, (int, float)) and not isinstance(current, bool):
+            set_field(data, field_path, current + value.value)
+        else:
+            set_field(data, field_path, value.value)
+    else:
+        set_field(data, field_path, copy.deepcopy(value))
+
+
+def compare_values(a, b):
+    """
+    Compare two field values for ordering. Values of different types are ordered by type name so that mixed
+    collections can still be sorted deterministically.
+
+    Returns
+
+    - -1, 0 or 1.
+    """
+    if isinstance(a, bool) or isinstance(b, bool) or not (
+        isinstance(a, (int, float)) and isinstance(b, (int, float))
+    ):
+        if type(a) is not type(b):
+            a, b = type(a).__name__, type(b).__name__
+    if a < b:
+        return -1
+    if a > b:
+        return 1
+    return 0
+
+
+def matches_filter(data, field_path, op_string, value):
+    """
+    Check if a document matches a single where filter.
+
+    Parameters
+
+    - data (dict): The document data.
+    - field_path (string): The field path to filter on.
+    - op_string (string): The operator (==, !=, <, <=, >, >=, in, not-in, array_contains, array_contains_any).
+    - value (any): The value to compare against.
+
+    Returns
+
+    - True if the document matches the filter, False otherwise.
+    """
+    found, field_value = get_field(data, field_path)
+    if not found:
+        return False
+    if op_string == "==":
+        return field_value == value
+    if op_string == "!=":
+        return field_value != value
+    if op_string == "in":
+        return field_value in value
+    if op_string == "not-in":
+        return field_value not in value
+    if op_string == "array_contains":
+        return isinstance(field_value, list) and value in field_value
+    if op_string == "array_contains_any":
+        return isinstance(field_value, list) and any(v in field_value for v in value)
+    if op_string in ("<", "<=", ">", ">="):
+        try:
+            result = compare_values(field_value, value)
+        except TypeError:
+            return False
+        if op_string == "<":
+            return result < 0
+        if op_string == "<=":
+            return result <= 0
+        if op_string == ">":
+            return result > 0
+        return result >= 0
+    raise ValueError(f"Unsupported operator: {op_string}")
+
+
+class MemoryDocumentSnapshot:
+    """
+    A read-only snapshot of a document, compatible with google.cloud.firestore.DocumentSnapshot.
+    """
+
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = datetime.now(timezone.utc)
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        return copy.deepcopy(self._data)
+
+    def get(self, field_path):
+        found, value = get_field(self._data or {}, field_path)
+        if not found:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    """
+    A reference to a document in a MemoryClient, compatible with google.cloud.firestore.DocumentReference.
+    """
+
+    def __init__(self, client, collection_id, document_id):
+        self._client = client
+        self._collection_id = collection_id
+        self.id = document_id
+
+    @property
+    def path(self):
+        return f"{self._collection_id}/{self.id}"
+
+    @property
+    def parent(self):
+        return self._client.collection(self._collection_id)
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def get(self, field_paths=None, transaction=None, retry=None, timeout=None):
+        return self._client._get_snapshot(self, field_paths)
+
+    def create(self, document_data, retry=None, timeout=None):
+        self._client._commit([("create", self, document_data, None)])
+
+    def set(self, document_data, merge=False, retry=None, timeout=None):
+        self._client._commit([("set", self, document_data, merge)])
+
+    def update(self, field_updates, option=None, retry=None, timeout=None):
+        staged = self._client._commit([("update", self, field_updates, None)])
+        return self._client._update_result(self, field_updates, staged)
+
+    def delete(self, option=None, retry=None, timeout=None):
+        self._client._commit([("delete", self, None, None)])
+
+    def on_snapshot(self, callback):
+        return self._client._add_watch(self, callback)
+
+
+class MemoryQuery:
+    """
+    A query over a collection in a MemoryClient, compatible with the subset of google.cloud.firestore.Query
+    used by server.py. Queries are immutable; every method returns a new query.
+    """
+
+    def __init__(self, client, collection_id, filters=(), orders=(), limit=None, start_after=None, projection=None):
+        self._client = client
+        self._collection_id = collection_id
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._projection = projection
+
+    def _copy(self, **kwargs):
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "start_after": self._start_after,
+            "projection": self._projection,
+        }
+        params.update(kwargs)
+        return MemoryQuery(self._client, self._collection_id, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def stream(self, transaction=None, retry=None, timeout=None):
+        return iter(self._client._run_query(self))
+
+    def get(self, transaction=None, retry=None, timeout=None):
+        return self._client._run_query(self)
+
+    def on_snapshot(self, callback):
+        return self._client._add_watch(self, callback)
+
+
+class MemoryCollectionReference(MemoryQuery):
+    """
+    A reference to a collection in a MemoryClient, compatible with google.cloud.firestore.CollectionReference.
+    """
+
+    def __init__(self, client, collection_id):
+        super().__init__(client, collection_id)
+        self.id = collection_id
+
+    def document(self, document_id=None):
+        if document_id is None:
+            document_id = uuid.uuid4().hex
+        return MemoryDocumentReference(self._client, self._collection_id, document_id)
+
+    def list_documents(self, page_size=None):
+        with self._client._lock:
+            document_ids = list(self._client._collections.get(self._collection_id, {}))
+        return [self.document(document_id) for document_id in document_ids]
+
+
+class MemoryWriteBatch:
+    """
+    A batch of writes that are applied atomically on commit(), compatible with google.cloud.firestore.WriteBatch.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def create(self, reference, document_data):
+        self._writes.append(("create", reference, document_data, None))
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(("set", reference, document_data, merge))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(("update", reference, field_updates, None))
+
+    def delete(self, reference, option=None):
+        self._writes.append(("delete", reference, None, None))
+
+    def commit(self, retry=None, timeout=None):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    A transaction, compatible with google.cloud.firestore.Transaction. Use it with the transactional decorator
+    of this module. The transactional function runs while holding the client lock, so transactions are serialized.
+    """
+
+    def get(self, ref_or_query, retry=None, timeout=None):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return ref_or_query.get()
+        return ref_or_query.stream()
+
+    def get_all(self, references, retry=None, timeout=None):
+        return self._client.get_all(references)
+
+
+class MemoryWatch:
+    """
+    A snapshot listener of a document or a query in a MemoryClient, compatible with
+    google.cloud.firestore_v1.watch.Watch.
+
+    Like Firestore, the callback runs on a background thread, first when the listener starts and then after each
+    change. For a document, it receives a list with the snapshot of the document (empty if the document does not
+    exist). For a query, it receives the snapshots of all matching documents and the list of changes since the last
+    call.
+    """
+
+    def __init__(self, client, target, callback):
+        self._client = client
+        self.target = target
+        self._callback = callback
+        self.is_active = True
+
+        # The update times of the documents last sent to a query listener (None before the first call)
+        self._update_times = None
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._remove_watch(self)
+
+
+def transactional(to_wrap):
+    """
+    Decorate a transactional function so that it runs with either a Firestore transaction or a MemoryTransaction.
+
+    Parameters
+
+    - to_wrap (function): The function to run in a transaction. Its first argument is the transaction.
+
+    Returns
+
+    - The decorated function.
+    """
+    firestore_wrapped = firestore.transactional(to_wrap)
+
+    @wraps(to_wrap)
+    def wrapper(transaction, *args, **kwargs):
+        # Check the transaction itself if it is wrapped (e.g., by instrumentation.py)
+        memory_transaction = getattr(transaction, "wrapped", transaction)
+        if not isinstance(memory_transaction, MemoryTransaction):
+            return firestore_wrapped(transaction, *args, **kwargs)
+
+        # Run the function under the client lock and commit the buffered writes only if it succeeds
+        with memory_transaction._client._lock:
+            memory_transaction._writes = []
+            try:
+                result = to_wrap(transaction, *args, **kwargs)
+            except Exception:
+                memory_transaction._writes = []
+                raise
+            transaction.commit()
+            return result
+
+    return wrapper
+
+
+class MemoryClient:
+    """
+    An in-process storage engine compatible with the subset of google.cloud.firestore.Client used by server.py.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}
+
+        # The snapshot listeners and the queue of listeners to call (run by a dispatcher thread started on first use)
+        self._watches = []
+        self._watch_queue = queue.Queue()
+        self._dispatcher = None
+
+    def collection(self, collection_id):
+        return MemoryCollectionReference(self, collection_id)
+
+    def document(self, document_path):
+        collection_id, document_id = document_path.split("/", 1)
+        return MemoryDocumentReference(self, collection_id, document_id)
+
+    def collections(self):
+        with self._lock:
+            return [self.collection(collection_id) for collection_id in self._collections]
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return MemoryTransaction(self)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None, retry=None, timeout=None):
+        with self._lock:
+            snapshots = [self._get_snapshot(reference, field_paths) for reference in references]
+        return iter(snapshots)
+
+    def close(self):
+        pass
+
+    def _add_watch(self, target, callback):
+        watch = MemoryWatch(self, target, callback)
+        with self._lock:
+            self._watches.append(watch)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="memory-watch", daemon=True)
+                self._dispatcher.start()
+        self._watch_queue.put(watch)
+        return watch
+
+    def _remove_watch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _dispatch(self):
+        while True:
+            watch = self._watch_queue.get()
+            if not watch.is_active:
+                continue
+
+            # Send the current state (changes made in the meantime are delivered together)
+            try:
+                if isinstance(watch.target, MemoryDocumentReference):
+                    snapshot = self._get_snapshot(watch.target)
+                    watch._callback([snapshot] if snapshot.exists else [], [], datetime.now(timezone.utc))
+                else:
+                    self._dispatch_query(watch)
+            except Exception as e:
+                print(f"Error occurred in a snapshot listener of {watch.target._collection_id}: {e}")
+
+    def _dispatch_query(self, watch):
+        snapshots = self._run_query(watch.target)
+        update_times = {snapshot.id: snapshot.update_time for snapshot in snapshots}
+        previous = watch._update_times
+
+        # Compare the documents with the documents last sent to find the changes
+        changes = []
+        previous_indexes = {document_id: index for index, document_id in enumerate(previous or {})}
+        collection = self.collection(watch.target._collection_id)
+        for new_index, snapshot in enumerate(snapshots):
+            if snapshot.id not in previous_indexes:
+                changes.append(DocumentChange(ChangeType.ADDED, snapshot, -1, new_index))
+            elif previous[snapshot.id] != snapshot.update_time:
+                changes.append(DocumentChange(ChangeType.MODIFIED, snapshot, previous_indexes[snapshot.id], new_index))
+        for document_id, old_index in previous_indexes.items():
+            if document_id not in update_times:
+                removed = MemoryDocumentSnapshot(collection.document(document_id), None)
+                changes.append(DocumentChange(ChangeType.REMOVED, removed, old_index, -1))
+
+        if previous is not None and len(changes) == 0:
+            return
+        watch._update_times = update_times
+        watch._callback(snapshots, changes, datetime.now(timezone.utc))
+
+    def _get_snapshot(self, reference, field_paths=None):
+        with self._lock:
+            entry = self._collections.get(reference._collection_id, {}).get(reference.id)
+        if entry is None:
+            return MemoryDocumentSnapshot(reference, None)
+        data, create_time, update_time = entry
+        if field_paths is not None:
+            data = project_fields(data, field_paths)
+        return MemoryDocumentSnapshot(reference, data, create_time, update_time)
+
+    def _run_query(self, query):
+        with self._lock:
+            documents = list(self._collections.get(query._collection_id, {}).items())
+
+        # Apply the where filters
+        for field_path, op_string, value in query._filters:
+            documents = [(i, e) for i, e in documents if matches_filter(e[0], field_path, op_string, value)]
+
+        # Apply the ordering (documents without an ordered field are excluded, ties are broken by document id)
+        documents.sort(key=lambda document: document[0])
+        for field_path, direction in reversed(query._orders):
+            if field_path == "__name__":
+                documents.sort(key=lambda document: document[0], reverse=direction == firestore.Query.DESCENDING)
+                continue
+            documents = [(i, e) for i, e in documents if get_field(e[0], field_path)[0]]
+            documents.sort(
+                key=_OrderKey.factory(field_path),
+                reverse=direction == firestore.Query.DESCENDING,
+            )
+
+        # Skip the documents up to and including the cursor
+        if query._start_after is not None:
+            documents = documents[self._cursor_offset(query, documents) :]
+
+        # Apply the limit
+        if query._limit is not None:
+            documents = documents[: query._limit]
+
+        collection = self.collection(query._collection_id)
+        snapshots = []
+        for document_id, (data, create_time, update_time) in documents:
+            if query._projection is not None:
+                data = project_fields(data, query._projection)
+            snapshots.append(MemoryDocumentSnapshot(collection.document(document_id), data, create_time, update_time))
+        return snapshots
+
+    def _cursor_offset(self, query, documents):
+        cursor = query._start_after
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            cursor_id = cursor.id
+            cursor = cursor._data or {}
+        else:
+            cursor_id = cursor.get("__name__") if isinstance(cursor, dict) else None
+            if isinstance(cursor_id, MemoryDocumentReference):
+                cursor_id = cursor_id.id
+
+        # Compare the ordered fields (and finally the document id) to find the first document after the cursor
+        for index, (document_id, (data, _, _)) in enumerate(documents):
+            for field_path, direction in query._orders:
+                if field_path == "__name__":
+                    result = compare_values(document_id, cursor_id)
+                else:
+                    result = compare_values(get_field(data, field_path)[1], get_field(cursor, field_path)[1])
+                if direction == firestore.Query.DESCENDING:
+                    result = -result
+                if result != 0:
+                    break
+            else:
+                result = 0 if cursor_id is None else compare_values(document_id, cursor_id)
+            if result > 0:
+                return index
+        return len(documents)
+
+    def _commit(self, writes):
+        with self._lock:
+            # Validate every write first so that a failing write leaves the data unchanged
+            staged = {}
+            for operation, reference, document_data, merge in writes:
+                key = (reference._collection_id, reference.id)
+                if key in staged:
+                    current = staged[key]
+                else:
+                    current = self._collections.get(reference._collection_id, {}).get(reference.id)
+                if operation == "create" and current is not None:
+                    raise AlreadyExists(f"Document already exists: {reference.path}")
+                if operation == "update" and current is None:
+                    raise NotFound(f"No document to update: {reference.path}")
+                staged[key] = self._apply_write(operation, current, document_data, merge)
+
+            # Apply the staged documents
+            for (collection_id, document_id), entry in staged.items():
+                collection = self._collections.setdefault(collection_id, {})
+                if entry is None:
+                    collection.pop(document_id, None)
+                else:
+                    collection[document_id] = entry
+
+            # Notify the snapshot listeners of the changed documents (or of the queries over their collections)
+            for watch in self._watches:
+                if isinstance(watch.target, MemoryDocumentReference):
+                    changed = (watch.target._collection_id, watch.target.id) in staged
+                else:
+                    changed = any(collection_id == watch.target._collection_id for collection_id, _ in staged)
+                if changed:
+                    self._watch_queue.put(watch)
+        return staged
+
+    def _update_result(self, reference, field_updates, staged):
+        # Build the WriteResult of an update with the values of its Increment transforms, like Firestore
+        data, _, update_time = staged[(reference._collection_id, reference.id)]
+        transform_results = []
+        for field_path, value in field_updates.items():
+            if isinstance(value, firestore.Increment):
+                result = get_field(data, field_path)[1]
+                if isinstance(result, float):
+                    transform_results.append(Value(double_value=result))
+                else:
+                    transform_results.append(Value(integer_value=result))
+        return WriteResult(update_time=update_time, transform_results=transform_results)
+
+    def _apply_write(self, operation, current, document_data, merge):
+        if operation == "delete":
+            return None
+
+        now = datetime.now(timezone.utc)
+        create_time = current[1] if current is not None else now
+
+        # Copy the current data so that existing snapshots are never modified
+        if operation in ("create", "set") and not merge:
+            data = copy.deepcopy(document_data)
+        elif operation == "set":
+            data = copy.deepcopy(current[0]) if current is not None else {}
+            merge_fields(data, document_data)
+        else:
+            data = copy.deepcopy(current[0])
+            for field_path, value in document_data.items():
+                apply_value(data, field_path, value)
+        return (data, create_time, now)
+
+
+class _OrderKey:
+    """
+    A sort key that orders documents by a field using compare_values.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return compare_values(self.value, other.value) < 0
+
+    @staticmethod
+    def factory(field_path):
+        return lambda document: _OrderKey(get_field(document[1][0], field_path)[1])
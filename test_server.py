@@ -0,0 +1,90 @@
+# import necessary libraries
+import os
+import time
+import uuid
+
+import pytest
+
+# Run the server on the in-process storage engine (set before importing the server)
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("API_KEY_DESIGNER", "test_designer")
+os.environ.setdefault("API_KEY_PLAYER", "test_player")
+
+import server  # noqa: E402
+from spatial import GeohashIndex  # noqa: E402
+
+DESIGNER = os.environ["API_KEY_DESIGNER"]
+PLAYER = os.environ["API_KEY_PLAYER"]
+
+
+@pytest.fixture
+def client():
+    server.limiter.enabled = False
+    return server.app.test_client()
+
+
+def create_location(client, type):
+    params = {"name": f"test{uuid.uuid4().hex}", "type": type, "api_key": DESIGNER}
+    response = client.get("/create_location", query_string=params)
+    assert response.status_code == 200
+    return response.get_data(as_text=True).split(",")[1]
+
+
+def create_item(client, location_id, coordinates):
+    params = {"location_id": location_id, "name": "test", "type": "TEST", "coordinates": coordinates}
+    return client.get("/create_item", query_string={**params, "api_key": DESIGNER})
+
+
+@pytest.mark.parametrize(
+    "type, coordinates, position",
+    [("INDOOR", "inf,1,1", "0,0,0"), ("INDOOR", "1,nan,1", "0,0,0"), ("OUTDOOR", "nan,139", "35,139")],
+)
+def test_non_finite_coordinates(client, type, coordinates, position):
+    location_id = create_location(client, type)
+    valid_item = create_item(client, location_id, position)
+    assert valid_item.status_code == 200
+    valid_item_id = valid_item.get_data(as_text=True).split(",")[1]
+
+    # Non-finite coordinates are rejected by create_item, create_items and update_item
+    response = create_item(client, location_id, coordinates)
+    assert response.status_code == 400
+    body = "name,type,coordinates\n" + f'test,TEST,"{coordinates}"\n'
+    response = client.post("/create_items", query_string={"location_id": location_id, "api_key": DESIGNER}, data=body)
+    assert response.status_code == 400
+    response = client.get(
+        "/update_item", query_string={"item_id": valid_item_id, "coordinates": coordinates, "api_key": DESIGNER}
+    )
+    assert response.status_code == 400
+
+    def list_ids():
+        params = {"location_id": location_id, "position": position, "radius": 10, "api_key": PLAYER}
+        response = client.get("/list_items", query_string=params)
+        assert response.status_code == 200
+        return [line.split(",")[0] for line in response.get_data(as_text=True).splitlines()]
+
+    # Load the spatial index of the location before storing an item with non-finite coordinates directly
+    assert list_ids() == [valid_item_id]
+    stored = [float(c) for c in coordinates.split(",")]
+    item = {"location_id": location_id, "name": "stored", "owner": "PUBLIC_DOMAIN", "type": "TEST"}
+    server.db.collection("items").document().set({**item, "coordinates": stored, "attributes": None, "tags": []})
+    time.sleep(0.1)
+
+    # The item is skipped by the index updated by its listener, by a newly loaded index, and by a query-built index
+    assert list_ids() == [valid_item_id]
+    server.spatial_indexes.invalidate(location_id)
+    assert list_ids() == [valid_item_id]
+    index = server.SpatialIndexCache(server.db, use_listener=False)
+    assert index.query(location_id, type, [float(p) for p in position.split(",")], 10) == [valid_item_id]
+
+
+def test_geohash_cover_cap(client):
+    location_id = create_location(client, "OUTDOOR")
+    item_ids = [create_item(client, location_id, c).get_data(as_text=True).split(",")[1] for c in ["35,139", "-35,-50"]]
+
+    # A radius that needs more than GEOHASH_MAX_RANGES cells reads the whole location instead
+    assert server.geohash_cover(35, 139, 1e7, max_cells=server.GEOHASH_MAX_RANGES) is None
+    items = server.query_items_by_geohash(location_id, [35, 139], 2e7)
+    assert sorted(item.id for item in items) == sorted(item_ids)
+    index = GeohashIndex()
+    index.load([(item.id, item.to_dict()["coordinates"]) for item in items])
+    assert sorted(index.query([35, 139], 2e7)) == sorted(item_ids)
@@ -0,0 +1,132 @@
+# import necessary libraries
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, has_request_context, request
+
+# This module traces the Firestore operations of each request (reported by an InstrumentedClient, see
+# instrumentation.py). When a request ends, its spans are printed in order on one line of the server log, and if the
+# request was slower than the threshold, the request and its spans are appended to the slow log as a JSON line.
+
+
+class RequestTracer:
+    """
+    Collects the spans (Firestore operations) of each request and logs them when the request ends.
+
+    Parameters
+
+    - slow_threshold (float): The duration of a slow request in seconds.
+    - slow_log_path (string): The path of the slow log (JSON lines).
+    """
+
+    def __init__(self, slow_threshold=1.0, slow_log_path="slow_requests.jsonl"):
+        self._slow_threshold = slow_threshold
+        self._slow_log_path = slow_log_path
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Start and finish a trace for every request handled by a Flask application.
+
+        Parameters
+
+        - app (Flask): The application.
+        """
+
+        @app.before_request
+        def start_trace():
+            g.trace_start = time.perf_counter()
+            g.trace_spans = []
+            g.trace_retries = 0
+
+        @app.after_request
+        def record_status(response):
+            g.trace_status = response.status_code
+
+            # Finish the trace of a streamed response when the last chunk is sent, since the documents are read while
+            # streaming (the spans are still added to the same list)
+            if response.is_streamed and "trace_start" in g:
+                start, spans = g.pop("trace_start"), g.trace_spans
+                endpoint, args = request.endpoint, request.args
+                response.call_on_close(
+                    lambda: self._finish(endpoint, args, response.status_code, time.perf_counter() - start, spans)
+                )
+            return response
+
+        @app.teardown_request
+        def finish_trace(error):
+            if "trace_start" in g:
+                duration = time.perf_counter() - g.pop("trace_start")
+                self._finish(request.endpoint, request.args, g.get("trace_status", 500), duration, g.trace_spans)
+
+    def record(self, operation, collection, documents, duration, error):
+        """
+        Add a Firestore operation reported by an InstrumentedClient to the trace of the current request (operations
+        outside of a request, e.g., by jobs and listeners, are not traced).
+
+        Parameters
+
+        - operation (string): The operation (see instrumentation.py).
+        - collection (string): The collection.
+        - documents (int): The number of documents read or written.
+        - duration (float): The duration of the operation in seconds.
+        - error (Exception): The exception raised by the operation (None if it succeeded).
+        """
+        if not has_request_context() or "trace_spans" not in g:
+            return
+
+        # The retries of a call are reported before the call ends, so they belong to the next span
+        span = {
+            "operation": operation,
+            "collection": collection,
+            "documents": documents,
+            "duration_ms": round(duration * 1000, 3),
+            "retries": g.trace_retries,
+        }
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+        g.trace_retries = 0
+        g.trace_spans.append(span)
+
+    def record_retry(self, error):
+        """
+        Count a retry of the Firestore call in progress (the on_error callback of a Retry).
+
+        Parameters
+
+        - error (Exception): The error of the attempt.
+        """
+        if has_request_context() and "trace_spans" in g:
+            g.trace_retries += 1
+
+    def _finish(self, endpoint, args, status, duration, spans):
+        endpoint = endpoint or "unknown"
+
+        # Print the spans in order (e.g., "items.query 3 docs 1.2 ms")
+        summary = ", ".join(
+            (f"{span['collection']}." if span["collection"] else "")
+            + f"{span['operation']} {span['documents']} docs {span['duration_ms']:.1f} ms"
+            + (f" ({span['retries']} retries)" if span["retries"] > 0 else "")
+            + (" (error)" if "error" in span else "")
+            for span in spans
+        )
+        print(f"Trace of {endpoint}: {status}, {duration * 1000:.1f} ms, {len(spans)} Firestore calls: {summary}")
+
+        # Append the request to the slow log (without the API key)
+        if duration >= self._slow_threshold:
+            entry = {
+                "time": datetime.now(timezone.utc).isoformat(),
+                "endpoint": endpoint,
+                "args": {key: value for key, value in args.items() if key != "api_key"},
+                "status": status,
+                "duration_ms": round(duration * 1000, 3),
+                "spans": spans,
+            }
+            try:
+                with self._lock:
+                    with open(self._slow_log_path, "a") as slow_log:
+                        slow_log.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                print(f"Error occurred while writing the slow log: {e}")
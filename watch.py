@@ -0,0 +1,106 @@
+# import necessary libraries
+import threading
+import time
+
+# This module shares one snapshot listener per item document among all the requests of a worker process that watch
+# the item (e.g., actuators waiting for an attribute to change). The listener is started when the first request
+# subscribes and stopped when the last one leaves, so an idle item costs nothing and a busy item costs one document
+# read per change, regardless of the number of watchers.
+
+
+class ItemWatch:
+    """
+    The latest state of a watched item, shared by its subscribers.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.subscribers = 0
+        self.watch = None
+
+        # The latest data of the item (None if the item does not exist) and whether the first snapshot arrived
+        self.data = None
+        self.loaded = False
+
+
+class ItemWatchHub:
+    """
+    Keeps one snapshot listener per watched item document and wakes up the waiting subscribers on each change.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self._items = {}
+
+    def subscribe(self, item_id):
+        """
+        Subscribe to an item. Call unsubscribe() with the same item_id when done.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        """
+        with self._lock:
+            item_watch = self._items.get(item_id)
+
+            # Start a new listener if the item is not watched yet or its listener stopped (e.g., after an error)
+            if item_watch is not None and item_watch.watch is not None and not item_watch.watch.is_active:
+                item_watch.watch = None
+            if item_watch is None:
+                item_watch = ItemWatch()
+                self._items[item_id] = item_watch
+            if item_watch.watch is None:
+                doc_ref = self._db.collection("items").document(item_id)
+                item_watch.watch = doc_ref.on_snapshot(
+                    lambda docs, changes, read_time: self._on_snapshot(item_watch, docs)
+                )
+            item_watch.subscribers += 1
+
+    def unsubscribe(self, item_id):
+        """
+        Unsubscribe from an item and stop its listener if nobody else watches it.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        """
+        with self._lock:
+            item_watch = self._items.get(item_id)
+            if item_watch is None:
+                return
+            item_watch.subscribers -= 1
+            if item_watch.subscribers == 0:
+                del self._items[item_id]
+                item_watch.watch.unsubscribe()
+
+    def _on_snapshot(self, item_watch, docs):
+        with item_watch.condition:
+            item_watch.data = docs[0].to_dict() if len(docs) > 0 else None
+            item_watch.loaded = True
+            item_watch.condition.notify_all()
+
+    def wait(self, item_id, predicate, timeout):
+        """
+        Wait until the data of a subscribed item satisfies a condition.
+
+        Parameters
+
+        - item_id (string): The id of the item (must be subscribed).
+        - predicate (function): A function that receives the data of the item (None if the item does not exist) and
+          returns True to stop waiting.
+        - timeout (float): The maximum time to wait (in seconds).
+
+        Returns
+
+        - A tuple (loaded, data). loaded is False if the first snapshot didn't arrive before the timeout.
+        """
+        item_watch = self._items[item_id]
+        deadline = time.monotonic() + timeout
+        with item_watch.condition:
+            while not (item_watch.loaded and predicate(item_watch.data)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                item_watch.condition.wait(remaining)
+            return item_watch.loaded, item_watch.data
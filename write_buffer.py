@@ -0,0 +1,259 @@
+# import necessary libraries
+import atexit
+import threading
+import time
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+
+# This module buffers high-frequency attribute updates (e.g., from ToF and motion sensors) in memory and writes them
+# to the storage backend at a fixed interval. Updates to the same attribute of the same item are merged: the last
+# absolute value wins and increments/decrements are summed. Each worker process has its own buffer, so other workers
+# see a buffered value only after it has been written.
+
+
+def parse_policies(text):
+    """
+    Parse per-attribute policies in key=value format (e.g., "temperature=0.5,distance=10").
+
+    Parameters
+
+    - text (string): The policies (comma-separated key-value pairs, optional).
+
+    Returns
+
+    - A dictionary of attribute names to numbers.
+    """
+    if not text:
+        return {}
+    return {key: float(value) for key, value in (policy.split("=") for policy in text.split(","))}
+
+
+# A marker for an attribute that has only increments/decrements pending
+UNSET = object()
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class AttributeWriteBuffer:
+    """
+    A write-behind buffer for attribute updates.
+
+    The first update of an item in each flush interval reads the item once to check that it exists and to get the
+    current values of its attributes. Absolute values that differ from the current value by less than the deadband
+    of the attribute, or that arrive less than the minimum interval of the attribute after the last accepted value,
+    are dropped.
+    """
+
+    def __init__(self, db, flush_interval=1.0, deadbands=None, min_intervals=None, on_flush=None):
+        self._db = db
+        self._on_flush = on_flush
+        self._flush_interval = flush_interval
+        self._deadbands = deadbands or {}
+        self._min_intervals = min_intervals or {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        # The attributes read from the storage backend in the current interval (item_id -> attributes)
+        self._bases = {}
+
+        # The pending updates (item_id -> attribute -> [absolute value or UNSET, sum of increments])
+        self._pending = {}
+
+        # The time of the last accepted absolute value ((item_id, attribute) -> time)
+        self._accepted_at = {}
+
+        self._thread = None
+        atexit.register(self.flush)
+
+    def _start_thread(self):
+        # Start the flush thread on first use so that each gunicorn worker has its own thread after forking
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error occurred while flushing buffered attributes: {e}")
+
+    def _current_value(self, item_id, attribute, pending=None):
+        # Get the value of an attribute including the pending updates
+        found = attribute in self._bases[item_id]
+        value = self._bases[item_id].get(attribute)
+        pending = (pending if pending is not None else self._pending.get(item_id, {})).get(attribute)
+        if pending is not None:
+            if pending[0] is not UNSET:
+                found, value = True, pending[0]
+            if pending[1] != 0:
+                value = value + pending[1]
+        return found, value
+
+    def update(self, item_id, attribute, value, increment=None):
+        """
+        Buffer an update of an attribute.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - attribute (string): The name of the attribute.
+        - value (any): The new value, or the amount to increment/decrement by.
+        - increment (string): "+" to increment or "-" to decrement by the value (optional).
+
+        Returns
+
+        - The value of the attribute after the update (the current value if the update was dropped).
+
+        Raises
+
+        - ValueError: If the item does not exist or an increment/decrement is invalid.
+        """
+        with self._lock:
+            self._start_thread()
+
+            # Read the item once per interval
+            if item_id not in self._bases:
+                item = self._db.collection("items").document(item_id).get()
+                if not item.exists:
+                    raise ValueError("Invalid item_id")
+                self._bases[item_id] = item.to_dict().get("attributes") or {}
+
+            found, current_value = self._current_value(item_id, attribute)
+
+            if increment is not None:
+                # Check if the value and the current value are numbers
+                if not is_number(value):
+                    raise ValueError("Invalid attribute (value should be a number to increment/decrement)")
+                if not found or not is_number(current_value):
+                    raise ValueError("Invalid attribute (current value should be a number to increment/decrement)")
+
+                # Note: The type of the current value (int or float) preserved
+                delta = int(value) if isinstance(current_value, int) else float(value)
+                if increment == "-":
+                    delta = -delta
+                pending = self._pending.setdefault(item_id, {}).setdefault(attribute, [UNSET, 0])
+                pending[1] += delta
+                return current_value + delta
+
+            # Drop the value if it is within the deadband of the current value
+            deadband = self._deadbands.get(attribute)
+            if deadband is not None and found and is_number(value) and is_number(current_value):
+                if abs(value - current_value) < deadband:
+                    return current_value
+
+            # Drop the value if it arrived too soon after the last accepted value
+            min_interval = self._min_intervals.get(attribute)
+            now = time.monotonic()
+            if min_interval is not None and found:
+                accepted_at = self._accepted_at.get((item_id, attribute))
+                if accepted_at is not None and now - accepted_at < min_interval:
+                    return current_value
+
+            self._pending.setdefault(item_id, {})[attribute] = [value, 0]
+            self._accepted_at[(item_id, attribute)] = now
+            return value
+
+    def get(self, item_id, attribute):
+        """
+        Get the buffered value of an attribute.
+
+        Parameters
+
+        - item_id (string): The id of the item.
+        - attribute (string): The name of the attribute.
+
+        Returns
+
+        - A tuple (found, value). found is False if the attribute has no pending update.
+        """
+        with self._lock:
+            if attribute not in self._pending.get(item_id, {}):
+                return False, None
+            return self._current_value(item_id, attribute)
+
+    def flush(self):
+        """
+        Write the pending updates to the storage backend (one update per item, in as few batches as possible). The
+        updates that could not be written (except to deleted items) are put back into the buffer for the next flush.
+        """
+        with self._flush_lock:
+            # Take the pending updates so that the updates arriving during the writes go to the next flush
+            with self._lock:
+                pending = self._pending
+                original_bases = self._bases
+                self._pending = {}
+
+                # Until the writes are done, use the written values as the current values instead of reading the items
+                self._bases = {item_id: self._written(item_id, attributes) for item_id, attributes in pending.items()}
+                bases = dict(self._bases)
+
+            updates = []
+            for item_id, attributes in pending.items():
+                fields = {}
+                for attribute, (value, delta) in attributes.items():
+                    if value is not UNSET:
+                        fields[f"attributes.{attribute}"] = value + delta if delta != 0 else value
+                    elif delta != 0:
+                        fields[f"attributes.{attribute}"] = firestore.Increment(delta)
+                if len(fields) > 0:
+                    updates.append((self._db.collection("items").document(item_id), fields))
+
+            written = []
+            failed = []
+            for start in range(0, len(updates), 500):
+                batch = self._db.batch()
+                for doc_ref, fields in updates[start : start + 500]:
+                    batch.update(doc_ref, fields)
+                try:
+                    batch.commit()
+                    written.extend(doc_ref.id for doc_ref, _ in updates[start : start + 500])
+                except Exception:
+                    # Write the items one by one so that a deleted item does not discard the other updates
+                    for doc_ref, fields in updates[start : start + 500]:
+                        try:
+                            doc_ref.update(fields)
+                            written.append(doc_ref.id)
+                        except NotFound:
+                            print(f"Dropped buffered attributes of deleted item {doc_ref.id}")
+                        except Exception as e:
+                            print(f"Error occurred while writing buffered attributes of {doc_ref.id}: {e}")
+                            failed.append(doc_ref.id)
+
+            with self._lock:
+                # Put the failed updates back on top of the values read before them, merged with the updates that
+                # arrived in the meantime
+                for item_id in failed:
+                    self._bases[item_id] = original_bases[item_id]
+                    self._requeue(item_id, pending[item_id])
+
+                # Read the written items again on their next update (unless they have pending updates again)
+                for item_id, base in bases.items():
+                    if self._bases.get(item_id) is base and item_id not in self._pending:
+                        del self._bases[item_id]
+
+        # Notify that the items were written (e.g., to invalidate cached copies)
+        if self._on_flush is not None and len(written) > 0:
+            self._on_flush(written)
+
+    def _written(self, item_id, attributes):
+        # Get the attributes of an item after its pending updates are written
+        base = dict(self._bases[item_id])
+        for attribute in attributes:
+            found, value = self._current_value(item_id, attribute, attributes)
+            if found:
+                base[attribute] = value
+        return base
+
+    def _requeue(self, item_id, attributes):
+        # Merge updates that could not be written with the updates that arrived later (later absolute values win)
+        later = self._pending.setdefault(item_id, {})
+        for attribute, (value, delta) in attributes.items():
+            if attribute not in later:
+                later[attribute] = [value, delta]
+            elif later[attribute][0] is UNSET:
+                later[attribute] = [value, delta + later[attribute][1]]